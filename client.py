@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+Thin client for the generation server (server.py)
+Uses only the standard library so submitting a job never imports torch
+"""
+
+import json
+import time
+import urllib.error
+import urllib.request
+from typing import Dict
+
+
+def _request(url: str, payload: Dict = None) -> Dict:
+    data = json.dumps(payload).encode("utf-8") if payload is not None else None
+    req = urllib.request.Request(url, data=data, headers={"Content-Type": "application/json"})
+    try:
+        with urllib.request.urlopen(req) as response:
+            return json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        body = json.loads(e.read() or b"{}")
+        raise RuntimeError(f"Server error {e.code}: {body.get('error', e.reason)}") from e
+
+
+def submit_job(
+    server_url: str,
+    kind: str,
+    payload: Dict,
+    wait: bool = True,
+    poll_interval: float = 1.0
+) -> Dict:
+    """
+    Submit a job to a running generation server.
+
+    Args:
+        server_url: Base URL of the server (e.g. http://127.0.0.1:7860)
+        kind: "image" or "video"
+        payload: Job parameters (same names as the generator arguments)
+        wait: Block until the job finishes
+        poll_interval: Seconds between status checks while waiting
+
+    Returns:
+        Final job status dict (or the queued status if wait is False)
+    """
+    base = server_url.rstrip("/")
+    status = _request(f"{base}/api/generate/{kind}", payload)
+    print(f"Submitted {kind} job {status['jobId']} to {base}")
+    if not wait:
+        return status
+    return wait_for_job(server_url, status["jobId"], poll_interval)
+
+
+def wait_for_job(server_url: str, job_id: str, poll_interval: float = 1.0) -> Dict:
+    """Poll a job until it completes; raise if it failed."""
+    status_url = f"{server_url.rstrip('/')}/api/generate/status/{job_id}"
+    status = _request(status_url)
+    while status["status"] in ("queued", "running"):
+        time.sleep(poll_interval)
+        status = _request(status_url)
+
+    if status["status"] == "failed":
+        raise RuntimeError(f"Job {job_id} failed: {status['error']}")
+    return status
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Compile Cache
+torch.compile fast path for the UNet and VAE decoder, with inductor artifacts cached on disk per library version
+"""
+
+import json
+import os
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Dict
+
+from lazy_imports import lazy_import
+
+torch = lazy_import("torch")
+
+
+DEFAULT_COMPILE_CACHE = "./cache/compile"
+
+# Each shape bucket compiles once; allow enough of them before dynamo falls back to eager
+RECOMPILE_LIMIT = 64
+
+
+def compile_cache_key(device: str, dtype: str) -> str:
+    """Directory name for artifacts that are only valid for these library versions and this device."""
+    import diffusers
+
+    parts = [f"torch-{torch.__version__}", f"diffusers-{diffusers.__version__}", device, dtype]
+    if device == "cuda" and torch.cuda.is_available():
+        parts.append(torch.cuda.get_device_name(0))
+    return re.sub(r"[^A-Za-z0-9.+_-]+", "_", "-".join(parts))
+
+
+def bucket_key(stage: str, width: int, height: int, batch: int, **extra) -> str:
+    """
+    Name of a shape bucket: every distinct key compiles its own specialized graphs.
+
+    Args:
+        stage: "image" or "video"
+        width: Output width
+        height: Output height
+        batch: Denoiser batch size (doubled by classifier-free guidance)
+        extra: Other shape-determining settings, e.g. num_frames
+    """
+    suffix = "".join(f" {name} {value}" for name, value in sorted(extra.items()))
+    return f"{stage} {width}x{height} batch {batch}{suffix}"
+
+
+class CompileCache:
+    """
+    Persistent torch.compile cache for one combination of library versions and device.
+
+    Inductor's compiled kernels (and autotuning results) go to
+    <cache_dir>/<versions>/inductor, so a later process with the same
+    versions skips code generation and only re-traces the model. A small
+    manifest next to them records which shape buckets were compiled and how
+    long that took, so warmups can report cold and cached buckets.
+    """
+
+    def __init__(self, cache_dir: str, device: str, dtype: str):
+        """
+        Initialize the cache and point inductor at it.
+
+        Args:
+            cache_dir: Root directory for compile caches
+            device: Device the compiled modules run on
+            dtype: Model dtype
+        """
+        self.dir = Path(cache_dir) / compile_cache_key(device, dtype)
+        self.dir.mkdir(parents=True, exist_ok=True)
+        self.manifest_path = self.dir / "buckets.json"
+        self._lock = threading.Lock()
+
+        # Read by inductor whenever it looks up or stores an artifact
+        os.environ["TORCHINDUCTOR_CACHE_DIR"] = str(self.dir / "inductor")
+        torch._inductor.config.fx_graph_cache = True
+        dynamo_config = torch._dynamo.config
+        limit_name = "recompile_limit" if hasattr(dynamo_config, "recompile_limit") else "cache_size_limit"
+        setattr(dynamo_config, limit_name, max(getattr(dynamo_config, limit_name), RECOMPILE_LIMIT))
+
+    def buckets(self) -> Dict[str, Dict]:
+        """Compiled shape buckets: {bucket: {"compile_seconds", "compiled_at"}}."""
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, "r") as f:
+            return json.load(f)
+
+    def record(self, bucket: str, compile_seconds: float):
+        """Remember that a bucket was compiled (kept from its first, cold compile)."""
+        with self._lock:
+            buckets = self.buckets()
+            if bucket in buckets:
+                return
+            buckets[bucket] = {"compile_seconds": round(compile_seconds, 2), "compiled_at": time.time()}
+            tmp_path = self.manifest_path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                json.dump(buckets, f, indent=2)
+            os.replace(tmp_path, self.manifest_path)
+
+
+def compile_pipeline(pipe, device: str, decoder_attr: str = "decoder") -> bool:
+    """
+    Switch a pipeline's denoiser and VAE decoder to the compiled fast path, in place.
+
+    Both get channels_last weights and explicit SDPA attention processors
+    (so nothing swaps the attention implementation under a compiled graph),
+    and their forward is wrapped in torch.compile with static shapes. Module
+    objects stay the same, so pipelines sharing them (see PipelineRegistry),
+    forward hooks and offload hooks keep working. Compilation itself happens
+    on the first call with each new shape.
+
+    Args:
+        pipe: Diffusers pipeline with a unet and a vae
+        device: Device it runs on (picks the compile mode)
+        decoder_attr: VAE submodule to compile
+
+    Returns:
+        False if the modules were already compiled (e.g. by a generator sharing them)
+    """
+    from diffusers.models.attention_processor import AttnProcessor2_0
+
+    if getattr(pipe.unet, "_compiled_fast_path", False):
+        return False
+
+    # Autotuned kernel choices are cached with the rest, so the slow search runs once
+    mode = "max-autotune-no-cudagraphs" if device == "cuda" else "default"
+    decoder = getattr(pipe.vae, decoder_attr)
+    for module in (pipe.unet, decoder):
+        # Only 2D convolutions; SVD's temporal layers have 5D weights
+        for layer in module.modules():
+            if isinstance(layer, torch.nn.Conv2d):
+                layer.to(memory_format=torch.channels_last)
+    for module in (pipe.unet, pipe.vae):
+        module.set_attn_processor(AttnProcessor2_0())
+    for module in (pipe.unet, decoder):
+        # Compiling forward rather than the module leaves hooks outside the graph
+        module.forward = torch.compile(module.forward, mode=mode, dynamic=False)
+    pipe.unet._compiled_fast_path = True
+    return True
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Deep Cache
+Reuses the UNet's deep-block features across denoising steps, recomputing only the shallowest blocks in between
+"""
+
+from typing import Dict, Optional
+
+
+class DeepCache:
+    """
+    DeepCache-style feature caching for a UNet (SDXL or SVD).
+
+    The deep part of a UNet (every down block but the first, the mid block
+    and every up block but the last) works at low resolution. Its output
+    changes little from one denoising step to the next. On a full step each
+    deep block runs and its output is kept. On the cached steps in between,
+    the deep blocks return the kept outputs, and only the time embedding,
+    the first down block, the last up block and the in/out convolutions
+    run. That is a small fraction of the UNet's work.
+
+    A full step runs every interval-th UNet call. One also runs whenever the
+    input shape changes, e.g. when a guidance cutoff drops the CFG batch.
+    The block wrappers are installed once per UNet (see attach()) and pass
+    straight through while no call has started caching.
+    """
+
+    def __init__(self, unet):
+        self.unet = unet
+        self.interval: Optional[int] = None
+        self.full = True
+        self.calls = 0
+        self.full_calls = 0
+        self._shape = None
+        self._outputs: Dict[int, object] = {}
+        deep_blocks = list(unet.down_blocks[1:]) + [unet.mid_block] + list(unet.up_blocks[:-1])
+        for index, block in enumerate(deep_blocks):
+            self._wrap(index, block)
+        unet.register_forward_pre_hook(self._before_call, with_kwargs=True)
+
+    @classmethod
+    def attach(cls, unet) -> "DeepCache":
+        """The UNet's DeepCache, installed on first use (generators sharing a UNet share it)."""
+        deep_cache = getattr(unet, "_deep_cache", None)
+        if deep_cache is None:
+            deep_cache = cls(unet)
+            unet._deep_cache = deep_cache
+        return deep_cache
+
+    def _wrap(self, index: int, block):
+        forward = block.forward
+
+        def cached_forward(*args, **kwargs):
+            if self.full:
+                output = forward(*args, **kwargs)
+                if self.interval is not None:
+                    self._outputs[index] = output
+                return output
+            return self._outputs[index]
+
+        block.forward = cached_forward
+
+    def _before_call(self, module, args, kwargs):
+        if self.interval is None:
+            self.full = True
+            return
+        sample = args[0] if args else kwargs["sample"]
+        shape = tuple(sample.shape)
+        self.full = self.calls % self.interval == 0 or shape != self._shape
+        if self.full:
+            self._shape = shape
+            self.full_calls += 1
+        self.calls += 1
+
+    def start(self, interval: int):
+        """
+        Cache deep features for the next pipeline call.
+
+        Args:
+            interval: Run the full UNet every interval-th step (1 caches nothing)
+        """
+        if interval < 1:
+            raise ValueError(f"deep_cache_interval must be at least 1, got {interval}")
+        self.interval = interval
+        self.calls = 0
+        self.full_calls = 0
+        self._shape = None
+        self._outputs = {}
+
+    def stop(self) -> Dict:
+        """
+        End caching (call after the pipeline returns, also on errors).
+
+        Returns:
+            {"unet_calls", "full_calls"} for the call
+        """
+        stats = {"unet_calls": self.calls, "full_calls": self.full_calls}
+        self.interval = None
+        self.full = True
+        self._outputs = {}
+        return stats
@@ -7,15 +7,60 @@ A general-purpose tool for generating images using Stable Diffusion XL and LoRA
 import argparse
 import json
 import os
+import random
+import time
+import uuid
 from datetime import datetime
 from pathlib import Path
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Union
 
-import torch
-from diffusers import StableDiffusionXLPipeline, AutoencoderKL
-from diffusers.utils import load_image
-from safetensors.torch import load_file
-from PIL import Image, PngImagePlugin
+from PIL import Image
+
+from compile_cache import DEFAULT_COMPILE_CACHE, CompileCache, bucket_key, compile_pipeline
+from lazy_imports import lazy_import
+from pipeline_registry import empty_device_cache, registry
+from manifest import MANIFEST_NAME, OutputManifest, image_record
+from memory_planner import COMPILE_DISABLED, MEMORY_FEATURES, MemoryPlanner, parse_memory_mode
+from memory_scheduler import GB
+from output_writer import FORMAT_EXTENSIONS, OutputWriter
+from prompt_cache import PromptEmbeddingCache
+from schedulers import DEFAULT_SCHEDULER, SCHEDULERS, SchedulerCache, check_scheduler
+from deep_cache import DeepCache
+from step_callbacks import EarlyExit, GuidanceCutoff, chain_callbacks
+from step_metrics import StepMetrics, build_step_metrics
+from token_merging import TokenMerging, parse_token_merge_ratio, resolve_token_merge_ratio
+
+torch = lazy_import("torch")
+
+
+# Per-call speed options of generate(); generate_many() only batches jobs that agree on all of them
+SAMPLING_OPTIONS = {
+    "scheduler": DEFAULT_SCHEDULER,
+    "cfg_cutoff": None,
+    "cfg_converge": None,
+    "deep_cache_interval": None,
+    "token_merge_ratio": None,
+    "early_exit_threshold": None,
+}
+
+
+class GeneratedImages(list):
+    """List of generated PIL Images that also tracks their seeds and pending saves."""
+
+    def __init__(self, images=(), futures=(), seeds=()):
+        super().__init__(images)
+        self.futures = list(futures)
+        self.seeds = list(seeds)
+
+    def add(self, image: Image.Image, future, seed: int):
+        self.append(image)
+        self.futures.append(future)
+        self.seeds.append(seed)
+
+    @property
+    def paths(self) -> List[str]:
+        """Saved file paths, waiting for background writes to finish."""
+        return [future.result() for future in self.futures]
 
 
 class SDXLGenerator:
@@ -27,7 +72,19 @@ class SDXLGenerator:
         vae_model: Optional[str] = None,
         device: str = "mps",
         dtype: str = "float16",
-        output_dir: str = "./outputs"
+        output_dir: str = "./outputs",
+        prompt_cache: Optional[PromptEmbeddingCache] = None,
+        lora_memory_mb: Optional[float] = None,
+        fused_lora_dir: Optional[str] = None,
+        output_format: str = "png",
+        png_compress_level: int = 6,
+        writer_workers: int = 2,
+        step_metrics: Optional[StepMetrics] = None,
+        memory_mode: str = "auto",
+        vram_budget_gb: Optional[float] = None,
+        memory_scheduler=None,
+        compile_models: bool = False,
+        compile_cache_dir: str = DEFAULT_COMPILE_CACHE
     ):
         """
         Initialize the SDXL generator.
@@ -38,47 +95,81 @@ class SDXLGenerator:
             device: Device to run on (mps for Mac, cuda for NVIDIA, cpu)
             dtype: Data type (float16 or float32)
             output_dir: Directory to save generated images
+            prompt_cache: Optional cache for text encoder outputs
+            lora_memory_mb: Budget for LoRA adapters kept resident between jobs;
+                shared by all generators on the same base model, which keep the largest
+            fused_lora_dir: Fuse LoRAs into the weights, caching snapshots here
+            output_format: Image file format (png, webp or jpeg)
+            png_compress_level: zlib level for PNG output (0-9, lower is faster)
+            writer_workers: Background threads encoding images (0 saves inline)
+            step_metrics: Optional per-denoising-step metrics (latency, it/s, memory)
+            memory_mode: "auto" to pick memory-saving features per call from
+                the requested size and batch, "none", or a fixed comma-separated
+                list such as "vae_tiling,model_offload" (see memory_planner.py)
+            vram_budget_gb: Device memory the planner may use (defaults to 95% of the GPU)
+            memory_scheduler: Optional StageMemoryScheduler that places the
+                SDXL components (as stage "image"); the planner then only
+                chooses slicing and tiling
+            compile_models: torch.compile the UNet and VAE decoder (channels_last,
+                SDPA attention); each new shape compiles once, see warmup()
+            compile_cache_dir: Where compiled kernels are kept for later processes
         """
+        disabled = COMPILE_DISABLED if compile_models else ()
+        parse_memory_mode(memory_mode, disabled)  # fail on a bad mode before loading weights
         self.model_id = model_id
+        self.prompt_cache = prompt_cache
+        self.step_metrics = step_metrics
         self.device = device
         self.dtype = torch.float16 if dtype == "float16" else torch.float32
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
 
-        print(f"Loading model: {model_id}")
-        print(f"Device: {device}, dtype: {dtype}")
-
-        # Load the pipeline
-        if vae_model:
-            # Load VAE if specified
-            print(f"Loading VAE: {vae_model}")
-            vae = AutoencoderKL.from_pretrained(vae_model, torch_dtype=self.dtype)
-            self.pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                vae=vae,
-                torch_dtype=self.dtype,
-                use_safetensors=True,
-            )
-        else:
-            self.pipe = StableDiffusionXLPipeline.from_pretrained(
-                model_id,
-                torch_dtype=self.dtype,
-                use_safetensors=True,
-            )
+        # Load the pipeline (shared with other generators using the same model)
+        self.pipe = registry.acquire(model_id, vae_model, dtype, device)
+        self.lora_pool = registry.lora_pool(self.pipe, lora_memory_mb)
+        self.schedulers = SchedulerCache(self.pipe)
+        self.fused_loras = None
+        if fused_lora_dir:
+            self.fused_loras = registry.fused_loras(self.pipe, fused_lora_dir)
 
-        # Move to device
-        if device == "mps":
-            self.pipe = self.pipe.to("mps")
-            # Enable attention slicing for better memory efficiency on Mac
-            self.pipe.enable_attention_slicing()
-        elif device == "cuda":
-            self.pipe = self.pipe.to("cuda")
-        else:
-            self.pipe = self.pipe.to("cpu")
+        self.memory_scheduler = memory_scheduler
+        if memory_scheduler is not None and vram_budget_gb is None and memory_scheduler.budget:
+            vram_budget_gb = memory_scheduler.budget / GB
+        self.memory_planner = MemoryPlanner(
+            self.pipe, device, mode=memory_mode, budget_gb=vram_budget_gb,
+            manage_placement=memory_scheduler is None, disabled=disabled,
+            applied=registry.memory_state(self.pipe)
+        )
+        if memory_scheduler is not None:
+            working = self.memory_planner.plan(1024, 1024)["working"]
+            memory_scheduler.add_stage("image", self.pipe, working_gb=working / GB)
 
-        print("Model loaded successfully!")
+        self.compile_cache = None
+        if compile_models:
+            self.compile_cache = CompileCache(compile_cache_dir, device, dtype)
+            if compile_pipeline(self.pipe, device):
+                print(f"Compiling UNet and VAE decoder on first use (cache: {self.compile_cache.dir})")
 
         self.loaded_loras: List[Dict] = []
+        self.writer = OutputWriter(
+            output_format=output_format,
+            num_workers=writer_workers,
+            png_compress_level=png_compress_level
+        )
+        self.manifest = OutputManifest(self.output_dir / MANIFEST_NAME)
+
+    def close(self):
+        """Flush pending image writes and release the shared pipeline."""
+        self.writer.flush()
+        if self.pipe is not None:
+            if self.fused_loras is not None:
+                self.fused_loras.restore_base()
+            if self.loaded_loras:
+                # Other generators may share the UNet, so only drop our own adapters
+                self.lora_pool.remove([lora["name"] for lora in self.loaded_loras])
+                self.loaded_loras = []
+            registry.release(self.pipe)
+            self.pipe = None
 
     def load_lora(self, lora_path: str, weight: float = 1.0, adapter_name: Optional[str] = None):
         """
@@ -89,40 +180,68 @@ class SDXLGenerator:
             weight: Weight/strength of the LoRA (0.0 to 2.0, typically)
             adapter_name: Optional name for this LoRA adapter
         """
+        lora = self._lora_entry(lora_path, weight, adapter_name)
+        if lora is None:
+            return
+        print(f"Loading LoRA: {lora['name']} with weight {weight}")
+
+        try:
+            # In fused mode adapters are only loaded when a new snapshot is built
+            if self.fused_loras is None:
+                self.lora_pool.activate(self.loaded_loras + [lora])
+            self.loaded_loras.append(lora)
+            print(f"LoRA '{lora['name']}' loaded successfully!")
+        except Exception as e:
+            print(f"Error loading LoRA: {e}")
+
+    def set_loras(self, loras: List[Dict]):
+        """
+        Switch to a different set of LoRAs.
+
+        Adapters already resident in the LoRA pool are reused instead of reloaded.
+
+        Args:
+            loras: List of {"path", "weight", "name"} dicts ("name" is optional)
+        """
+        selected = []
+        for lora in loras:
+            entry = self._lora_entry(lora["path"], lora.get("weight", 1.0), lora.get("name"))
+            if entry is not None:
+                selected.append(entry)
+        if self.fused_loras is None:
+            self.lora_pool.activate(selected)
+        self.loaded_loras = selected
+
+    def _lora_entry(self, lora_path: str, weight: float, adapter_name: Optional[str]) -> Optional[Dict]:
         if not os.path.exists(lora_path):
             print(f"Warning: LoRA file not found: {lora_path}")
-            return
+            return None
 
         # Sanitize adapter name - replace invalid characters
         lora_name = adapter_name or Path(lora_path).stem
         lora_name = lora_name.replace(".", "_").replace(" ", "_")
-        print(f"Loading LoRA: {lora_name} with weight {weight}")
-
-        try:
-            self.pipe.load_lora_weights(lora_path, adapter_name=lora_name)
-            self.loaded_loras.append({
-                "name": lora_name,
-                "path": lora_path,
-                "weight": weight
-            })
-            print(f"LoRA '{lora_name}' loaded successfully!")
-        except Exception as e:
-            print(f"Error loading LoRA: {e}")
+        return {
+            "name": lora_name,
+            "path": lora_path,
+            "weight": weight
+        }
 
     def set_lora_scale(self, weight: float):
-        """Set the scale for all loaded LoRAs."""
-        if self.loaded_loras:
-            self.pipe.set_adapters(
-                [lora["name"] for lora in self.loaded_loras],
-                adapter_weights=[weight] * len(self.loaded_loras)
-            )
+        """Scale all loaded LoRAs (multiplies each LoRA's own weight)."""
+        if self.fused_loras is not None:
+            self.fused_loras.apply(self.model_id, self.loaded_loras, weight)
+        else:
+            self.lora_pool.activate(self.loaded_loras, scale=weight)
 
     def unload_loras(self):
-        """Unload all LoRAs."""
+        """Deactivate all LoRAs (adapters stay resident in the pool for reuse)."""
         if self.loaded_loras:
             print("Unloading LoRAs...")
-            self.pipe.unload_lora_weights()
             self.loaded_loras = []
+            if self.fused_loras is not None:
+                self.fused_loras.restore_base()
+            else:
+                self.lora_pool.activate([])
 
     def generate(
         self,
@@ -135,8 +254,16 @@ class SDXLGenerator:
         num_images: int = 1,
         seed: Optional[int] = None,
         lora_scale: float = 1.0,
-        save_metadata: bool = True
-    ) -> List[Image.Image]:
+        save_metadata: bool = True,
+        batch_size: int = 1,
+        job_id: Optional[str] = None,
+        scheduler: str = DEFAULT_SCHEDULER,
+        cfg_cutoff: Optional[float] = None,
+        cfg_converge: Optional[float] = None,
+        deep_cache_interval: Optional[int] = None,
+        token_merge_ratio: Optional[Union[float, str]] = None,
+        early_exit_threshold: Optional[float] = None
+    ) -> "GeneratedImages":
         """
         Generate images.
 
@@ -148,76 +275,482 @@ class SDXLGenerator:
             num_inference_steps: Number of denoising steps
             guidance_scale: How closely to follow the prompt (1.0-20.0)
             num_images: Number of images to generate
-            seed: Random seed for reproducibility
+            seed: Random seed for reproducibility (image k uses seed + k)
             lora_scale: Scale/weight for LoRAs
             save_metadata: Whether to save generation metadata
+            batch_size: Maximum number of images denoised in one pipeline call
+            job_id: ID recorded in the output manifest (generated if not given)
+            scheduler: Sampler from schedulers.SCHEDULERS (e.g. "dpmpp_2m_karras")
+            cfg_cutoff: Fraction of the steps that use classifier-free
+                guidance; the rest run the UNet on a single batch
+            cfg_converge: Also stop guidance once the guidance delta changes
+                by less than this fraction between steps
+            deep_cache_interval: Reuse the UNet's deep features, running the
+                full UNet only every this many steps (see deep_cache.py)
+            token_merge_ratio: Fraction of self-attention tokens to merge, or
+                "auto" for the size's default (see token_merging.py)
+            early_exit_threshold: End denoising once the predicted image
+                changes by less than this fraction between steps
 
         Returns:
-            List of generated PIL Images
+            List of generated PIL Images; its .paths waits for and returns the
+            saved file paths (images are encoded in the background)
         """
-        # Set LoRA scale if any LoRAs are loaded
-        if self.loaded_loras and lora_scale != 1.0:
-            self.set_lora_scale(lora_scale)
+        check_scheduler(scheduler)
+        # Apply per-LoRA weights times the requested scale
+        self.set_lora_scale(lora_scale)
 
-        # Set seed if specified
-        generator = None
-        if seed is not None:
-            generator = torch.Generator(device=self.device).manual_seed(seed)
+        # Every image gets its own seed so it is reproducible on its own,
+        # regardless of which batch it ran in
+        base_seed = seed if seed is not None else random.randint(0, 2**32 - 1)
+        seeds = [base_seed + i for i in range(num_images)]
+        job_id = job_id or uuid.uuid4().hex
 
         print("\nGenerating images...")
         print(f"Prompt: {prompt}")
         print(f"Size: {width}x{height}")
-        print(f"Steps: {num_inference_steps}, Guidance: {guidance_scale}")
+        print(f"Steps: {num_inference_steps}, Guidance: {guidance_scale}, Scheduler: {scheduler}")
+        options = {
+            "scheduler": scheduler,
+            "cfg_cutoff": cfg_cutoff,
+            "cfg_converge": cfg_converge,
+            "deep_cache_interval": deep_cache_interval,
+            "token_merge_ratio": token_merge_ratio,
+            "early_exit_threshold": early_exit_threshold,
+        }
+        enabled = [f"{name} {value}" for name, value in options.items()
+                   if name != "scheduler" and value is not None]
+        if enabled:
+            print(f"Speed options: {', '.join(enabled)}")
         if self.loaded_loras:
             print(f"LoRAs: {', '.join([l['name'] for l in self.loaded_loras])} (scale: {lora_scale})")
 
-        # Generate images
-        images = []
-        for i in range(num_images):
+        # Generate images in batches
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        futures = []
+
+        def run_chunk(start: int, end: int) -> List[Image.Image]:
             if num_images > 1:
-                print(f"Generating image {i+1}/{num_images}...")
+                print(f"Generating images {start+1}-{end}/{num_images} (batch of {end - start})...")
+
+            images, extra = self._denoise(
+                job_id, self._prompt_kwargs(prompt, negative_prompt, lora_scale), seeds[start:end],
+                width, height, num_inference_steps, guidance_scale, options,
+                num_images_per_prompt=end - start
+            )
+
+            for i, image in enumerate(images, start):
+                filename = f"generated_{timestamp}_{i+1}.png" if num_images > 1 else f"generated_{timestamp}.png"
+                metadata = self._image_metadata(
+                    prompt, negative_prompt, width, height, num_inference_steps,
+                    guidance_scale, seeds[i], lora_scale, job_id, scheduler, extra
+                )
+                futures.append(self._save(image, self.output_dir / filename, metadata, save_metadata))
+            return images
+
+        images = self._run_in_chunks(num_images, batch_size, run_chunk)
+        return GeneratedImages(images, futures, seeds)
+
+    def generate_many(
+        self,
+        requests: List[Dict],
+        lora_scale: float = 1.0,
+        save_metadata: bool = True,
+        max_batch_size: int = 4
+    ) -> List["GeneratedImages"]:
+        """
+        Generate images for many independent jobs, batching compatible jobs together.
 
+        Jobs are grouped into buckets with matching width, height, steps,
+        guidance scale and SAMPLING_OPTIONS; each bucket runs as batched pipeline calls with mixed
+        prompts. Every image is seeded individually, so results match what
+        generate() produces for the same job and seed.
+
+        Args:
+            requests: List of job dicts with a "prompt" and optionally
+                "negative_prompt", "width", "height", "num_inference_steps",
+                "guidance_scale", "seed", "num_images", "job_id" and any of
+                SAMPLING_OPTIONS
+            lora_scale: Scale/weight for LoRAs (shared by all jobs)
+            save_metadata: Whether to save generation metadata
+            max_batch_size: Maximum number of images denoised in one pipeline call
+
+        Returns:
+            One GeneratedImages list per request, in the original order
+        """
+        self.set_lora_scale(lora_scale)
+
+        # Flatten jobs into one entry per output image
+        buckets: Dict[tuple, List[Dict]] = {}
+        for job_index, job in enumerate(requests):
+            params = {
+                "prompt": job["prompt"],
+                "negative_prompt": job.get("negative_prompt", ""),
+                "width": job.get("width", 1024),
+                "height": job.get("height", 1024),
+                "num_inference_steps": job.get("num_inference_steps", 30),
+                "guidance_scale": job.get("guidance_scale", 7.5),
+            }
+            options = {name: job.get(name, default) for name, default in SAMPLING_OPTIONS.items()}
+            check_scheduler(options["scheduler"])
+            seed = job.get("seed")
+            base_seed = seed if seed is not None else random.randint(0, 2**32 - 1)
+            params["job_id"] = job.get("job_id") or uuid.uuid4().hex
+            shape_key = (
+                params["width"], params["height"],
+                params["num_inference_steps"], params["guidance_scale"],
+                *options.values(),
+            )
+            for k in range(job.get("num_images", 1)):
+                buckets.setdefault(shape_key, []).append(
+                    dict(params, seed=base_seed + k, job_index=job_index, image_index=k)
+                )
+
+        print(f"\nGenerating {sum(len(b) for b in buckets.values())} images "
+              f"for {len(requests)} requests in {len(buckets)} bucket(s)...")
+
+        results = [GeneratedImages() for _ in requests]
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+
+        for key, items in buckets.items():
+            width, height, steps, guidance_scale = key[:4]
+            options = dict(zip(SAMPLING_OPTIONS, key[4:]))
+            print(f"Bucket {width}x{height}, {steps} steps, guidance {guidance_scale}, "
+                  f"{options['scheduler']} scheduler: {len(items)} image(s)")
+
+            def run_chunk(start: int, end: int, items=items, width=width, height=height, steps=steps,
+                          guidance_scale=guidance_scale, options=options) -> List[Image.Image]:
+                chunk = items[start:end]
+                images, extra = self._denoise(
+                    ",".join(dict.fromkeys(item["job_id"] for item in chunk)),
+                    self._batch_prompt_kwargs(
+                        [item["prompt"] for item in chunk],
+                        [item["negative_prompt"] for item in chunk],
+                        lora_scale
+                    ),
+                    [item["seed"] for item in chunk],
+                    width, height, steps, guidance_scale, options,
+                    num_images_per_prompt=1
+                )
+
+                for item, image in zip(chunk, images):
+                    filename = f"generated_{timestamp}_job{item['job_index']+1}_{item['image_index']+1}.png"
+                    metadata = self._image_metadata(
+                        item["prompt"], item["negative_prompt"], width, height, steps,
+                        guidance_scale, item["seed"], lora_scale, item["job_id"], options["scheduler"], extra
+                    )
+                    item["future"] = self._save(image, self.output_dir / filename, metadata, save_metadata)
+                return images
+
+            images = self._run_in_chunks(len(items), max_batch_size, run_chunk)
+            for item, image in zip(items, images):
+                results[item["job_index"]].add(image, item["future"], item["seed"])
+
+        return results
+
+    def warmup(self, shapes: List[Dict], num_inference_steps: int = 2):
+        """
+        Run one short generation per shape, so compilation happens now and not in the first jobs.
+
+        Does nothing unless the generator was created with compile_models.
+
+        Args:
+            shapes: Dicts with any of "width", "height", "guidance_scale",
+                "batch_size" (images per pipeline call) and "token_merge_ratio";
+                missing keys use the generate() defaults, and shapes that
+                compile the same are run once
+            num_inference_steps: Denoising steps per warmup call
+        """
+        if self.compile_cache is None:
+            return
+        compiled = self.compile_cache.buckets()
+        seen = set()
+        for shape in shapes:
+            width, height = shape.get("width", 1024), shape.get("height", 1024)
+            guidance_scale = shape.get("guidance_scale", 7.5)
+            batch = shape.get("batch_size", 1)
+            merge_ratio = resolve_token_merge_ratio(shape.get("token_merge_ratio"), width, height)
+            # Only whether CFG is on changes the UNet's batch, not the scale itself
+            extra = {"cfg": "on" if guidance_scale > 1 else "off"}
+            if merge_ratio is not None:
+                # Merged attention layers have their own token counts
+                extra["tome"] = merge_ratio
+            bucket = bucket_key("image", width, height, batch, **extra)
+            if bucket in seen:
+                continue
+            seen.add(bucket)
+
+            start = time.perf_counter()
+            self._prepare_memory(width, height, batch, guidance_scale)
+            token_merging = None
+            if merge_ratio is not None:
+                token_merging = TokenMerging.attach(self.pipe.unet)
+                token_merging.start(merge_ratio)
+            try:
+                self.pipe(
+                    prompt="",
+                    width=width,
+                    height=height,
+                    num_inference_steps=num_inference_steps,
+                    guidance_scale=guidance_scale,
+                    num_images_per_prompt=batch,
+                    generator=self._make_generators([0] * batch),
+                )
+            finally:
+                if token_merging is not None:
+                    token_merging.stop()
+            seconds = time.perf_counter() - start
+            state = "from cache" if bucket in compiled else "compiled"
+            print(f"✓ Warmup {bucket}: {seconds:.1f}s ({state})")
+            self.compile_cache.record(bucket, seconds)
+
+    def _prepare_memory(self, width: int, height: int, batch: int, guidance_scale: float):
+        """Apply the memory plan for one pipeline call (and enter the scheduler's image stage)."""
+        plan = self.memory_planner.plan(width, height, batch, guidance_scale)
+        self.memory_planner.apply(plan, label=f"{width}x{height} x{batch}")
+        if self.memory_scheduler is not None:
+            self.memory_scheduler.enter("image", working_gb=plan["working"] / GB)
+
+    def _track_steps(self, job_id: str, num_inference_steps: int):
+        """Step callback for one pipeline call, or None when metrics are off."""
+        if self.step_metrics is None:
+            return None
+        return self.step_metrics.track("image", job_id, num_inference_steps, pipe=self.pipe)
+
+    def _denoise(
+        self,
+        job_id: str,
+        prompt_kwargs: Dict,
+        seeds: List[int],
+        width: int,
+        height: int,
+        num_inference_steps: int,
+        guidance_scale: float,
+        options: Dict,
+        num_images_per_prompt: int
+    ):
+        """
+        Run one pipeline call with the memory plan, step metrics and SAMPLING_OPTIONS applied.
+
+        Returns:
+            (images, extra metadata fields describing how the options played out)
+        """
+        self._prepare_memory(width, height, len(seeds), guidance_scale)
+        self.schedulers.use(options["scheduler"])
+        tracker = self._track_steps(job_id, num_inference_steps)
+        cutoff = None
+        if guidance_scale > 1 and (options["cfg_cutoff"] is not None or options["cfg_converge"] is not None):
+            cutoff = GuidanceCutoff(
+                self.pipe, num_inference_steps, cutoff=options["cfg_cutoff"], converge=options["cfg_converge"]
+            )
+        deep_cache = None
+        if options["deep_cache_interval"] is not None:
+            deep_cache = DeepCache.attach(self.pipe.unet)
+            deep_cache.start(options["deep_cache_interval"])
+        token_merging = None
+        merge_ratio = resolve_token_merge_ratio(options["token_merge_ratio"], width, height)
+        if merge_ratio is not None:
+            token_merging = TokenMerging.attach(self.pipe.unet)
+            token_merging.start(merge_ratio)
+        early_exit = None
+        if options["early_exit_threshold"] is not None:
+            early_exit = EarlyExit(self.pipe, num_inference_steps, options["early_exit_threshold"])
+        callback, tensor_inputs = chain_callbacks(cutoff, tracker, early_exit)
+
+        extra = {}
+        try:
             result = self.pipe(
-                prompt=prompt,
-                negative_prompt=negative_prompt if negative_prompt else None,
+                **prompt_kwargs,
                 width=width,
                 height=height,
                 num_inference_steps=num_inference_steps,
                 guidance_scale=guidance_scale,
-                generator=generator,
+                num_images_per_prompt=num_images_per_prompt,
+                generator=self._make_generators(seeds),
+                callback_on_step_end=callback,
+                callback_on_step_end_tensor_inputs=tensor_inputs,
             )
+        finally:
+            if tracker is not None:
+                tracker.finish()
+            if cutoff is not None:
+                cutoff.finish()
+            if deep_cache is not None:
+                cache_stats = deep_cache.stop()
+            if token_merging is not None:
+                merge_stats = token_merging.stop()
+            if early_exit is not None:
+                early_exit.finish()
+        self.memory_planner.observe()
 
-            image = result.images[0]
-
-            # Save image with metadata
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"generated_{timestamp}_{i+1}.png" if num_images > 1 else f"generated_{timestamp}.png"
-            filepath = self.output_dir / filename
-
-            if save_metadata:
-                # Add metadata to PNG
-                metadata = PngImagePlugin.PngInfo()
-                metadata.add_text("prompt", prompt)
-                metadata.add_text("negative_prompt", negative_prompt)
-                metadata.add_text("width", str(width))
-                metadata.add_text("height", str(height))
-                metadata.add_text("steps", str(num_inference_steps))
-                metadata.add_text("guidance_scale", str(guidance_scale))
-                metadata.add_text("seed", str(seed) if seed is not None else "random")
-                metadata.add_text("model", self.model_id)
-                if self.loaded_loras:
-                    metadata.add_text("loras", json.dumps(self.loaded_loras))
-                    metadata.add_text("lora_scale", str(lora_scale))
-
-                image.save(filepath, pnginfo=metadata)
-            else:
-                image.save(filepath)
+        if cutoff is not None:
+            if cutoff.cfg_steps is not None:
+                print(f"Guidance stopped after {cutoff.cfg_steps}/{num_inference_steps} steps")
+            extra.update(cutoff.metadata())
+        if deep_cache is not None:
+            print(f"Deep cache: full UNet on {cache_stats['full_calls']}/{cache_stats['unet_calls']} steps")
+            extra["deep_cache_interval"] = str(options["deep_cache_interval"])
+        if token_merging is not None:
+            print(f"Token merging: {merge_ratio:.0%} of tokens merged in {merge_stats['merged_calls']} attention calls")
+            extra["token_merge_ratio"] = str(merge_ratio)
+        if early_exit is not None:
+            if early_exit.steps_used is not None:
+                print(f"Early exit after {early_exit.steps_used}/{num_inference_steps} steps "
+                      f"(change {early_exit.change:.4f})")
+            extra.update(early_exit.metadata())
+        return result.images, extra
 
-            print(f"Saved: {filepath}")
-            images.append(image)
+    def _run_in_chunks(self, total: int, batch_size: int, run_chunk) -> List[Image.Image]:
+        """
+        Call run_chunk(start, end) over [0, total) in chunks of at most batch_size.
 
+        A chunk that runs out of device memory is retried at half the size.
+        """
+        images: List[Image.Image] = []
+        batch_size = max(1, min(batch_size, total))
+        start = 0
+        while start < total:
+            end = min(start + batch_size, total)
+            try:
+                images.extend(run_chunk(start, end))
+            except Exception as e:
+                if not _is_out_of_memory(e):
+                    raise
+                # Later plans assume more memory, so a retry may pick a leaner mode
+                leaner = self.memory_planner.record_out_of_memory()
+                if batch_size == 1 and not leaner:
+                    raise
+                if batch_size > 1:
+                    batch_size = max(1, batch_size // 2)
+                    print(f"Out of memory, retrying with batch size {batch_size}")
+                else:
+                    print("Out of memory, retrying with a more memory-saving mode")
+                empty_device_cache(self.device)
+                continue
+            start = end
         return images
 
+    def _image_metadata(
+        self,
+        prompt: str,
+        negative_prompt: str,
+        width: int,
+        height: int,
+        num_inference_steps: int,
+        guidance_scale: float,
+        seed: int,
+        lora_scale: float,
+        job_id: str,
+        scheduler: str,
+        extra: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Build the text fields embedded in saved PNGs (plus any extra fields of the call)."""
+        metadata = {
+            "job_id": job_id,
+            "prompt": prompt,
+            "negative_prompt": negative_prompt,
+            "width": str(width),
+            "height": str(height),
+            "steps": str(num_inference_steps),
+            "guidance_scale": str(guidance_scale),
+            "scheduler": scheduler,
+            "seed": str(seed),
+            "model": self.model_id,
+        }
+        if self.loaded_loras:
+            metadata["loras"] = json.dumps(self.loaded_loras)
+            metadata["lora_scale"] = str(lora_scale)
+        metadata.update(extra or {})
+        return metadata
+
+    def _save(self, image: Image.Image, filepath: Path, metadata: Dict[str, str], save_metadata: bool):
+        """Queue an image for writing and record it in the manifest once saved."""
+        return self.writer.submit(
+            image, filepath, metadata if save_metadata else None,
+            on_saved=lambda path: self.manifest.append(image_record(path, metadata))
+        )
+
+    def _prompt_kwargs(self, prompt: str, negative_prompt: str, lora_scale: float) -> Dict:
+        """Pipeline prompt arguments, using cached embeddings when a cache is set."""
+        if self.prompt_cache is None:
+            return {
+                "prompt": prompt,
+                "negative_prompt": negative_prompt if negative_prompt else None,
+            }
+        return self._batch_prompt_kwargs([prompt], [negative_prompt], lora_scale)
+
+    def _batch_prompt_kwargs(self, prompts: List[str], negative_prompts: List[str], lora_scale: float) -> Dict:
+        """Pipeline arguments for a batch of mixed prompts, as stacked embeddings."""
+        encoded = {}
+
+        def encode(text: str):
+            if text not in encoded:
+                encoded[text] = self._encode_text(text, lora_scale)
+            return encoded[text]
+
+        embeds, pooled, negative_embeds, negative_pooled = [], [], [], []
+        for prompt, negative_prompt in zip(prompts, negative_prompts):
+            prompt_embeds, pooled_prompt_embeds = encode(prompt)
+            if not negative_prompt and self.pipe.config.force_zeros_for_empty_prompt:
+                # Matches the pipeline's own handling of an empty negative prompt
+                neg_embeds = torch.zeros_like(prompt_embeds)
+                neg_pooled = torch.zeros_like(pooled_prompt_embeds)
+            else:
+                neg_embeds, neg_pooled = encode(negative_prompt)
+            embeds.append(prompt_embeds)
+            pooled.append(pooled_prompt_embeds)
+            negative_embeds.append(neg_embeds)
+            negative_pooled.append(neg_pooled)
+
+        return {
+            "prompt_embeds": torch.cat(embeds),
+            "pooled_prompt_embeds": torch.cat(pooled),
+            "negative_prompt_embeds": torch.cat(negative_embeds),
+            "negative_pooled_prompt_embeds": torch.cat(negative_pooled),
+        }
+
+    def _encode_text(self, text: str, lora_scale: float):
+        """Run both text encoders on one string, going through the prompt cache if set."""
+        key = None
+        if self.prompt_cache is not None:
+            lora_state = [
+                [l["name"], l["path"], l["weight"]] for l in self.loaded_loras
+            ]
+            if lora_state:
+                lora_state.append(["scale", lora_scale])
+            key = PromptEmbeddingCache.make_key(self.model_id, text, lora_state)
+
+            cached = self.prompt_cache.get(key, device=self.device)
+            if cached is not None:
+                return cached["prompt_embeds"], cached["pooled_prompt_embeds"]
+
+        with torch.no_grad():
+            prompt_embeds, _, pooled_prompt_embeds, _ = self.pipe.encode_prompt(
+                prompt=text,
+                device=self.device,
+                num_images_per_prompt=1,
+                do_classifier_free_guidance=False,
+            )
+        if key is not None:
+            self.prompt_cache.put(key, {
+                "prompt_embeds": prompt_embeds,
+                "pooled_prompt_embeds": pooled_prompt_embeds,
+            })
+        return prompt_embeds, pooled_prompt_embeds
+
+    def _make_generators(self, seeds: List[int]) -> List["torch.Generator"]:
+        """Create one seeded RNG per image so results don't depend on batching."""
+        return [torch.Generator(device=self.device).manual_seed(s) for s in seeds]
+
+
+
+def _is_out_of_memory(error: Exception) -> bool:
+    """Check whether an exception is an accelerator out-of-memory error."""
+    oom_type = getattr(torch.cuda, "OutOfMemoryError", None)
+    if oom_type is not None and isinstance(error, oom_type):
+        return True
+    return isinstance(error, RuntimeError) and "out of memory" in str(error).lower()
+
 
 def main():
     parser = argparse.ArgumentParser(
@@ -251,6 +784,30 @@ def main():
         choices=["float16", "float32"],
         help="Data type for model weights"
     )
+    parser.add_argument(
+        "--memory-mode",
+        type=str,
+        default="auto",
+        help="auto (pick per request from size and batch), none, or a comma-separated list of: "
+             + ", ".join(MEMORY_FEATURES)
+    )
+    parser.add_argument(
+        "--vram-budget-gb",
+        type=float,
+        default=None,
+        help="Device memory the memory planner may use (default: 95%% of the GPU)"
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the UNet and VAE decoder (slow first run per size, cached on disk)"
+    )
+    parser.add_argument(
+        "--compile-cache-dir",
+        type=str,
+        default=DEFAULT_COMPILE_CACHE,
+        help="Directory for cached compiled kernels"
+    )
 
     # LoRA arguments
     parser.add_argument(
@@ -266,6 +823,12 @@ def main():
         default=1.0,
         help="LoRA scale/weight (0.0-2.0)"
     )
+    parser.add_argument(
+        "--fused-lora-dir",
+        type=str,
+        default=None,
+        help="Fuse LoRAs into the model weights, caching fused snapshots in this directory"
+    )
 
     # Generation arguments
     parser.add_argument(
@@ -304,6 +867,44 @@ def main():
         default=7.5,
         help="Guidance scale (how closely to follow prompt)"
     )
+    parser.add_argument(
+        "--scheduler",
+        type=str,
+        default=DEFAULT_SCHEDULER,
+        choices=list(SCHEDULERS),
+        help="Sampler (dpmpp_2m_karras/unipc: 15-25 steps; lcm: 4-8 steps with the LCM-LoRA; "
+             "turbo: 1-4 steps for Turbo models)"
+    )
+    parser.add_argument(
+        "--cfg-cutoff",
+        type=float,
+        default=None,
+        help="Fraction of steps that use guidance (e.g. 0.6); the rest run at half the UNet cost"
+    )
+    parser.add_argument(
+        "--cfg-converge",
+        type=float,
+        default=None,
+        help="Also stop guidance once the guidance delta changes less than this between steps (e.g. 0.05)"
+    )
+    parser.add_argument(
+        "--deep-cache-interval",
+        type=int,
+        default=None,
+        help="Run the full UNet every N steps and reuse its deep features in between (e.g. 3)"
+    )
+    parser.add_argument(
+        "--token-merge-ratio",
+        type=parse_token_merge_ratio,
+        default=None,
+        help="Merge this fraction of self-attention tokens (e.g. 0.5), or 'auto' for the resolution's default"
+    )
+    parser.add_argument(
+        "--early-exit-threshold",
+        type=float,
+        default=None,
+        help="End denoising once the predicted image changes less than this between steps (e.g. 0.01)"
+    )
     parser.add_argument(
         "--num-images",
         type=int,
@@ -314,7 +915,20 @@ def main():
         "--seed",
         type=int,
         default=None,
-        help="Random seed for reproducibility"
+        help="Random seed for reproducibility (image k uses seed + k)"
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Images denoised per pipeline call (halved automatically on OOM)"
+    )
+
+    parser.add_argument(
+        "--prompt-cache-dir",
+        type=str,
+        default=None,
+        help="Directory for cached prompt embeddings (enables the prompt cache)"
     )
 
     # Output arguments
@@ -329,21 +943,116 @@ def main():
         action="store_true",
         help="Don't save generation metadata in images"
     )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="png",
+        choices=list(FORMAT_EXTENSIONS),
+        help="Image file format (webp is lossless)"
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        type=int,
+        default=6,
+        help="PNG zlib compression level (0-9, lower is faster)"
+    )
+
+    # Metrics arguments
+    parser.add_argument(
+        "--metrics-jsonl",
+        type=str,
+        default=None,
+        help="Append per-step metrics (latency, it/s, memory) to this JSONL file"
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=str,
+        default=None,
+        help="Write per-step metrics to this Prometheus textfile (.prom)"
+    )
+    parser.add_argument(
+        "--usage-log",
+        type=str,
+        default=None,
+        help="Log GPU time per job to this usage log (see runpod/cost_monitor.py summary)"
+    )
+
+    # Server arguments
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="Submit to a running generation server (e.g. http://127.0.0.1:7860) instead of loading models"
+    )
 
     args = parser.parse_args()
 
+    if args.server:
+        from client import submit_job
+        if args.lora:
+            print("Warning: --lora is ignored in server mode; the server uses its configured LoRAs")
+        status = submit_job(args.server, "image", {
+            "prompt": args.prompt,
+            "negative_prompt": args.negative_prompt,
+            "width": args.width,
+            "height": args.height,
+            "num_inference_steps": args.steps,
+            "guidance_scale": args.guidance_scale,
+            "num_images": args.num_images,
+            "seed": args.seed,
+            "lora_scale": args.lora_scale,
+            "batch_size": args.batch_size,
+            "scheduler": args.scheduler,
+            "cfg_cutoff": args.cfg_cutoff,
+            "cfg_converge": args.cfg_converge,
+            "deep_cache_interval": args.deep_cache_interval,
+            "token_merge_ratio": args.token_merge_ratio,
+            "early_exit_threshold": args.early_exit_threshold,
+        })
+        for path in status["result"]["paths"]:
+            print(f"Saved: {path}")
+        print(f"\n✓ Generated {len(status['result']['paths'])} image(s) successfully!")
+        return
+
+    prompt_cache = None
+    if args.prompt_cache_dir:
+        prompt_cache = PromptEmbeddingCache(disk_dir=args.prompt_cache_dir)
+
     # Create generator
     generator = SDXLGenerator(
         model_id=args.model,
         vae_model=args.vae,
         device=args.device,
         dtype=args.dtype,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        prompt_cache=prompt_cache,
+        fused_lora_dir=args.fused_lora_dir,
+        output_format=args.output_format,
+        png_compress_level=args.png_compress_level,
+        step_metrics=build_step_metrics(args.device, args.metrics_jsonl, args.metrics_prom, args.usage_log),
+        memory_mode=args.memory_mode,
+        vram_budget_gb=args.vram_budget_gb,
+        compile_models=args.compile,
+        compile_cache_dir=args.compile_cache_dir
     )
 
     # Load LoRAs
+    # --lora-scale is applied at generation time on top of each LoRA's weight
     for lora_path in args.lora:
-        generator.load_lora(lora_path, weight=args.lora_scale)
+        generator.load_lora(lora_path)
+
+    if args.compile:
+        # Compile the requested shape (the full batch and a final partial one) before timing starts
+        batch = min(args.batch_size, args.num_images)
+        batches = {batch, args.num_images % batch or batch}
+        guidance_scales = [args.guidance_scale]
+        if args.cfg_cutoff is not None or args.cfg_converge is not None:
+            guidance_scales.append(1.0)
+        generator.warmup([
+            {"width": args.width, "height": args.height, "guidance_scale": guidance_scale,
+             "batch_size": batch_size, "token_merge_ratio": args.token_merge_ratio}
+            for batch_size in sorted(batches) for guidance_scale in guidance_scales
+        ])
 
     # Generate images
     images = generator.generate(
@@ -356,10 +1065,22 @@ def main():
         num_images=args.num_images,
         seed=args.seed,
         lora_scale=args.lora_scale,
-        save_metadata=not args.no_metadata
+        save_metadata=not args.no_metadata,
+        batch_size=args.batch_size,
+        scheduler=args.scheduler,
+        cfg_cutoff=args.cfg_cutoff,
+        cfg_converge=args.cfg_converge,
+        deep_cache_interval=args.deep_cache_interval,
+        token_merge_ratio=args.token_merge_ratio,
+        early_exit_threshold=args.early_exit_threshold
     )
+    generator.writer.flush()
+    if generator.step_metrics is not None:
+        generator.step_metrics.close()
 
     print(f"\n✓ Generated {len(images)} image(s) successfully!")
+    if prompt_cache is not None:
+        print(prompt_cache.summary())
 
 
 if __name__ == "__main__":
@@ -7,15 +7,35 @@ Generates videos from images using SVD (img2vid pipeline)
 import argparse
 import json
 import os
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor
 from datetime import datetime
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Tuple, Union
 
-import torch
-from diffusers import StableVideoDiffusionPipeline
-from diffusers.utils import load_image, export_to_video
 from PIL import Image
 
+from compile_cache import DEFAULT_COMPILE_CACHE, CompileCache, bucket_key, compile_pipeline
+from deep_cache import DeepCache
+from lazy_imports import lazy_import
+from manifest import MANIFEST_NAME, OutputManifest, video_record
+from step_callbacks import EarlyExit, EarlyExitReached, chain_callbacks
+from step_metrics import StepMetrics, build_step_metrics
+from token_merging import TokenMerging, parse_token_merge_ratio, resolve_token_merge_ratio
+
+torch = lazy_import("torch")
+diffusers = lazy_import("diffusers")
+
+
+SVD_RESOLUTION = (1024, 576)
+
+
+def estimate_working_gb(num_frames: int, decode_chunk_size: int) -> float:
+    """Rough fp16 activation memory of SVD-XT at 1024x576 (compare with the scheduler's measured peak)."""
+    return 2.0 + 0.1 * num_frames + 0.25 * decode_chunk_size
+
 
 class VideoGenerator:
     """Video generator using Stable Video Diffusion."""
@@ -25,7 +45,12 @@ class VideoGenerator:
         model_id: str = "stabilityai/stable-video-diffusion-img2vid-xt",
         device: str = "cuda",
         dtype: str = "float16",
-        output_dir: str = "./outputs"
+        output_dir: str = "./outputs",
+        memory_scheduler=None,
+        resolution: Tuple[int, int] = SVD_RESOLUTION,
+        step_metrics: Optional[StepMetrics] = None,
+        compile_models: bool = False,
+        compile_cache_dir: str = DEFAULT_COMPILE_CACHE
     ):
         """
         Initialize the video generator.
@@ -35,28 +60,47 @@ class VideoGenerator:
             device: Device to run on (cuda for GPU, mps for Mac, cpu)
             dtype: Data type (float16 or float32)
             output_dir: Directory to save generated videos
+            memory_scheduler: Optional StageMemoryScheduler that places the
+                SVD components (as stage "video") instead of model offload
+            resolution: Output (width, height); SVD-XT is trained for 1024x576
+            step_metrics: Optional per-denoising-step metrics (latency, it/s, memory)
+            compile_models: torch.compile the UNet and VAE decoder (channels_last,
+                SDPA attention); each new shape compiles once, see warmup()
+            compile_cache_dir: Where compiled kernels are kept for later processes
         """
         self.model_id = model_id
         self.device = device
         self.dtype = torch.float16 if dtype == "float16" else torch.float32
+        self.resolution = tuple(resolution)
+        self.step_metrics = step_metrics
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.manifest = OutputManifest(self.output_dir / MANIFEST_NAME)
 
         print(f"Loading video generation model: {model_id}")
         print(f"Device: {device}, dtype: {dtype}")
         print("This may take a few minutes on first run...")
 
         # Load the SVD pipeline
-        self.pipe = StableVideoDiffusionPipeline.from_pretrained(
+        self.pipe = diffusers.StableVideoDiffusionPipeline.from_pretrained(
             model_id,
             torch_dtype=self.dtype,
             variant="fp16" if dtype == "float16" else None,
         )
 
+        self.memory_scheduler = memory_scheduler
+
+        # MP4 encoding runs off the device thread; at most two videos' frames wait for it
+        self._encoder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="video-encoder")
+        self._encode_slots = threading.BoundedSemaphore(2)
+
         # Move to device
-        if device == "cuda":
-            self.pipe = self.pipe.to("cuda")
-            # Enable memory efficient attention
+        if memory_scheduler is not None:
+            # Stays in host memory until the scheduler enters the video stage
+            memory_scheduler.add_stage("video", self.pipe, working_gb=estimate_working_gb(25, 8))
+        elif device == "cuda":
+            # Offload moves components to the GPU as they run; moving the whole
+            # pipeline there first would only add a full-size peak
             self.pipe.enable_model_cpu_offload()
         elif device == "mps":
             # Mac Metal support (if available)
@@ -64,41 +108,153 @@ class VideoGenerator:
         else:
             self.pipe = self.pipe.to("cpu")
 
+        self.compile_cache = None
+        if compile_models:
+            self.compile_cache = CompileCache(compile_cache_dir, device, dtype)
+            compile_pipeline(self.pipe, device)
+            print(f"Compiling UNet and VAE decoder on first use (cache: {self.compile_cache.dir})")
+
         print("Video generation model loaded successfully!")
 
+    def warmup(self, frame_counts: List[int], decode_chunk_size: int = 8, num_inference_steps: int = 2):
+        """
+        Run one short generation per frame count, so compilation happens now and not in the first jobs.
+
+        Does nothing unless the generator was created with compile_models.
+
+        Args:
+            frame_counts: Numbers of frames jobs will ask for
+            decode_chunk_size: Decode chunk size jobs will use
+            num_inference_steps: Denoising steps per warmup call
+        """
+        if self.compile_cache is None:
+            return
+        compiled = self.compile_cache.buckets()
+        width, height = self.resolution
+        image = Image.new("RGB", self.resolution)
+        for num_frames in dict.fromkeys(frame_counts):
+            bucket = bucket_key("video", width, height, 1, frames=num_frames, decode=decode_chunk_size)
+            start = time.perf_counter()
+            if self.memory_scheduler is not None:
+                self.memory_scheduler.enter("video", working_gb=estimate_working_gb(num_frames, decode_chunk_size))
+            self.pipe(
+                image,
+                height=height,
+                width=width,
+                num_frames=num_frames,
+                decode_chunk_size=decode_chunk_size,
+                num_inference_steps=num_inference_steps,
+                generator=torch.Generator(device=self.device).manual_seed(0),
+            )
+            seconds = time.perf_counter() - start
+            state = "from cache" if bucket in compiled else "compiled"
+            print(f"✓ Warmup {bucket}: {seconds:.1f}s ({state})")
+            self.compile_cache.record(bucket, seconds)
+
     def generate_video(
         self,
-        image_path: str,
+        image: Union[str, Image.Image, "torch.Tensor"],
         num_frames: int = 25,
         fps: int = 6,
         motion_bucket_id: int = 127,
         noise_aug_strength: float = 0.02,
         decode_chunk_size: int = 8,
+        num_inference_steps: int = 25,
         seed: Optional[int] = None,
-        save_metadata: bool = True
+        save_metadata: bool = True,
+        job_id: Optional[str] = None,
+        input_image_path: Optional[Union[str, Future]] = None,
+        deep_cache_interval: Optional[int] = None,
+        token_merge_ratio: Optional[Union[float, str]] = None,
+        early_exit_threshold: Optional[float] = None
     ) -> str:
         """
         Generate a video from an input image.
 
         Args:
-            image_path: Path to input image
+            image: Path to input image, or an in-memory PIL image or
+                tensor (CHW or 1CHW, values in [0, 1]) such as SDXLGenerator output
             num_frames: Number of frames to generate (default: 25, ~4 seconds at 6fps)
             fps: Frames per second for output video
             motion_bucket_id: Controls amount of motion (higher = more motion, 1-255)
             noise_aug_strength: Noise augmentation strength (0.0-1.0)
             decode_chunk_size: Chunk size for decoding (lower = less VRAM)
+            num_inference_steps: Denoising steps
             seed: Random seed for reproducibility
             save_metadata: Whether to save generation metadata
+            job_id: ID recorded in the output manifest (generated if not given)
+            input_image_path: Where an in-memory image was saved, for the
+                metadata; may be a still-pending OutputWriter future
+            deep_cache_interval: Reuse the UNet's deep features, running the
+                full UNet only every this many steps (see deep_cache.py)
+            token_merge_ratio: Fraction of spatial self-attention tokens to
+                merge, or "auto" for the resolution's default (see token_merging.py)
+            early_exit_threshold: End denoising once the predicted frames
+                change by less than this fraction between steps
 
         Returns:
             Path to generated video file
         """
-        # Load and preprocess image
-        print(f"\nLoading image: {image_path}")
-        image = load_image(image_path)
+        return self.generate_video_async(
+            image,
+            num_frames=num_frames,
+            fps=fps,
+            motion_bucket_id=motion_bucket_id,
+            noise_aug_strength=noise_aug_strength,
+            decode_chunk_size=decode_chunk_size,
+            num_inference_steps=num_inference_steps,
+            seed=seed,
+            save_metadata=save_metadata,
+            job_id=job_id,
+            input_image_path=input_image_path,
+            deep_cache_interval=deep_cache_interval,
+            token_merge_ratio=token_merge_ratio,
+            early_exit_threshold=early_exit_threshold
+        ).result()
+
+    def generate_video_async(
+        self,
+        image: Union[str, Image.Image, "torch.Tensor"],
+        num_frames: int = 25,
+        fps: int = 6,
+        motion_bucket_id: int = 127,
+        noise_aug_strength: float = 0.02,
+        decode_chunk_size: int = 8,
+        num_inference_steps: int = 25,
+        seed: Optional[int] = None,
+        save_metadata: bool = True,
+        job_id: Optional[str] = None,
+        input_image_path: Optional[Union[str, Future]] = None,
+        deep_cache_interval: Optional[int] = None,
+        token_merge_ratio: Optional[Union[float, str]] = None,
+        early_exit_threshold: Optional[float] = None
+    ) -> "Future[str]":
+        """
+        Generate video frames and encode the MP4 in the background.
 
-        # Resize image to supported resolution (1024x576 for SVD-XT)
-        image = image.resize((1024, 576))
+        Takes the same arguments as generate_video() and returns as soon as
+        the frames exist, so the device can start on the next job while the
+        previous video is encoded.
+
+        Returns:
+            Future resolving to the path of the video file
+        """
+        if isinstance(image, (str, Path)):
+            print(f"\nLoading image: {image}")
+            input_image_path = str(image)
+            image = diffusers.utils.load_image(str(image))
+        elif isinstance(image, torch.Tensor):
+            image = self.pipe.video_processor.numpy_to_pil(
+                self.pipe.video_processor.pt_to_numpy(image.detach().float().cpu().reshape(-1, *image.shape[-3:]))
+            )[0]
+
+        # Resize image to supported resolution (1024x576 for SVD-XT);
+        # SDXL output generated at that size is passed through untouched
+        if image.size != self.resolution:
+            image = image.resize(self.resolution)
+
+        if self.memory_scheduler is not None:
+            self.memory_scheduler.enter("video", working_gb=estimate_working_gb(num_frames, decode_chunk_size))
 
         # Set seed if specified
         generator = None
@@ -108,47 +264,144 @@ class VideoGenerator:
         print(f"\nGenerating video...")
         print(f"Frames: {num_frames} ({num_frames/fps:.1f} seconds at {fps} fps)")
         print(f"Motion: {motion_bucket_id}, Noise: {noise_aug_strength}")
+        if deep_cache_interval is not None:
+            print(f"Deep cache interval: {deep_cache_interval}")
+        merge_ratio = resolve_token_merge_ratio(token_merge_ratio, *self.resolution)
+
+        job_id = job_id or uuid.uuid4().hex
+        tracker = None
+        if self.step_metrics is not None:
+            tracker = self.step_metrics.track("video", job_id, num_inference_steps, pipe=self.pipe)
+        deep_cache = None
+        if deep_cache_interval is not None:
+            deep_cache = DeepCache.attach(self.pipe.unet)
+            deep_cache.start(deep_cache_interval)
+        token_merging = None
+        if merge_ratio is not None:
+            token_merging = TokenMerging.attach(self.pipe.unet)
+            token_merging.start(merge_ratio)
+        early_exit = None
+        if early_exit_threshold is not None:
+            early_exit = EarlyExit(self.pipe, num_inference_steps, early_exit_threshold)
+        callback, tensor_inputs = chain_callbacks(tracker, early_exit)
 
         # Generate video frames
-        frames = self.pipe(
-            image,
-            num_frames=num_frames,
-            motion_bucket_id=motion_bucket_id,
-            noise_aug_strength=noise_aug_strength,
-            decode_chunk_size=decode_chunk_size,
-            generator=generator,
-        ).frames[0]
+        try:
+            frames = self.pipe(
+                image,
+                height=self.resolution[1],
+                width=self.resolution[0],
+                num_frames=num_frames,
+                motion_bucket_id=motion_bucket_id,
+                noise_aug_strength=noise_aug_strength,
+                decode_chunk_size=decode_chunk_size,
+                num_inference_steps=num_inference_steps,
+                generator=generator,
+                callback_on_step_end=callback,
+                callback_on_step_end_tensor_inputs=tensor_inputs,
+            ).frames[0]
+        except EarlyExitReached as stop:
+            # SVD has no interrupt flag, so the early latents are decoded here
+            frames = self._decode(stop.latents, num_frames, decode_chunk_size)
+        finally:
+            if tracker is not None:
+                tracker.finish()
+            if deep_cache is not None:
+                stats = deep_cache.stop()
+            if token_merging is not None:
+                merge_stats = token_merging.stop()
+            if early_exit is not None:
+                early_exit.finish()
+        if deep_cache is not None:
+            print(f"Deep cache: full UNet on {stats['full_calls']}/{stats['unet_calls']} steps")
+        if token_merging is not None:
+            print(f"Token merging: {merge_ratio:.0%} of tokens merged in {merge_stats['merged_calls']} attention calls")
+        if early_exit is not None and early_exit.steps_used is not None:
+            print(f"Early exit after {early_exit.steps_used}/{num_inference_steps} steps "
+                  f"(change {early_exit.change:.4f})")
+
+        # Blocks while two earlier videos are still being encoded
+        self._encode_slots.acquire()
+        params = {
+            "job_id": job_id,
+            "input_image_path": input_image_path,
+            "num_frames": num_frames,
+            "fps": fps,
+            "motion_bucket_id": motion_bucket_id,
+            "noise_aug_strength": noise_aug_strength,
+            "num_inference_steps": num_inference_steps,
+            "seed": seed,
+            "deep_cache_interval": deep_cache_interval,
+            "token_merge_ratio": merge_ratio,
+            "early_exit_threshold": early_exit_threshold,
+            # Only with early exit on
+            "steps_used": (early_exit.steps_used or num_inference_steps) if early_exit is not None else None,
+            "save_metadata": save_metadata,
+        }
+        future = self._encoder.submit(self._export, frames, params)
+        future.add_done_callback(lambda _: self._encode_slots.release())
+        return future
+
+    def _decode(self, latents, num_frames: int, decode_chunk_size: int) -> List[Image.Image]:
+        """Finish a call that early exit ended, the way the pipeline does after its last step."""
+        with torch.no_grad():
+            frames = self.pipe.decode_latents(latents, num_frames, decode_chunk_size)
+        frames = self.pipe.video_processor.postprocess_video(video=frames, output_type="pil")[0]
+        self.pipe.maybe_free_model_hooks()
+        return frames
+
+    def _export(self, frames, params: Dict) -> str:
+        num_frames = params["num_frames"]
+        fps = params["fps"]
+        input_image_path = params["input_image_path"]
 
         # Save video
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
         video_filename = f"video_{timestamp}.mp4"
         video_path = self.output_dir / video_filename
+        counter = 1
+        while video_path.exists():
+            video_path = self.output_dir / f"video_{timestamp}_{counter}.mp4"
+            counter += 1
 
         print(f"\nExporting video to: {video_path}")
-        export_to_video(frames, str(video_path), fps=fps)
+        diffusers.utils.export_to_video(frames, str(video_path), fps=fps)
+
+        # Resolved only now, so saving an in-memory input never delays generation
+        if isinstance(input_image_path, Future):
+            input_image_path = input_image_path.result()
+
+        metadata = {
+            "job_id": params["job_id"],
+            "video_path": str(video_path),
+            "input_image": input_image_path,
+            "num_frames": num_frames,
+            "fps": fps,
+            "duration_seconds": num_frames / fps,
+            "motion_bucket_id": params["motion_bucket_id"],
+            "noise_aug_strength": params["noise_aug_strength"],
+            "num_inference_steps": params["num_inference_steps"],
+            "seed": params["seed"],
+            "deep_cache_interval": params["deep_cache_interval"],
+            "token_merge_ratio": params["token_merge_ratio"],
+            "early_exit_threshold": params["early_exit_threshold"],
+            "steps_used": params["steps_used"],
+            "model": self.model_id,
+            "timestamp": timestamp
+        }
+
+        self.manifest.append(video_record(str(video_path), metadata))
 
         # Save metadata if requested
-        if save_metadata:
-            metadata = {
-                "input_image": str(image_path),
-                "num_frames": num_frames,
-                "fps": fps,
-                "duration_seconds": num_frames / fps,
-                "motion_bucket_id": motion_bucket_id,
-                "noise_aug_strength": noise_aug_strength,
-                "seed": seed,
-                "model": self.model_id,
-                "timestamp": timestamp
-            }
-
-            metadata_path = self.output_dir / f"video_{timestamp}_metadata.json"
+        if params["save_metadata"]:
+            metadata_path = video_path.with_name(f"{video_path.stem}_metadata.json")
             with open(metadata_path, 'w') as f:
                 json.dump(metadata, f, indent=2)
             print(f"Metadata saved to: {metadata_path}")
 
         print(f"\n✓ Video generation complete!")
         print(f"Duration: {num_frames/fps:.1f} seconds")
-        print(f"Resolution: 1024x576")
+        print(f"Resolution: {self.resolution[0]}x{self.resolution[1]}")
 
         return str(video_path)
 
@@ -225,6 +478,24 @@ def main():
         default=8,
         help="Chunk size for decoding (lower = less VRAM)"
     )
+    parser.add_argument(
+        "--deep-cache-interval",
+        type=int,
+        default=None,
+        help="Run the full UNet every N steps and reuse its deep features in between (e.g. 3)"
+    )
+    parser.add_argument(
+        "--token-merge-ratio",
+        type=parse_token_merge_ratio,
+        default=None,
+        help="Merge this fraction of spatial attention tokens (e.g. 0.3), or 'auto' for the resolution's default"
+    )
+    parser.add_argument(
+        "--early-exit-threshold",
+        type=float,
+        default=None,
+        help="End denoising once the predicted frames change less than this between steps (e.g. 0.01)"
+    )
     parser.add_argument(
         "--seed",
         type=int,
@@ -236,6 +507,41 @@ def main():
         action="store_true",
         help="Don't save generation metadata"
     )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the UNet and VAE decoder (slow first run per frame count, cached on disk)"
+    )
+    parser.add_argument(
+        "--compile-cache-dir",
+        type=str,
+        default=DEFAULT_COMPILE_CACHE,
+        help="Directory for cached compiled kernels"
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        type=str,
+        default=None,
+        help="Append per-step metrics (latency, it/s, memory) to this JSONL file"
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=str,
+        default=None,
+        help="Write per-step metrics to this Prometheus textfile (.prom)"
+    )
+    parser.add_argument(
+        "--usage-log",
+        type=str,
+        default=None,
+        help="Log GPU time per job to this usage log (see runpod/cost_monitor.py summary)"
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="Submit to a running generation server (e.g. http://127.0.0.1:7860) instead of loading models"
+    )
 
     args = parser.parse_args()
 
@@ -244,25 +550,52 @@ def main():
         print(f"Error: Input image not found: {args.image}")
         return
 
+    if args.server:
+        from client import submit_job
+        status = submit_job(args.server, "video", {
+            "image_path": os.path.abspath(args.image),
+            "num_frames": args.num_frames,
+            "fps": args.fps,
+            "motion_bucket_id": args.motion_bucket_id,
+            "noise_aug_strength": args.noise_aug_strength,
+            "decode_chunk_size": args.decode_chunk_size,
+            "seed": args.seed,
+            "deep_cache_interval": args.deep_cache_interval,
+            "token_merge_ratio": args.token_merge_ratio,
+            "early_exit_threshold": args.early_exit_threshold,
+        })
+        print(f"\nVideo saved to: {status['result']['paths'][0]}")
+        return
+
     # Create generator
     generator = VideoGenerator(
         model_id=args.model,
         device=args.device,
         dtype=args.dtype,
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        step_metrics=build_step_metrics(args.device, args.metrics_jsonl, args.metrics_prom, args.usage_log),
+        compile_models=args.compile,
+        compile_cache_dir=args.compile_cache_dir
     )
+    if args.compile:
+        generator.warmup([args.num_frames], decode_chunk_size=args.decode_chunk_size)
 
     # Generate video
     video_path = generator.generate_video(
-        image_path=args.image,
+        image=args.image,
         num_frames=args.num_frames,
         fps=args.fps,
         motion_bucket_id=args.motion_bucket_id,
         noise_aug_strength=args.noise_aug_strength,
         decode_chunk_size=args.decode_chunk_size,
         seed=args.seed,
-        save_metadata=not args.no_metadata
+        save_metadata=not args.no_metadata,
+        deep_cache_interval=args.deep_cache_interval,
+        token_merge_ratio=args.token_merge_ratio,
+        early_exit_threshold=args.early_exit_threshold
     )
+    if generator.step_metrics is not None:
+        generator.step_metrics.close()
 
     print(f"\nVideo saved to: {video_path}")
     print(f"To view: open '{video_path}'")
@@ -6,7 +6,12 @@ SDXL Generator using configuration file
 import argparse
 import json
 from pathlib import Path
+from compile_cache import DEFAULT_COMPILE_CACHE
 from generate import SDXLGenerator
+from output_writer import FORMAT_EXTENSIONS
+from prompt_cache import PromptEmbeddingCache
+from schedulers import DEFAULT_SCHEDULER, SCHEDULERS
+from token_merging import parse_token_merge_ratio
 
 
 def load_config(config_path: str) -> dict:
@@ -15,6 +20,88 @@ def load_config(config_path: str) -> dict:
         return json.load(f)
 
 
+def resolve_preset(config: dict, preset: str = None) -> dict:
+    """Merge a preset over the config's generation defaults."""
+    params = dict(config.get("generation_defaults", {}))
+    if preset:
+        presets = config.get("presets", {})
+        if preset in presets:
+            params.update(presets[preset])
+        else:
+            print(f"Warning: Preset '{preset}' not found in config")
+    return params
+
+
+def _override(value, default):
+    """Command line value if given (0 counts), else the config's."""
+    return value if value is not None else default
+
+
+def warmup_shapes(config: dict) -> list:
+    """Shapes of the generation defaults and every preset, for SDXLGenerator.warmup()."""
+    batch_sizes = config.get("model", {}).get("warmup_batch_sizes", [1])
+    shapes = []
+    for preset in [None] + list(config.get("presets", {})):
+        params = resolve_preset(config, preset)
+        guidance_scales = [params.get("guidance_scale", 7.5)]
+        if params.get("cfg_cutoff") is not None or params.get("cfg_converge") is not None:
+            # Steps after the guidance cutoff run the UNet without the CFG batch
+            guidance_scales.append(1.0)
+        for batch_size in batch_sizes:
+            for guidance_scale in guidance_scales:
+                shapes.append({
+                    "width": params.get("width", 1024),
+                    "height": params.get("height", 1024),
+                    "guidance_scale": guidance_scale,
+                    "batch_size": batch_size,
+                    "token_merge_ratio": params.get("token_merge_ratio"),
+                })
+    return shapes
+
+
+def load_jobs(jobs_path: str) -> list:
+    """Load generation jobs from a JSONL file (one JSON object per line)."""
+    jobs = []
+    with open(jobs_path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                jobs.append(json.loads(line))
+    return jobs
+
+
+def run_on_server(args):
+    """Submit the prompt or jobs to a generation server; presets resolve server-side."""
+    from client import submit_job, wait_for_job
+
+    jobs = load_jobs(args.jobs) if args.jobs else [{"prompt": args.prompt}]
+    submitted = []
+    for job in jobs:
+        payload = {
+            "prompt": job["prompt"],
+            "preset": job.get("preset", args.preset),
+            "negative_prompt": job.get("negative_prompt", args.negative_prompt),
+            "seed": job.get("seed", args.seed),
+            "num_images": job.get("num_images", args.num_images),
+            "batch_size": args.batch_size,
+            "scheduler": job.get("scheduler", args.scheduler),
+            "cfg_cutoff": job.get("cfg_cutoff", args.cfg_cutoff),
+            "cfg_converge": job.get("cfg_converge", args.cfg_converge),
+            "deep_cache_interval": job.get("deep_cache_interval", args.deep_cache_interval),
+            "token_merge_ratio": job.get("token_merge_ratio", args.token_merge_ratio),
+            "early_exit_threshold": job.get("early_exit_threshold", args.early_exit_threshold),
+            "loras": job.get("loras", args.enable_lora or None),
+        }
+        submitted.append(submit_job(args.server, "image", payload, wait=False))
+
+    paths = []
+    for status in submitted:
+        paths.extend(wait_for_job(args.server, status["jobId"])["result"]["paths"])
+    for path in paths:
+        print(f"Saved: {path}")
+    print(f"\n✓ Generated {len(paths)} image(s) for {len(jobs)} job(s) successfully!")
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="Generate images using SDXL with a configuration file"
@@ -35,9 +122,15 @@ def main():
     parser.add_argument(
         "--prompt",
         type=str,
-        required=True,
+        default=None,
         help="Text prompt for image generation"
     )
+    parser.add_argument(
+        "--jobs",
+        type=str,
+        default=None,
+        help="JSONL file of jobs ({\"prompt\", \"preset\", \"seed\", ...} per line) to batch together"
+    )
     parser.add_argument(
         "--negative-prompt",
         type=str,
@@ -51,12 +144,61 @@ def main():
         default=[],
         help="Enable specific LoRA by name from config (can specify multiple)"
     )
+    parser.add_argument(
+        "--fused-lora-dir",
+        type=str,
+        default=None,
+        help="Fuse enabled LoRAs into the model weights, caching snapshots here (overrides config)"
+    )
+    parser.add_argument(
+        "--scheduler",
+        type=str,
+        default=None,
+        choices=list(SCHEDULERS),
+        help="Sampler (overrides the preset's scheduler)"
+    )
+    parser.add_argument(
+        "--cfg-cutoff",
+        type=float,
+        default=None,
+        help="Fraction of steps that use guidance (overrides the preset's cfg_cutoff)"
+    )
+    parser.add_argument(
+        "--cfg-converge",
+        type=float,
+        default=None,
+        help="Stop guidance once its delta changes less than this between steps (overrides config)"
+    )
+    parser.add_argument(
+        "--deep-cache-interval",
+        type=int,
+        default=None,
+        help="Run the full UNet every N steps, reusing deep features in between (overrides the preset's)"
+    )
+    parser.add_argument(
+        "--token-merge-ratio",
+        type=parse_token_merge_ratio,
+        default=None,
+        help="Fraction of attention tokens to merge, or 'auto' (overrides the preset's token_merge_ratio)"
+    )
+    parser.add_argument(
+        "--early-exit-threshold",
+        type=float,
+        default=None,
+        help="End denoising once the image changes less than this between steps (overrides the preset's)"
+    )
     parser.add_argument(
         "--num-images",
         type=int,
         default=1,
         help="Number of images to generate"
     )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=1,
+        help="Images denoised per pipeline call (halved automatically on OOM)"
+    )
     parser.add_argument(
         "--seed",
         type=int,
@@ -69,8 +211,43 @@ def main():
         default="./outputs",
         help="Directory to save generated images"
     )
+    parser.add_argument(
+        "--output-format",
+        type=str,
+        default="png",
+        choices=list(FORMAT_EXTENSIONS),
+        help="Image file format (webp is lossless)"
+    )
+    parser.add_argument(
+        "--png-compress-level",
+        type=int,
+        default=6,
+        help="PNG zlib compression level (0-9, lower is faster)"
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the UNet and VAE decoder (overrides config)"
+    )
+    parser.add_argument(
+        "--warmup",
+        action="store_true",
+        help="With compile, first compile every preset's shape (fills the on-disk compile cache)"
+    )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="Submit to a running generation server (e.g. http://127.0.0.1:7860) instead of loading models"
+    )
 
     args = parser.parse_args()
+    if not args.prompt and not args.jobs:
+        parser.error("one of --prompt or --jobs is required")
+
+    if args.server:
+        run_on_server(args)
+        return
 
     # Load configuration
     config = load_config(args.config)
@@ -79,17 +256,20 @@ def main():
     # Get model settings
     model_config = config.get("model", {})
 
-    # Get generation defaults
-    gen_defaults = config.get("generation_defaults", {})
-
-    # Apply preset if specified
+    # Get generation defaults, with the preset applied if specified
     if args.preset:
-        presets = config.get("presets", {})
-        if args.preset in presets:
-            print(f"Using preset: {args.preset}")
-            gen_defaults.update(presets[args.preset])
-        else:
-            print(f"Warning: Preset '{args.preset}' not found in config")
+        print(f"Using preset: {args.preset}")
+    gen_defaults = resolve_preset(config, args.preset)
+
+    # Prompt embedding cache (the default negative prompt is shared by most runs)
+    prompt_cache = None
+    cache_config = config.get("prompt_cache")
+    if cache_config and cache_config.get("enabled", True):
+        prompt_cache = PromptEmbeddingCache(
+            memory_budget_mb=cache_config.get("memory_budget_mb", 256),
+            disk_dir=cache_config.get("disk_dir"),
+            disk_budget_mb=cache_config.get("disk_budget_mb", 2048)
+        )
 
     # Create generator
     generator = SDXLGenerator(
@@ -97,7 +277,16 @@ def main():
         vae_model=model_config.get("vae_model"),
         device=model_config.get("device", "mps"),
         dtype=model_config.get("dtype", "float16"),
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        prompt_cache=prompt_cache,
+        lora_memory_mb=model_config.get("lora_memory_mb"),
+        fused_lora_dir=args.fused_lora_dir or model_config.get("fused_lora_dir"),
+        output_format=args.output_format,
+        png_compress_level=args.png_compress_level,
+        memory_mode=model_config.get("memory_mode", "auto"),
+        vram_budget_gb=model_config.get("vram_budget_gb"),
+        compile_models=args.compile or model_config.get("compile", False),
+        compile_cache_dir=model_config.get("compile_cache_dir") or DEFAULT_COMPILE_CACHE
     )
 
     # Load enabled LoRAs
@@ -124,6 +313,50 @@ def main():
         else:
             print(f"Warning: LoRA file not found: {lora_path}")
 
+    if args.warmup:
+        generator.warmup(warmup_shapes(config))
+
+    # Generate a batch of jobs, bucketed by shape
+    if args.jobs:
+        requests = []
+        for job in load_jobs(args.jobs):
+            params = resolve_preset(config, job.get("preset", args.preset))
+            negative_prompt = job.get("negative_prompt", args.negative_prompt)
+            requests.append({
+                "prompt": job["prompt"],
+                "negative_prompt": negative_prompt if negative_prompt is not None else params.get("negative_prompt", ""),
+                "width": params.get("width", 1024),
+                "height": params.get("height", 1024),
+                "num_inference_steps": params.get("num_inference_steps", 30),
+                "guidance_scale": params.get("guidance_scale", 7.5),
+                "scheduler": job.get("scheduler", args.scheduler or params.get("scheduler", DEFAULT_SCHEDULER)),
+                "cfg_cutoff": job.get("cfg_cutoff", _override(args.cfg_cutoff, params.get("cfg_cutoff"))),
+                "cfg_converge": job.get("cfg_converge", _override(args.cfg_converge, params.get("cfg_converge"))),
+                "deep_cache_interval": job.get(
+                    "deep_cache_interval", _override(args.deep_cache_interval, params.get("deep_cache_interval"))
+                ),
+                "token_merge_ratio": job.get(
+                    "token_merge_ratio", _override(args.token_merge_ratio, params.get("token_merge_ratio"))
+                ),
+                "early_exit_threshold": job.get(
+                    "early_exit_threshold", _override(args.early_exit_threshold, params.get("early_exit_threshold"))
+                ),
+                "seed": job.get("seed", args.seed),
+                "num_images": job.get("num_images", args.num_images),
+            })
+
+        results = generator.generate_many(
+            requests,
+            lora_scale=gen_defaults.get("lora_scale", 1.0),
+            save_metadata=True,
+            max_batch_size=args.batch_size
+        )
+        generator.writer.flush()
+        print(f"\n✓ Generated {sum(len(r) for r in results)} image(s) for {len(results)} job(s) successfully!")
+        if prompt_cache is not None:
+            print(prompt_cache.summary())
+        return
+
     # Generate images
     negative_prompt = args.negative_prompt if args.negative_prompt is not None else gen_defaults.get("negative_prompt", "")
 
@@ -137,10 +370,20 @@ def main():
         num_images=args.num_images,
         seed=args.seed,
         lora_scale=gen_defaults.get("lora_scale", 1.0),
-        save_metadata=True
+        save_metadata=True,
+        batch_size=args.batch_size,
+        scheduler=args.scheduler or gen_defaults.get("scheduler", DEFAULT_SCHEDULER),
+        cfg_cutoff=_override(args.cfg_cutoff, gen_defaults.get("cfg_cutoff")),
+        cfg_converge=_override(args.cfg_converge, gen_defaults.get("cfg_converge")),
+        deep_cache_interval=_override(args.deep_cache_interval, gen_defaults.get("deep_cache_interval")),
+        token_merge_ratio=_override(args.token_merge_ratio, gen_defaults.get("token_merge_ratio")),
+        early_exit_threshold=_override(args.early_exit_threshold, gen_defaults.get("early_exit_threshold"))
     )
+    generator.writer.flush()
 
     print(f"\n✓ Generated {len(images)} image(s) successfully!")
+    if prompt_cache is not None:
+        print(prompt_cache.summary())
 
 
 if __name__ == "__main__":
@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+Lazy Imports
+Defers heavy imports (torch, diffusers, ...) until first use, so --help and argument errors return immediately
+"""
+
+import atexit
+import importlib
+import os
+import sys
+import time
+import types
+from pathlib import Path
+from typing import Dict, List
+
+
+# Set to 1 to print which heavy modules were imported, from where, and how long each took
+REPORT_ENV = "IMPORT_REPORT"
+
+_started = time.perf_counter()
+_imports: List[Dict] = []
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported the first time one of its attributes is used."""
+
+    def __init__(self, name: str):
+        super().__init__(name)
+        self._module = None
+
+    def _load(self) -> types.ModuleType:
+        if self._module is None:
+            name = self.__name__
+            loaded = name in sys.modules
+            start = time.perf_counter()
+            self._module = importlib.import_module(name)
+            if not loaded:
+                # Two frames up is the code that touched the attribute
+                caller = sys._getframe(2)
+                _imports.append({
+                    "module": name,
+                    "seconds": time.perf_counter() - start,
+                    "at": time.perf_counter() - _started,
+                    "first_use": f"{Path(caller.f_code.co_filename).name}:{caller.f_lineno}",
+                })
+        return self._module
+
+    def __getattr__(self, attr: str):
+        return getattr(self._load(), attr)
+
+    def __dir__(self):
+        return dir(self._load())
+
+    def __repr__(self):
+        state = "loaded" if self._module is not None else "not loaded"
+        return f"<lazy module '{self.__name__}' ({state})>"
+
+
+def lazy_import(name: str):
+    """
+    Module stand-in that imports the module on first attribute access.
+
+    Use for module-level imports of heavy packages in code that CLIs import,
+    e.g. torch = lazy_import("torch"), then torch.float16 as usual. Names that
+    would be pulled in with "from x import y" are reached as x.y instead, and
+    annotations naming heavy types are quoted so defining a function does not
+    trigger the import.
+
+    Args:
+        name: Fully qualified module name (e.g. "accelerate.hooks")
+
+    Returns:
+        The module itself if it is already imported, else a LazyModule
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
+
+
+def import_report() -> List[Dict]:
+    """Heavy imports triggered so far: {"module", "seconds", "at", "first_use"}, in order."""
+    return list(_imports)
+
+
+def print_import_report():
+    """Print the heavy imports and their cost (nested imports are counted in the outer one)."""
+    print(f"\nImport report ({time.perf_counter() - _started:.2f}s since startup):", file=sys.stderr)
+    if not _imports:
+        print("  no heavy modules imported", file=sys.stderr)
+    for entry in _imports:
+        print(f"  {entry['module']:<24} {entry['seconds']:>6.2f}s  at {entry['at']:>6.2f}s  "
+              f"first used at {entry['first_use']}", file=sys.stderr)
+
+
+if os.environ.get(REPORT_ENV) == "1":
+    atexit.register(print_import_report)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+"""
+Fused LoRA Snapshots
+Fuse hot LoRA combinations into the base weights once and reload them from disk
+"""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from lazy_imports import lazy_import
+
+torch = lazy_import("torch")
+safetensors = lazy_import("safetensors")
+safetensors_torch = lazy_import("safetensors.torch")
+
+
+COMPONENTS = ("unet", "text_encoder", "text_encoder_2")
+
+
+class FusedLoRACache:
+    """
+    Apply LoRA combinations as fused weights, with content-addressed snapshots.
+
+    The first time a combination is requested its adapters are loaded through
+    the LoRA pool, fused with fuse_lora(), and the affected weights are saved
+    to <snapshot_dir>/<key>.safetensors. The key hashes the model, the LoRA
+    file contents, their effective weights and the dtype, so later processes
+    load the snapshot and copy it in instead of converting and fusing.
+
+    Original values of every weight a snapshot touches are kept on the CPU so
+    switching combinations (or back to no LoRAs) restores them exactly. Fused
+    weights live on the shared pipeline modules, so they affect every
+    generator using the same base model.
+    """
+
+    def __init__(self, pipe, lora_pool, snapshot_dir: str = "./cache/fused_loras"):
+        """
+        Initialize the cache.
+
+        Args:
+            pipe: SDXL pipeline to fuse into
+            lora_pool: LoRAPool used to load adapters when building a snapshot
+            snapshot_dir: Directory for fused weight snapshots
+        """
+        self.pipe = pipe
+        self.lora_pool = lora_pool
+        self.snapshot_dir = Path(snapshot_dir)
+        self.snapshot_dir.mkdir(parents=True, exist_ok=True)
+
+        self._base: Dict[str, torch.Tensor] = {}
+        self._applied: List[str] = []
+        self._current: Optional[str] = None
+        self._file_hashes: Dict[Tuple[str, int, float], str] = {}
+        self.stats = {"snapshot_loads": 0, "fusions": 0}
+
+    def snapshot_key(self, model_id: str, loras: List[Dict], scale: float) -> str:
+        """Content address of a fused LoRA combination."""
+        payload = {
+            "model": model_id,
+            "dtype": str(self.pipe.unet.dtype),
+            "loras": sorted(
+                [self._file_hash(lora["path"]), round(lora["weight"] * scale, 6)] for lora in loras
+            ),
+        }
+        return hashlib.sha256(json.dumps(payload, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def apply(self, model_id: str, loras: List[Dict], scale: float = 1.0):
+        """
+        Make the pipeline's weights equal to base + the given fused LoRAs.
+
+        Args:
+            model_id: Base model ID (part of the snapshot key)
+            loras: List of {"name", "path", "weight"} dicts (empty restores base weights)
+            scale: Multiplier applied on top of each LoRA's own weight
+        """
+        key = self.snapshot_key(model_id, loras, scale) if loras else None
+        if key == self._current:
+            return
+
+        self.restore_base()
+        if key is None:
+            return
+
+        path = self.snapshot_dir / f"{key}.safetensors"
+        if not path.exists():
+            print(f"Fusing {len(loras)} LoRA(s) into snapshot {key[:12]}...")
+            self._build_snapshot(path, model_id, loras, scale)
+            self.stats["fusions"] += 1
+        else:
+            print(f"Loading fused LoRA snapshot {key[:12]}")
+            self.stats["snapshot_loads"] += 1
+
+        self._load_snapshot(path)
+        self._current = key
+
+    def restore_base(self):
+        """Put back the original values of every weight changed by a snapshot."""
+        with torch.no_grad():
+            for name in self._applied:
+                self._param(name).copy_(self._base[name])
+        self._applied = []
+        self._current = None
+
+    def _build_snapshot(self, path: Path, model_id: str, loras: List[Dict], scale: float):
+        self.lora_pool.activate(loras, scale)
+        names = [lora["name"] for lora in loras]
+
+        # Every layer wrapped by an adapter in this combination
+        targets = []
+        for component in COMPONENTS:
+            module = getattr(self.pipe, component)
+            for module_name, submodule in module.named_modules():
+                adapters = getattr(submodule, "lora_A", None)
+                if adapters is not None and hasattr(submodule, "base_layer") and any(n in adapters for n in names):
+                    targets.append(f"{component}.{module_name}.weight")
+        for name in targets:
+            self._remember_base(name)
+
+        self.pipe.fuse_lora(components=list(COMPONENTS), lora_scale=1.0, adapter_names=names)
+        # clone(): on CPU .cpu() would alias the weights that are restored below
+        fused = {name: self._param(name).detach().cpu().clone() for name in targets}
+        self.pipe.unfuse_lora(components=list(COMPONENTS))
+        self.lora_pool.activate([])
+
+        # Unfusing subtracts the delta again; restore the exact originals
+        with torch.no_grad():
+            for name in targets:
+                self._param(name).copy_(self._base[name])
+
+        tmp_path = path.with_suffix(".tmp")
+        safetensors_torch.save_file(fused, str(tmp_path), metadata={
+            "model": model_id,
+            "loras": json.dumps([[lora["path"], lora["weight"] * scale] for lora in loras]),
+        })
+        os.replace(tmp_path, path)
+
+    def _load_snapshot(self, path: Path):
+        # Adapters must be inactive or they would be applied on top of the fused weights
+        self.lora_pool.activate([])
+        with safetensors.safe_open(str(path), framework="pt", device="cpu") as f, torch.no_grad():
+            for name in f.keys():
+                self._remember_base(name)
+                self._param(name).copy_(f.get_tensor(name))
+                self._applied.append(name)
+
+    def _remember_base(self, name: str):
+        if name not in self._base:
+            self._base[name] = self._param(name).detach().cpu().clone()
+
+    def _param(self, name: str) -> "torch.Tensor":
+        """Resolve 'component.module.path.weight', looking through PEFT wrappers."""
+        component, rest = name.split(".", 1)
+        module_path, param_name = rest.rsplit(".", 1)
+        module = getattr(self.pipe, component).get_submodule(module_path)
+        if hasattr(module, "base_layer"):
+            module = module.base_layer
+        return getattr(module, param_name)
+
+    def _file_hash(self, path: str) -> str:
+        stat = os.stat(path)
+        cache_key = (path, stat.st_size, stat.st_mtime)
+        if cache_key not in self._file_hashes:
+            digest = hashlib.sha256()
+            with open(path, "rb") as f:
+                for block in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(block)
+            self._file_hashes[cache_key] = digest.hexdigest()
+        return self._file_hashes[cache_key]
@@ -0,0 +1,149 @@
+#!/usr/bin/env python3
+"""
+LoRA Adapter Pool
+Keeps recently used LoRA adapters resident and switches between sets with set_adapters
+"""
+
+import os
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+
+def _state_dict_bytes(state_dict: Dict) -> int:
+    return sum(t.element_size() * t.numel() for t in state_dict.values())
+
+
+class LoRAPool:
+    """
+    Manage LoRA adapters on one pipeline's UNet and text encoders.
+
+    Adapters stay loaded after use and are evicted least-recently-used first
+    once the resident size exceeds memory_budget_mb. Parsed and key-converted
+    state dicts are kept on the CPU (up to state_dict_cache_mb), so reloading
+    an evicted adapter skips reading and converting the file again.
+    """
+
+    def __init__(self, pipe, memory_budget_mb: float = 1024, state_dict_cache_mb: float = 2048):
+        """
+        Initialize the pool.
+
+        Args:
+            pipe: SDXL pipeline whose modules hold the adapters
+            memory_budget_mb: Maximum size of adapters resident on the pipeline
+            state_dict_cache_mb: Maximum size of converted state dicts kept on CPU
+        """
+        self.pipe = pipe
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.state_dict_cache_budget = int(state_dict_cache_mb * 1024 * 1024)
+
+        # adapter name -> {"path", "mtime", "bytes"}, least recently used first
+        self._resident: "OrderedDict[str, Dict]" = OrderedDict()
+        # (path, mtime) -> (state_dict, network_alphas), least recently used first
+        self._state_dicts: "OrderedDict[Tuple[str, float], Tuple[Dict, Optional[Dict]]]" = OrderedDict()
+        self._active: Optional[Tuple] = None
+        self.stats = {"hits": 0, "loads": 0, "parses": 0, "evictions": 0}
+
+    def activate(self, loras: List[Dict], scale: float = 1.0):
+        """
+        Make exactly the given adapters active.
+
+        Args:
+            loras: List of {"name", "path", "weight"} dicts
+            scale: Multiplier applied on top of each LoRA's own weight
+        """
+        for lora in loras:
+            self._ensure_resident(lora["name"], lora["path"])
+
+        active = tuple((lora["name"], lora["weight"] * scale) for lora in loras)
+        if active == self._active:
+            return
+
+        if active:
+            self.pipe.enable_lora()
+            self.pipe.set_adapters(
+                [name for name, _ in active],
+                adapter_weights=[weight for _, weight in active]
+            )
+        elif self._resident:
+            self.pipe.disable_lora()
+        self._active = active
+        self._evict(keep={lora["name"] for lora in loras})
+
+    def remove(self, names: List[str]):
+        """Delete adapters from the pipeline (state dicts stay cached)."""
+        names = [name for name in names if name in self._resident]
+        if names:
+            self.pipe.delete_adapters(names)
+            for name in names:
+                del self._resident[name]
+            self._active = None
+
+    def resident_bytes(self) -> int:
+        return sum(entry["bytes"] for entry in self._resident.values())
+
+    def _ensure_resident(self, name: str, path: str):
+        mtime = os.path.getmtime(path)
+        entry = self._resident.get(name)
+        if entry is not None:
+            if entry["path"] == path and entry["mtime"] == mtime:
+                self._resident.move_to_end(name)
+                self.stats["hits"] += 1
+                return
+            # Same name now refers to a different file
+            self.remove([name])
+
+        state_dict, network_alphas = self._converted_state_dict(path, mtime)
+        self._load_adapter(name, state_dict, network_alphas)
+        self._resident[name] = {"path": path, "mtime": mtime, "bytes": _state_dict_bytes(state_dict)}
+        self._active = None
+        self.stats["loads"] += 1
+
+    def _converted_state_dict(self, path: str, mtime: float):
+        key = (path, mtime)
+        if key in self._state_dicts:
+            self._state_dicts.move_to_end(key)
+            return self._state_dicts[key]
+
+        # Reads the file and converts Kohya/A1111 keys to the diffusers layout
+        state_dict, network_alphas = self.pipe.lora_state_dict(path, unet_config=self.pipe.unet.config)
+        self.stats["parses"] += 1
+        self._state_dicts[key] = (state_dict, network_alphas)
+
+        total = sum(_state_dict_bytes(sd) for sd, _ in self._state_dicts.values())
+        while total > self.state_dict_cache_budget and len(self._state_dicts) > 1:
+            _, (evicted, _) = self._state_dicts.popitem(last=False)
+            total -= _state_dict_bytes(evicted)
+        return state_dict, network_alphas
+
+    def _load_adapter(self, name: str, state_dict: Dict, network_alphas: Optional[Dict]):
+        """Same steps as load_lora_weights(), starting from an already-converted state dict."""
+        pipe = self.pipe
+        # The loaders may rewrite keys in place, so hand them copies
+        network_alphas = dict(network_alphas) if network_alphas else None
+        pipe.load_lora_into_unet(
+            dict(state_dict), network_alphas=network_alphas, unet=pipe.unet, adapter_name=name, _pipeline=pipe
+        )
+        for prefix, text_encoder in (("text_encoder", pipe.text_encoder), ("text_encoder_2", pipe.text_encoder_2)):
+            text_encoder_state_dict = {k: v for k, v in state_dict.items() if k.startswith(f"{prefix}.")}
+            if text_encoder_state_dict:
+                pipe.load_lora_into_text_encoder(
+                    text_encoder_state_dict,
+                    network_alphas=network_alphas,
+                    text_encoder=text_encoder,
+                    prefix=prefix,
+                    lora_scale=pipe.lora_scale,
+                    adapter_name=name,
+                    _pipeline=pipe,
+                )
+
+    def _evict(self, keep: set):
+        total = self.resident_bytes()
+        for name in list(self._resident):
+            if total <= self.memory_budget:
+                break
+            if name in keep:
+                continue
+            total -= self._resident[name]["bytes"]
+            self.pipe.delete_adapters([name])
+            del self._resident[name]
+            self.stats["evictions"] += 1
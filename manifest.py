@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+"""
+Output Manifest
+Append-only JSONL index of generated images and videos, so results are found by job id, seed or prompt instead of globbing
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import struct
+import threading
+import zlib
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from output_writer import EXIF_DESCRIPTION_TAG, FORMAT_EXTENSIONS
+
+
+MANIFEST_NAME = "manifest.jsonl"
+INDEXED_FIELDS = ("job_id", "seed", "prompt_hash", "model")
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+
+
+def prompt_hash(prompt: str) -> str:
+    """Short stable hash used to look up outputs by prompt."""
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+def read_png_text(path: str) -> Dict[str, str]:
+    """
+    Read PNG text chunks (tEXt, zTXt, iTXt) without decoding any pixel data.
+
+    Image data chunks are skipped with seek(), so this costs a few small
+    reads per file regardless of resolution.
+    """
+    text = {}
+    with open(path, "rb") as f:
+        if f.read(8) != PNG_SIGNATURE:
+            return text
+        while True:
+            header = f.read(8)
+            if len(header) < 8:
+                break
+            length, chunk_type = struct.unpack(">I4s", header)
+            if chunk_type in (b"tEXt", b"zTXt", b"iTXt"):
+                key, _, value = f.read(length).partition(b"\0")
+                encoding = "latin-1"
+                if chunk_type == b"zTXt":
+                    value = zlib.decompress(value[1:])
+                elif chunk_type == b"iTXt":
+                    compressed, value = value[0], value[2:]
+                    _, _, value = value.partition(b"\0")  # language tag
+                    _, _, value = value.partition(b"\0")  # translated keyword
+                    if compressed:
+                        value = zlib.decompress(value)
+                    encoding = "utf-8"
+                text[key.decode("latin-1")] = value.decode(encoding)
+                f.seek(4, os.SEEK_CUR)  # CRC
+            elif chunk_type == b"IEND":
+                break
+            else:
+                f.seek(length + 4, os.SEEK_CUR)
+    return text
+
+
+def read_image_metadata(path: str) -> Dict[str, str]:
+    """
+    Read the metadata OutputWriter embedded in an image of any output format.
+
+    PNG files carry it as text chunks; WebP and JPEG as JSON in the EXIF
+    ImageDescription, which PIL reads from the header without decoding pixels.
+    """
+    if Path(path).suffix == FORMAT_EXTENSIONS["png"]:
+        return read_png_text(path)
+    with Image.open(path) as image:
+        description = image.getexif().get(EXIF_DESCRIPTION_TAG)
+    if not description:
+        return {}
+    try:
+        metadata = json.loads(description)
+    except json.JSONDecodeError:
+        return {}
+    return metadata if isinstance(metadata, dict) else {}
+
+
+class OutputManifest:
+    """Append-only record of generated outputs with an in-memory lookup index."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the manifest.
+
+        Args:
+            path: JSONL file to append to (created on first write)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        # Built on first lookup so writers never pay for reading the file
+        self._records: Optional[List[Dict]] = None
+        self._index: Dict[str, Dict[str, List[int]]] = {}
+
+    def append(self, record: Dict):
+        """Append one output record (one line, written with a single O_APPEND write)."""
+        line = (json.dumps(record, sort_keys=True) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            if self._records is not None:
+                self._add_to_index(record)
+
+    def find(self, **filters) -> List[Dict]:
+        """
+        Find records matching all given fields.
+
+        Args:
+            filters: Any of job_id, seed, prompt_hash, model (indexed) or other record fields
+
+        Returns:
+            Matching records in the order they were written
+        """
+        with self._lock:
+            if self._records is None:
+                self._load()
+            candidates = None
+            for field in INDEXED_FIELDS:
+                if field in filters:
+                    hits = set(self._index[field].get(str(filters[field]), []))
+                    candidates = hits if candidates is None else candidates & hits
+            if candidates is None:
+                candidates = range(len(self._records))
+            return [
+                self._records[i] for i in sorted(candidates)
+                if all(str(self._records[i].get(k)) == str(v) for k, v in filters.items())
+            ]
+
+    def rebuild(self, output_dir: str) -> int:
+        """
+        Recreate the manifest from embedded image metadata (every output format) and video metadata files in output_dir.
+
+        Returns:
+            Number of records written
+        """
+        records = []
+        images = [p for ext in FORMAT_EXTENSIONS.values() for p in Path(output_dir).glob(f"*{ext}")]
+        for image_path in sorted(images):
+            metadata = read_image_metadata(str(image_path))
+            if "prompt" not in metadata:
+                continue
+            records.append(image_record(str(image_path), metadata))
+        for metadata_file in sorted(Path(output_dir).glob("video_*_metadata.json")):
+            with open(metadata_file, "r") as f:
+                metadata = json.load(f)
+            video_path = metadata.get("video_path") or str(metadata_file).replace("_metadata.json", ".mp4")
+            records.append(video_record(video_path, metadata))
+
+        with self._lock:
+            tmp_path = self.path.with_suffix(".tmp")
+            with open(tmp_path, "w") as f:
+                for record in records:
+                    f.write(json.dumps(record, sort_keys=True) + "\n")
+            os.replace(tmp_path, self.path)
+            self._records = None
+            self._index = {}
+        return len(records)
+
+    def _load(self):
+        self._records = []
+        self._index = {field: {} for field in INDEXED_FIELDS}
+        if self.path.exists():
+            with open(self.path, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line:
+                        self._add_to_index(json.loads(line))
+
+    def _add_to_index(self, record: Dict):
+        position = len(self._records)
+        self._records.append(record)
+        for field in INDEXED_FIELDS:
+            if record.get(field) is not None:
+                self._index[field].setdefault(str(record[field]), []).append(position)
+
+
+def image_record(path: str, metadata: Dict[str, str]) -> Dict:
+    """Manifest record for an image, built from its embedded metadata."""
+    record = {
+        "type": "image",
+        "path": path,
+        "job_id": metadata.get("job_id"),
+        "prompt": metadata.get("prompt"),
+        "prompt_hash": prompt_hash(metadata.get("prompt", "")),
+        "model": metadata.get("model"),
+        "width": int(metadata["width"]) if "width" in metadata else None,
+        "height": int(metadata["height"]) if "height" in metadata else None,
+        "steps": int(metadata["steps"]) if "steps" in metadata else None,
+        "scheduler": metadata.get("scheduler"),
+        # Only with early exit on; fewer than "steps" when denoising ended early
+        "steps_used": int(metadata["steps_used"]) if "steps_used" in metadata else None,
+    }
+    seed = metadata.get("seed")
+    record["seed"] = int(seed) if seed and seed.isdigit() else seed
+    return record
+
+
+def video_record(path: str, metadata: Dict) -> Dict:
+    """Manifest record for a video, built from its metadata."""
+    return {
+        "type": "video",
+        "path": path,
+        "job_id": metadata.get("job_id"),
+        "seed": metadata.get("seed"),
+        "model": metadata.get("model"),
+        "input_image": metadata.get("input_image"),
+        "num_frames": metadata.get("num_frames"),
+        "fps": metadata.get("fps"),
+        "steps_used": metadata.get("steps_used"),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Query or rebuild the output manifest"
+    )
+
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    find_parser = subparsers.add_parser('find', help='Find outputs')
+    find_parser.add_argument('--job-id', type=str, default=None, help='Job ID')
+    find_parser.add_argument('--seed', type=int, default=None, help='Seed')
+    find_parser.add_argument('--prompt', type=str, default=None, help='Exact prompt')
+    find_parser.add_argument('--model', type=str, default=None, help='Model ID')
+
+    subparsers.add_parser('rebuild', help='Rebuild the manifest from image and video metadata')
+
+    parser.add_argument('--output-dir', type=str, default='./outputs', help='Output directory')
+
+    args = parser.parse_args()
+
+    manifest = OutputManifest(Path(args.output_dir) / MANIFEST_NAME)
+
+    if args.command == 'find':
+        filters = {}
+        if args.job_id:
+            filters["job_id"] = args.job_id
+        if args.seed is not None:
+            filters["seed"] = args.seed
+        if args.prompt:
+            filters["prompt_hash"] = prompt_hash(args.prompt)
+        if args.model:
+            filters["model"] = args.model
+        for record in manifest.find(**filters):
+            print(json.dumps(record))
+    elif args.command == 'rebuild':
+        count = manifest.rebuild(args.output_dir)
+        print(f"✓ Rebuilt manifest with {count} output(s): {manifest.path}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,366 @@
+#!/usr/bin/env python3
+"""
+Memory Planner
+Estimates the peak device memory of an SDXL generation and picks the fastest memory-saving features that fit
+"""
+
+import itertools
+import os
+from typing import Dict, List, Optional, Sequence
+
+from lazy_imports import lazy_import
+from memory_scheduler import GB, module_bytes
+
+torch = lazy_import("torch")
+
+
+# Features that shrink activation memory, with their rough slowdown (fraction of a generation)
+FEATURE_COST = {
+    # Decode the batch one image at a time
+    "vae_slicing": 0.01,
+    # Decode in overlapping tiles; only changes anything above the VAE's tile size
+    "vae_tiling": 0.05,
+    # Attention one head at a time; only saves memory where SDPA falls back to
+    # materializing the full attention matrix (mps), and replaces SDPA elsewhere
+    "attention_slicing": 0.15,
+}
+
+# Where the weights live during a call, with the same rough slowdown
+PLACEMENT_COST = {
+    "resident": 0.0,
+    # One model (text encoders, UNet, VAE) on the device at a time
+    "model_offload": 0.2,
+    # Weights streamed layer by layer
+    "sequential_offload": 3.0,
+}
+
+MEMORY_FEATURES = list(FEATURE_COST) + [p for p in PLACEMENT_COST if p != "resident"]
+
+# Features that would swap attention processors or hook layers inside a
+# torch.compile'd UNet (see compile_cache.py)
+COMPILE_DISABLED = ("attention_slicing", "sequential_offload")
+
+# Rough activation peaks in elements of the compute dtype, from fp16 SDXL runs
+# with SDPA; observe() raises them if a run on the device needs more
+UNET_ELEMENTS_PER_LATENT_PIXEL = 28_000  # per image in the UNet batch (doubled by CFG)
+VAE_ELEMENTS_PER_PIXEL = 1_000  # per decoded image, at output resolution
+
+# Device memory left for the layer in flight under sequential offload
+SEQUENTIAL_LAYER_BYTES = GB // 2
+
+
+def parse_memory_mode(mode: str, disabled: Sequence[str] = ()) -> Optional[Dict]:
+    """
+    Turn a memory mode string into a fixed plan.
+
+    Args:
+        mode: "auto" (plan per call), "none" (no memory-saving features), or a
+            comma-separated list from MEMORY_FEATURES, e.g. "vae_tiling,model_offload"
+        disabled: Features the pipeline cannot use (e.g. COMPILE_DISABLED)
+
+    Returns:
+        {"features": [...], "placement": ...}, or None for "auto"
+    """
+    if mode == "auto":
+        return None
+    names = [] if mode == "none" else [name.strip() for name in mode.split(",") if name.strip()]
+    unknown = [name for name in names if name not in MEMORY_FEATURES]
+    if unknown:
+        raise ValueError(f"Unknown memory feature(s): {', '.join(unknown)} "
+                         f"(choose from auto, none, {', '.join(MEMORY_FEATURES)})")
+    placements = [name for name in names if name in PLACEMENT_COST]
+    if len(placements) > 1:
+        raise ValueError("Choose at most one of model_offload and sequential_offload")
+    conflicting = [name for name in names if name in disabled]
+    if conflicting:
+        raise ValueError(f"Memory feature(s) {', '.join(conflicting)} cannot be used with --compile")
+    return {
+        "features": [name for name in FEATURE_COST if name in names],
+        "placement": placements[0] if placements else "resident",
+    }
+
+
+def device_budget(device: str) -> Optional[int]:
+    """Memory to plan for on a device, or None where there is nothing to plan (cpu)."""
+    if device == "cuda" and torch.cuda.is_available():
+        return int(torch.cuda.get_device_properties(0).total_memory * 0.95)
+    if device == "mps" and torch.backends.mps.is_available():
+        recommended = getattr(torch.mps, "recommended_max_memory", None)
+        if recommended is not None:
+            return int(recommended())
+        # Older torch: Metal's default working set limit is about two thirds of RAM
+        return int(os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") * 0.65)
+    return None
+
+
+class MemoryPlanner:
+    """
+    Choose memory-saving features for each SDXL pipeline call.
+
+    The peak of a call is estimated from the weights that are on the device
+    plus the larger of the UNet's activations (batch, CFG and latent size;
+    attention grows with tokens squared when SDPA cannot avoid the full
+    matrix) and the VAE decode (batch and output size, decoded in fp32 when
+    the VAE upcasts). Every combination of features and weight placement is
+    scored by its rough slowdown, and the cheapest one whose estimate fits the
+    budget is applied, so small images run with everything resident and no
+    slicing while large ones get tiling or offload instead of running out of
+    memory.
+    """
+
+    def __init__(
+        self,
+        pipe,
+        device: str,
+        mode: str = "auto",
+        budget_gb: Optional[float] = None,
+        manage_placement: bool = True,
+        disabled: Sequence[str] = (),
+        applied: Optional[Dict] = None
+    ):
+        """
+        Initialize the planner.
+
+        Args:
+            pipe: SDXL pipeline the plans are applied to
+            device: Device the pipeline runs on
+            mode: "auto", "none" or a fixed comma-separated feature list (see parse_memory_mode)
+            budget_gb: Device memory to plan for (defaults to 95% of the GPU, or
+                the Metal working set limit on mps; there is no budget on cpu)
+            manage_placement: Allow model and sequential offload. Turn off when
+                a StageMemoryScheduler places the weights; plans then only
+                count the UNet as resident and use slicing and tiling alone
+            disabled: Features and placements plans never use
+            applied: What is applied to the pipeline's modules, shared by every
+                planner whose pipeline shares them (PipelineRegistry.memory_state());
+                defaults to a private record of a freshly loaded pipeline
+        """
+        self.pipe = pipe
+        self.device = device
+        self.forced = parse_memory_mode(mode, disabled)
+        self.disabled = set(disabled)
+        self.budget = int(budget_gb * GB) if budget_gb else device_budget(device)
+        self.manage_placement = manage_placement and device == "cuda"
+        # Weights placed by a StageMemoryScheduler, which keeps the UNet resident
+        self.scheduled = not manage_placement and device == "cuda"
+        # Multiplies the activation estimates; only ever raised by measurements
+        self.correction = 1.0
+
+        self.sizes = {
+            name: module_bytes(module) for name, module in pipe.components.items()
+            if isinstance(module, torch.nn.Module)
+        }
+        self.dtype_bytes = torch.finfo(pipe.unet.dtype).bits // 8
+        # The SDXL pipeline decodes in fp32 when the VAE asks for it
+        self.vae_upcast = pipe.vae.dtype == torch.float16 and pipe.vae.config.force_upcast
+        sample_size = pipe.vae.config.sample_size
+        self.vae_tile = sample_size[0] if isinstance(sample_size, (list, tuple)) else sample_size
+        self.efficient_attention = (
+            device == "cuda" and hasattr(torch.nn.functional, "scaled_dot_product_attention")
+            and (torch.backends.cuda.flash_sdp_enabled() or torch.backends.cuda.mem_efficient_sdp_enabled())
+        )
+        # Highest-resolution attention level of the UNet and its head count
+        down_blocks = pipe.unet.config.down_block_types
+        self.attention_level = next(
+            (i for i, block in enumerate(down_blocks) if block.startswith("CrossAttn")), 0
+        )
+        heads = pipe.unet.config.num_attention_heads or pipe.unet.config.attention_head_dim
+        self.attention_heads = heads[self.attention_level] if isinstance(heads, (list, tuple)) else heads
+
+        # Updated in place, so planners of other handles on the same modules see the change
+        self.applied = applied if applied is not None else {"features": [], "placement": "resident", "hooks_on": None}
+        self.last_plan: Optional[Dict] = None
+        self._allocated_before = None
+
+    def estimate(
+        self,
+        width: int,
+        height: int,
+        batch: int,
+        guidance_scale: float,
+        features: List[str],
+        placement: str = "resident"
+    ) -> Dict:
+        """
+        Estimate the peak device memory of one pipeline call.
+
+        Returns:
+            {"peak": bytes, "working": bytes} where working is the activation
+            part (what a StageMemoryScheduler reserves next to the weights)
+        """
+        d = self.dtype_bytes
+        vae_d = 4 if self.vae_upcast else d
+
+        unet_batch = batch * (2 if guidance_scale > 1 else 1)
+        latent_pixels = (width // 8) * (height // 8)
+        unet_work = UNET_ELEMENTS_PER_LATENT_PIXEL * latent_pixels * unet_batch * d
+        if not self.efficient_attention:
+            tokens = latent_pixels // 4 ** self.attention_level
+            matrices = 1 if "attention_slicing" in features else unet_batch * self.attention_heads
+            unet_work += tokens * tokens * d * matrices
+
+        decode_batch = 1 if "vae_slicing" in features else batch
+        if "vae_tiling" in features and max(width, height) > self.vae_tile:
+            decode_pixels = min(width, self.vae_tile) * min(height, self.vae_tile)
+        else:
+            decode_pixels = width * height
+        vae_work = VAE_ELEMENTS_PER_PIXEL * decode_pixels * decode_batch * vae_d
+        if not self.efficient_attention:
+            # Single-head attention in the VAE's mid block, at 1/8 resolution
+            vae_work += (decode_pixels // 64) ** 2 * vae_d * decode_batch
+        # Decoded images, as fp32 tensors
+        vae_work += width * height * 3 * 4 * batch
+
+        unet_work = int(unet_work * self.correction)
+        vae_work = int(vae_work * self.correction)
+
+        unet = self.sizes.get("unet", 0)
+        vae = self.sizes.get("vae", 0) * vae_d // d
+        text = self.sizes.get("text_encoder", 0) + self.sizes.get("text_encoder_2", 0)
+        working = max(unet_work, vae_work)
+        if self.scheduled:
+            # The stage scheduler offloads the other components as needed
+            peak = unet + working
+        elif placement == "model_offload":
+            peak = max(text, unet + unet_work, vae + vae_work)
+        elif placement == "sequential_offload":
+            peak = SEQUENTIAL_LAYER_BYTES + working
+        else:
+            peak = unet + vae + text + working
+        return {"peak": peak, "working": working}
+
+    def plan(self, width: int, height: int, batch: int = 1, guidance_scale: float = 7.5) -> Dict:
+        """
+        Pick the fastest features whose estimated peak fits the budget.
+
+        Returns:
+            {"features", "placement", "peak", "working", "budget", "fits", "tightest"};
+            when nothing fits, the plan with the lowest peak ("tightest")
+        """
+        placements = list(PLACEMENT_COST) if self.manage_placement else ["resident"]
+        placements = [p for p in placements if p not in self.disabled]
+        available = [f for f in FEATURE_COST if f not in self.disabled]
+        candidates = []
+        for placement in placements:
+            for count in range(len(available) + 1):
+                for features in itertools.combinations(available, count):
+                    estimate = self.estimate(width, height, batch, guidance_scale, list(features), placement)
+                    cost = PLACEMENT_COST[placement] + sum(FEATURE_COST[f] for f in features)
+                    candidates.append((cost, estimate["peak"], list(features), placement, estimate))
+        lowest_peak = min(c[1] for c in candidates)
+
+        if self.forced is not None:
+            features, placement = self.forced["features"], self.forced["placement"]
+            if placement != "resident" and not self.manage_placement:
+                placement = "resident"
+            estimate = self.estimate(width, height, batch, guidance_scale, features, placement)
+        else:
+            fitting = [c for c in candidates if self.budget is None or c[1] <= self.budget]
+            if fitting:
+                _, _, features, placement, estimate = min(fitting, key=lambda c: (c[0], c[1]))
+            else:
+                _, _, features, placement, estimate = min(candidates, key=lambda c: (c[1], c[0]))
+
+        plan = {
+            "features": features,
+            "placement": placement,
+            "peak": estimate["peak"],
+            "working": estimate["working"],
+            "budget": self.budget,
+            "fits": self.budget is None or estimate["peak"] <= self.budget,
+            "tightest": estimate["peak"] <= lowest_peak,
+        }
+        self.last_plan = plan
+        return plan
+
+    def apply(self, plan: Dict, label: str = ""):
+        """Switch the pipeline to a plan's features and placement (no-op if unchanged)."""
+        if self.device == "cuda" and torch.cuda.is_available() and self.manage_placement:
+            torch.cuda.reset_peak_memory_stats()
+            self._allocated_before = torch.cuda.memory_allocated()
+
+        target = {"features": list(plan["features"]), "placement": plan["placement"]}
+        # Offload hooks sit on the shared modules, but only the pipeline that
+        # installed them offloads the last model after a call
+        hooks_moved = target["placement"] != "resident" and self.applied["hooks_on"] != id(self.pipe)
+        # The VAE can also be shared between base models, so its flags are read from the module itself
+        vae_features = [f for f, on in (("vae_slicing", getattr(self.pipe.vae, "use_slicing", False)),
+                                         ("vae_tiling", getattr(self.pipe.vae, "use_tiling", False))) if on]
+        if vae_features != [f for f in target["features"] if f.startswith("vae_")]:
+            unchanged = False
+        elif self.manage_placement:
+            unchanged = target == {"features": self.applied["features"], "placement": self.applied["placement"]}
+            unchanged = unchanged and not hooks_moved
+        else:
+            unchanged = target["features"] == self.applied["features"]
+        if unchanged:
+            return
+
+        features = set(plan["features"])
+        vae = self.pipe.vae
+        if "vae_slicing" in features:
+            vae.enable_slicing()
+        else:
+            vae.disable_slicing()
+        if "vae_tiling" in features:
+            vae.enable_tiling()
+        else:
+            vae.disable_tiling()
+        if ("attention_slicing" in features) != ("attention_slicing" in self.applied["features"]):
+            if "attention_slicing" in features:
+                self.pipe.enable_attention_slicing(1)
+            else:
+                # Restores the default (SDPA) attention processors
+                self.pipe.disable_attention_slicing()
+
+        if (plan["placement"] != self.applied["placement"] or hooks_moved) and self.manage_placement:
+            self.pipe.remove_all_hooks()
+            if plan["placement"] == "model_offload":
+                self.pipe.enable_model_cpu_offload(device=self.device)
+            elif plan["placement"] == "sequential_offload":
+                self.pipe.enable_sequential_cpu_offload(device=self.device)
+            else:
+                self.pipe.to(self.device)
+            # Measure the next call from the new placement
+            if self.device == "cuda" and torch.cuda.is_available():
+                self._allocated_before = torch.cuda.memory_allocated()
+
+        self.applied["features"] = target["features"]
+        if self.manage_placement:
+            self.applied["placement"] = target["placement"]
+            self.applied["hooks_on"] = id(self.pipe) if target["placement"] != "resident" else None
+        names = target["features"] + ([target["placement"]] if target["placement"] != "resident" else [])
+        budget_text = f" of {plan['budget'] / GB:.1f} GB" if plan["budget"] else ""
+        print(f"Memory mode{' for ' + label if label else ''}: {', '.join(names) or 'none'} "
+              f"(estimated peak {plan['peak'] / GB:.1f} GB{budget_text})")
+        if not plan["fits"]:
+            print("Warning: even the most memory-saving mode is estimated to exceed the budget")
+
+    def observe(self):
+        """
+        Compare the last call's measured activation peak with its estimate.
+
+        Only measured on cuda with resident weights (offload hooks move weights
+        during the call); a higher measurement scales all later estimates up.
+        """
+        plan = self.last_plan
+        if (plan is None or self._allocated_before is None or plan["placement"] != "resident"
+                or not plan["working"]):
+            return
+        measured = torch.cuda.max_memory_allocated() - self._allocated_before
+        self._allocated_before = None
+        ratio = measured / plan["working"]
+        if ratio > 1.0:
+            self.correction *= ratio
+
+    def record_out_of_memory(self) -> bool:
+        """
+        Raise the estimates after an out-of-memory error.
+
+        Returns:
+            Whether a retry can plan a more memory-saving mode
+        """
+        if self.forced is not None or self.budget is None:
+            return False
+        self.correction *= 1.5
+        return self.last_plan is not None and not self.last_plan["tightest"]
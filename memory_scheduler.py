@@ -0,0 +1,285 @@
+#!/usr/bin/env python3
+"""
+Stage Memory Scheduler
+Decides which pipeline components stay on the GPU for each workflow stage and moves them between stages
+"""
+
+import gc
+from typing import Dict, List, Optional
+
+from lazy_imports import lazy_import
+from pipeline_registry import empty_device_cache
+
+torch = lazy_import("torch")
+accelerate = lazy_import("accelerate")
+
+
+GB = 1024 ** 3
+
+# Denoisers run once per step, everything else once per generation
+HOT_COMPONENTS = ("unet", "transformer")
+
+
+def module_bytes(module: "torch.nn.Module") -> int:
+    """Size of a module's parameters and buffers."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.element_size() * t.numel() for t in tensors)
+
+
+class StageMemoryScheduler:
+    """
+    Place the components of several pipelines under one device memory budget.
+
+    Each stage (e.g. "image" for SDXL, "video" for SVD) registers its
+    pipeline and an estimate of the working memory its activations need.
+    On enter(), components of every other stage are parked in host memory
+    (so running that stage again costs a copy, not a reload from disk) and
+    the stage's own components are placed:
+
+    - resident: moved to the device for the whole stage
+    - offload:  kept on the host and moved to the device only while called,
+      one offloaded component at a time
+    - sequential: if even the largest component does not fit next to the
+      working memory, weights are streamed layer by layer
+
+    The denoiser is made resident first because it runs every step; the
+    remaining components follow in the pipeline's own order while they fit.
+    """
+
+    def __init__(self, device: str = "cuda", budget_gb: Optional[float] = None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            device: Device the stages run on
+            budget_gb: Device memory to plan for (defaults to 95% of the GPU's
+                total memory). On cpu and mps there is no budget: the active
+                stage is fully resident and the others are parked on the host
+        """
+        self.device = device
+        self.enabled = device == "cuda" and torch.cuda.is_available()
+        if self.enabled and budget_gb is None:
+            budget_gb = torch.cuda.get_device_properties(0).total_memory * 0.95 / GB
+        self.budget = int(budget_gb * GB) if budget_gb else None
+
+        self._stages: Dict[str, Dict] = {}
+        self._current: Optional[str] = None
+        # Stages placed together by enter_together(); enter() leaves them alone
+        self._together: List[str] = []
+        self.history: List[Dict] = []
+
+    def add_stage(self, name: str, pipe, working_gb: float = 0.0):
+        """
+        Register a stage.
+
+        Args:
+            name: Stage name used with enter()
+            pipe: Diffusers pipeline run by the stage
+            working_gb: Estimated activation memory the stage needs on top of its weights
+        """
+        components = {
+            component: module for component, module in pipe.components.items()
+            if isinstance(module, torch.nn.Module)
+        }
+        self._stages[name] = {
+            "pipe": pipe,
+            "components": components,
+            "sizes": {component: module_bytes(module) for component, module in components.items()},
+            "working": int(working_gb * GB),
+            "hooks": [],
+            "sequential": False,
+        }
+
+    def plan(self, name: str, working_gb: Optional[float] = None) -> Dict:
+        """
+        Decide placement for a stage without moving anything.
+
+        Returns:
+            {"resident": [...], "offload": [...], "sequential": bool, "planned_peak": bytes}
+        """
+        stage = self._stages[name]
+        sizes = stage["sizes"]
+        working = stage["working"] if working_gb is None else int(working_gb * GB)
+
+        if not self.enabled:
+            return {"resident": list(sizes), "offload": [], "sequential": False,
+                    "planned_peak": sum(sizes.values()) + working}
+
+        order = [c for c in HOT_COMPONENTS if c in sizes] + [c for c in sizes if c not in HOT_COMPONENTS]
+        resident: List[str] = []
+        offload = list(order)
+
+        def peak(resident_names, offload_names):
+            largest = max((sizes[c] for c in offload_names), default=0)
+            return sum(sizes[c] for c in resident_names) + largest + working
+
+        for component in order:
+            remaining = [c for c in offload if c != component]
+            if peak(resident + [component], remaining) <= self.budget:
+                resident.append(component)
+                offload = remaining
+
+        sequential = peak(resident, offload) > self.budget
+        planned_peak = working if sequential else peak(resident, offload)
+        return {"resident": resident, "offload": offload, "sequential": sequential, "planned_peak": planned_peak}
+
+    def enter(self, name: str, working_gb: Optional[float] = None) -> Dict:
+        """
+        Move components so the given stage can run.
+
+        Args:
+            name: Stage to run next
+            working_gb: Override the stage's working memory estimate
+
+        Returns:
+            The placement plan
+        """
+        if name in self._together:
+            return self.history[-1]["plan"]
+        plan = self.plan(name, working_gb)
+        if self._current == name and plan == self.history[-1]["plan"]:
+            return plan
+        if self._current is not None:
+            self._measure()
+        self._together = []
+
+        # Re-entering the current stage with a different plan re-places it
+        for other in self._stages:
+            if other != name or other == self._current:
+                self._park(other)
+        empty_device_cache(self.device)
+        if self.enabled:
+            torch.cuda.reset_peak_memory_stats()
+        self._place(name, plan)
+
+        self._current = name
+        self.history.append({"stage": name, "plan": plan, "actual_peak": None})
+        self._print_plan(name, plan)
+        return plan
+
+    def fits_together(self, names: List[str]) -> bool:
+        """Whether the given stages can all be fully resident and run at the same time."""
+        if not self.enabled:
+            return False
+        total = sum(sum(self._stages[n]["sizes"].values()) + self._stages[n]["working"] for n in names)
+        return total <= self.budget
+
+    def enter_together(self, names: List[str]) -> Dict:
+        """
+        Make every component of the given stages resident so they can run concurrently.
+
+        Returns:
+            The combined placement plan
+        """
+        if self._current is not None:
+            self._measure()
+        for other in self._stages:
+            self._park(other)
+        empty_device_cache(self.device)
+        if self.enabled:
+            torch.cuda.reset_peak_memory_stats()
+
+        plan = {"resident": [], "offload": [], "sequential": False, "planned_peak": 0}
+        for name in names:
+            stage = self._stages[name]
+            for module in stage["components"].values():
+                module.to(self.device)
+            plan["resident"] += [f"{name}.{component}" for component in stage["components"]]
+            plan["planned_peak"] += sum(stage["sizes"].values()) + stage["working"]
+
+        label = "+".join(names)
+        self._current = label
+        self._together = list(names)
+        self.history.append({"stage": label, "plan": plan, "actual_peak": None})
+        self._print_plan(label, plan)
+        return plan
+
+    def release_stage(self, name: str):
+        """Forget a stage that will not run again so its weights can be freed."""
+        if name not in self._stages:
+            return
+        if self._current == name or name in self._together:
+            self._measure()
+            self._current = None
+            self._together = []
+        self._park(name)
+        del self._stages[name]
+        gc.collect()
+        empty_device_cache(self.device)
+
+    def report(self) -> List[Dict]:
+        """
+        Planned and actual peak device memory of every stage entered so far.
+
+        Returns:
+            List of {"stage", "planned_peak_gb", "actual_peak_gb", "resident", "offload"}
+        """
+        if self._current is not None:
+            self._measure()
+        rows = []
+        for entry in self.history:
+            plan = entry["plan"]
+            rows.append({
+                "stage": entry["stage"],
+                "planned_peak_gb": round(plan["planned_peak"] / GB, 2),
+                "actual_peak_gb": round(entry["actual_peak"] / GB, 2) if entry["actual_peak"] is not None else None,
+                "resident": plan["resident"],
+                "offload": plan["offload"] if not plan["sequential"] else "sequential",
+            })
+        return rows
+
+    def print_report(self):
+        """Print the largest planned and actual peak of each stage."""
+        peaks: Dict[str, List] = {}
+        for row in self.report():
+            planned, actual = peaks.setdefault(row["stage"], [0.0, None])
+            if row["actual_peak_gb"] is not None:
+                actual = max(actual or 0.0, row["actual_peak_gb"])
+            peaks[row["stage"]] = [max(planned, row["planned_peak_gb"]), actual]
+        print("\nPeak memory per stage (GB):")
+        for stage, (planned, actual) in peaks.items():
+            actual_text = f"{actual:.2f}" if actual is not None else "n/a"
+            print(f"  {stage}: planned {planned:.2f}, actual {actual_text}")
+
+    def _place(self, name: str, plan: Dict):
+        stage = self._stages[name]
+        if plan["sequential"]:
+            stage["pipe"].enable_sequential_cpu_offload(device=self.device)
+            stage["sequential"] = True
+            return
+
+        components = stage["components"]
+        for component in plan["resident"]:
+            components[component].to(self.device)
+        previous = None
+        for component in plan["offload"]:
+            _, previous = accelerate.cpu_offload_with_hook(components[component], self.device, prev_module_hook=previous)
+            stage["hooks"].append(previous)
+
+    def _park(self, name: str):
+        """Move every component of a stage to host memory and drop its hooks."""
+        stage = self._stages[name]
+        if stage["sequential"]:
+            stage["pipe"].remove_all_hooks()
+            stage["sequential"] = False
+        for hook in stage["hooks"]:
+            hook.offload()
+            accelerate.hooks.remove_hook_from_module(hook.model, recurse=True)
+        stage["hooks"] = []
+        for module in stage["components"].values():
+            module.to("cpu")
+
+    def _measure(self):
+        if self.enabled:
+            self.history[-1]["actual_peak"] = torch.cuda.max_memory_allocated()
+
+    def _print_plan(self, name: str, plan: Dict):
+        if not self.enabled:
+            return
+        print(f"Memory plan for '{name}' (budget {self.budget / GB:.1f} GB): "
+              f"planned peak {plan['planned_peak'] / GB:.2f} GB")
+        if plan["sequential"]:
+            print("  Sequential offload: weights streamed layer by layer")
+        else:
+            print(f"  Resident: {', '.join(plan['resident']) or 'none'}")
+            print(f"  Offloaded: {', '.join(plan['offload']) or 'none'}")
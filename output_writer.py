@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+"""
+Output Writer
+Encodes and saves generated images on background threads so the GPU never waits on PNG compression
+"""
+
+import atexit
+import json
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from typing import Callable, Dict, Optional
+
+from PIL import Image, PngImagePlugin
+
+
+FORMAT_EXTENSIONS = {"png": ".png", "webp": ".webp", "jpeg": ".jpg"}
+
+# EXIF ImageDescription, used to carry metadata in WebP and JPEG files
+EXIF_DESCRIPTION_TAG = 0x010E
+
+# Paths handed out but not yet on disk, shared by every writer in the process
+_reserved_paths = set()
+_reserved_lock = threading.Lock()
+
+
+def _reserve_path(filepath: Path) -> Path:
+    """Return filepath, or filepath with a -2, -3, ... suffix if it is taken."""
+    with _reserved_lock:
+        candidate, counter = filepath, 1
+        while candidate in _reserved_paths or candidate.exists():
+            counter += 1
+            candidate = filepath.with_name(f"{filepath.stem}-{counter}{filepath.suffix}")
+        _reserved_paths.add(candidate)
+    return candidate
+
+
+class OutputWriter:
+    """Bounded background queue that encodes and writes images."""
+
+    def __init__(
+        self,
+        output_format: str = "png",
+        num_workers: int = 2,
+        max_pending: int = 8,
+        png_compress_level: int = 6,
+        jpeg_quality: int = 95
+    ):
+        """
+        Initialize the writer.
+
+        Args:
+            output_format: png, webp (lossless) or jpeg
+            num_workers: Encoder threads (0 writes synchronously in the caller)
+            max_pending: Maximum queued images before submit() blocks
+            png_compress_level: zlib level for PNG (0-9, lower is faster)
+            jpeg_quality: JPEG quality (1-95)
+        """
+        if output_format not in FORMAT_EXTENSIONS:
+            raise ValueError(f"Unsupported output format: {output_format}")
+        self.output_format = output_format
+        self.extension = FORMAT_EXTENSIONS[output_format]
+        self.png_compress_level = png_compress_level
+        self.jpeg_quality = jpeg_quality
+
+        self._executor = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="output-writer") if num_workers > 0 else None
+        self._slots = threading.BoundedSemaphore(max(1, max_pending))
+        self._pending = set()
+        self._pending_lock = threading.Lock()
+        # Time spent encoding and writing, summed over all writer threads
+        self.stats = {"images": 0, "seconds": 0.0}
+        atexit.register(self.close)
+
+    def submit(
+        self,
+        image: Image.Image,
+        filepath: Path,
+        metadata: Optional[Dict[str, str]] = None,
+        on_saved: Optional[Callable[[str], None]] = None
+    ) -> "Future[str]":
+        """
+        Queue an image for saving.
+
+        Args:
+            image: Image to save
+            filepath: Destination (the suffix is replaced to match the format;
+                "-2", "-3", ... is added to the name if it is already taken)
+            metadata: Text fields to embed, or None
+            on_saved: Called with the saved path on the writer thread, before
+                the future resolves
+
+        Returns:
+            Future resolving to the saved path
+        """
+        filepath = _reserve_path(Path(filepath).with_suffix(self.extension))
+        if self._executor is None:
+            future: "Future[str]" = Future()
+            future.set_result(self._write(image, filepath, metadata, on_saved))
+            return future
+
+        # Blocks when max_pending images are still being encoded
+        self._slots.acquire()
+        future = self._executor.submit(self._write, image, filepath, metadata, on_saved)
+        with self._pending_lock:
+            self._pending.add(future)
+        future.add_done_callback(self._finished)
+        return future
+
+    def flush(self):
+        """Wait until every queued image has been written."""
+        with self._pending_lock:
+            pending = list(self._pending)
+        for future in pending:
+            future.result()
+
+    def close(self):
+        """Flush and stop the worker threads."""
+        if self._executor is not None:
+            self.flush()
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+    def _finished(self, future: Future):
+        with self._pending_lock:
+            self._pending.discard(future)
+        self._slots.release()
+        if future.exception() is not None:
+            print(f"Error saving image: {future.exception()}")
+
+    def _write(
+        self,
+        image: Image.Image,
+        filepath: Path,
+        metadata: Optional[Dict[str, str]],
+        on_saved: Optional[Callable[[str], None]]
+    ) -> str:
+        start = time.perf_counter()
+        if self.output_format == "png":
+            kwargs = {"compress_level": self.png_compress_level}
+            if metadata is not None:
+                pnginfo = PngImagePlugin.PngInfo()
+                for key, value in metadata.items():
+                    pnginfo.add_text(key, value)
+                kwargs["pnginfo"] = pnginfo
+        else:
+            if self.output_format == "webp":
+                kwargs = {"lossless": True}
+            else:
+                kwargs = {"quality": self.jpeg_quality}
+            if metadata is not None:
+                exif = Image.Exif()
+                exif[EXIF_DESCRIPTION_TAG] = json.dumps(metadata)
+                kwargs["exif"] = exif
+
+        try:
+            image.save(filepath, **kwargs)
+        finally:
+            with _reserved_lock:
+                _reserved_paths.discard(filepath)
+        with self._pending_lock:
+            self.stats["images"] += 1
+            self.stats["seconds"] += time.perf_counter() - start
+        if metadata is not None and "seed" in metadata:
+            print(f"Saved: {filepath} (seed: {metadata['seed']})")
+        else:
+            print(f"Saved: {filepath}")
+        if on_saved is not None:
+            on_saved(str(filepath))
+        return str(filepath)
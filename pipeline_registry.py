@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Pipeline Registry
+Process-wide cache so SDXL and VAE weights are loaded once and shared
+"""
+
+import threading
+from typing import Dict, Optional
+
+from lazy_imports import lazy_import
+from lora_fusion import FusedLoRACache
+from lora_pool import LoRAPool
+
+torch = lazy_import("torch")
+diffusers = lazy_import("diffusers")
+
+
+def _torch_dtype(dtype: str) -> "torch.dtype":
+    return torch.float16 if dtype == "float16" else torch.float32
+
+
+class PipelineRegistry:
+    """
+    Hand out pipelines that share loaded model components.
+
+    Base pipelines are keyed by (model_id, vae_model, dtype, device). Every
+    acquire() returns a new pipeline object built with from_pipe(), so a
+    second generator or a variant such as img2img shares the UNet, VAE and
+    text encoders instead of loading them again. Note that LoRA adapters and
+    attention processors live on the shared modules, so they are visible to
+    every pipeline acquired for the same key; lora_pool() manages them.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pipelines: Dict[tuple, Dict] = {}
+        self._vaes: Dict[tuple, Dict] = {}
+        self._handles: Dict[int, tuple] = {}
+
+    def acquire(
+        self,
+        model_id: str,
+        vae_model: Optional[str] = None,
+        dtype: str = "float16",
+        device: str = "cuda",
+        pipeline_cls=None
+    ):
+        """
+        Get a pipeline for the given model, loading it on first use.
+
+        Args:
+            model_id: HuggingFace model ID or local path
+            vae_model: Optional separate VAE model
+            dtype: Data type (float16 or float32)
+            device: Device to run on (mps, cuda, cpu)
+            pipeline_cls: Pipeline class to build over the shared components
+                (default StableDiffusionXLPipeline; e.g. StableDiffusionXLImg2ImgPipeline)
+
+        Returns:
+            A pipeline instance; pass it to release() when done
+        """
+        key = (model_id, vae_model, dtype, device)
+        with self._lock:
+            entry = self._pipelines.get(key)
+            if entry is None:
+                entry = {"pipe": self._load(model_id, vae_model, dtype, device), "refs": 0}
+                self._pipelines[key] = entry
+            else:
+                print(f"Reusing loaded model: {model_id}")
+
+            pipe = (pipeline_cls or diffusers.StableDiffusionXLPipeline).from_pipe(entry["pipe"])
+            entry["refs"] += 1
+            self._handles[id(pipe)] = key
+            return pipe
+
+    def release(self, pipe):
+        """Drop a reference; weights are freed when the last user releases."""
+        with self._lock:
+            key = self._handles.pop(id(pipe), None)
+            if key is None:
+                return
+            entry = self._pipelines[key]
+            entry["refs"] -= 1
+            if entry["refs"] > 0:
+                return
+
+            del self._pipelines[key]
+            model_id, vae_model, dtype, device = key
+            if vae_model:
+                self._release_vae((vae_model, dtype, device))
+            print(f"Released model: {model_id}")
+            empty_device_cache(device)
+
+    def lora_pool(self, pipe, memory_budget_mb: Optional[float] = None) -> LoRAPool:
+        """
+        LoRA pool for the modules behind an acquired pipeline (one per base model).
+
+        Args:
+            pipe: Pipeline from acquire()
+            memory_budget_mb: Resident adapter budget wanted by the caller. The
+                pool is shared, so this only ever raises its budget: every
+                generator on the model gets the largest one asked for.
+        """
+        with self._lock:
+            entry = self._pipelines[self._handles[id(pipe)]]
+            if "lora_pool" not in entry:
+                entry["lora_pool"] = LoRAPool(entry["pipe"])
+            pool = entry["lora_pool"]
+            if memory_budget_mb is not None:
+                pool.memory_budget = max(pool.memory_budget, int(memory_budget_mb * 1024 * 1024))
+            return pool
+
+    def fused_loras(self, pipe, snapshot_dir: str) -> FusedLoRACache:
+        """Fused LoRA snapshot cache for the modules behind an acquired pipeline."""
+        with self._lock:
+            entry = self._pipelines[self._handles[id(pipe)]]
+            if "fused_loras" not in entry:
+                entry["fused_loras"] = FusedLoRACache(entry["pipe"], self.lora_pool(pipe), snapshot_dir)
+            return entry["fused_loras"]
+
+    def memory_state(self, pipe) -> Dict:
+        """
+        Memory features and placement currently applied to the modules behind
+        an acquired pipeline (one per base model, see MemoryPlanner.apply()).
+        """
+        with self._lock:
+            entry = self._pipelines[self._handles[id(pipe)]]
+            if "memory_state" not in entry:
+                entry["memory_state"] = {"features": [], "placement": "resident", "hooks_on": None}
+            return entry["memory_state"]
+
+    def loaded(self) -> Dict[tuple, int]:
+        """Reference counts of the currently loaded base pipelines."""
+        with self._lock:
+            return {key: entry["refs"] for key, entry in self._pipelines.items()}
+
+    def _load(self, model_id: str, vae_model: Optional[str], dtype: str, device: str):
+        print(f"Loading model: {model_id}")
+        print(f"Device: {device}, dtype: {dtype}")
+
+        kwargs = {}
+        if vae_model:
+            kwargs["vae"] = self._acquire_vae(vae_model, dtype, device)
+
+        pipe = diffusers.StableDiffusionXLPipeline.from_pretrained(
+            model_id,
+            torch_dtype=_torch_dtype(dtype),
+            use_safetensors=True,
+            **kwargs
+        )
+
+        # Move to device (memory-saving features are chosen per call by MemoryPlanner)
+        pipe = pipe.to(device)
+
+        print("Model loaded successfully!")
+        return pipe
+
+    def _acquire_vae(self, vae_model: str, dtype: str, device: str) -> "diffusers.AutoencoderKL":
+        key = (vae_model, dtype, device)
+        entry = self._vaes.get(key)
+        if entry is None:
+            print(f"Loading VAE: {vae_model}")
+            vae = diffusers.AutoencoderKL.from_pretrained(vae_model, torch_dtype=_torch_dtype(dtype))
+            entry = {"vae": vae, "refs": 0}
+            self._vaes[key] = entry
+        entry["refs"] += 1
+        return entry["vae"]
+
+    def _release_vae(self, key: tuple):
+        entry = self._vaes.get(key)
+        if entry is None:
+            return
+        entry["refs"] -= 1
+        if entry["refs"] <= 0:
+            del self._vaes[key]
+
+
+def empty_device_cache(device: str):
+    """Release cached allocator blocks on the given device."""
+    if device == "cuda":
+        torch.cuda.empty_cache()
+    elif device == "mps" and hasattr(torch, "mps"):
+        torch.mps.empty_cache()
+
+
+# Shared by every generator in the process
+registry = PipelineRegistry()
@@ -0,0 +1,168 @@
+#!/usr/bin/env python3
+"""
+Prompt Embedding Cache
+Two-tier (in-memory LRU + on-disk) cache for SDXL text encoder outputs
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, Optional
+
+from lazy_imports import lazy_import
+
+torch = lazy_import("torch")
+safetensors = lazy_import("safetensors")
+safetensors_torch = lazy_import("safetensors.torch")
+
+
+def _tensor_bytes(tensors: Dict[str, "torch.Tensor"]) -> int:
+    """Total storage size of a dict of tensors in bytes."""
+    return sum(t.element_size() * t.numel() for t in tensors.values())
+
+
+class PromptEmbeddingCache:
+    """Cache prompt embeddings keyed by model, text and text-encoder LoRA state."""
+
+    def __init__(
+        self,
+        memory_budget_mb: float = 256,
+        disk_dir: Optional[str] = None,
+        disk_budget_mb: float = 2048
+    ):
+        """
+        Initialize the cache.
+
+        Args:
+            memory_budget_mb: Maximum size of the in-memory LRU tier
+            disk_dir: Directory for the on-disk tier (None disables it)
+            disk_budget_mb: Maximum size of the on-disk tier
+        """
+        self.memory_budget = int(memory_budget_mb * 1024 * 1024)
+        self.disk_budget = int(disk_budget_mb * 1024 * 1024)
+        self.disk_dir = Path(disk_dir) if disk_dir else None
+        # Disk entries in LRU order with their sizes; scanned once so puts never walk the directory
+        self._disk: "OrderedDict[Path, int]" = OrderedDict()
+        self._disk_bytes = 0
+        if self.disk_dir:
+            self.disk_dir.mkdir(parents=True, exist_ok=True)
+            entries = sorted((p.stat().st_mtime, p.stat().st_size, p) for p in self.disk_dir.glob("*.safetensors"))
+            for _, size, path in entries:
+                self._disk[path] = size
+                self._disk_bytes += size
+
+        self._memory: "OrderedDict[str, Dict[str, torch.Tensor]]" = OrderedDict()
+        self._memory_bytes = 0
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    @staticmethod
+    def make_key(model_id: str, text: str, lora_state: Optional[list] = None) -> str:
+        """Build a stable cache key for a piece of text."""
+        payload = json.dumps(
+            {"model": model_id, "text": text, "loras": lora_state or []},
+            sort_keys=True
+        )
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    def get(self, key: str, device: Optional[str] = None) -> Optional[Dict[str, "torch.Tensor"]]:
+        """
+        Look up embeddings, checking memory first and then disk.
+
+        Args:
+            key: Key from make_key()
+            device: Device to load disk entries onto
+
+        Returns:
+            Dict of tensors, or None on a miss
+        """
+        if key in self._memory:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return self._memory[key]
+
+        path = self._disk_path(key)
+        if path is not None and path.exists():
+            # safe_open memory-maps the file and copies each tensor out of the mapping
+            with safetensors.safe_open(str(path), framework="pt", device=device or "cpu") as f:
+                tensors = {name: f.get_tensor(name) for name in f.keys()}
+            os.utime(path)
+            if path in self._disk:
+                self._disk.move_to_end(path)
+            else:
+                # Written by another process since the scan
+                self._disk[path] = path.stat().st_size
+                self._disk_bytes += self._disk[path]
+            self.stats["disk_hits"] += 1
+            self._put_memory(key, tensors)
+            return tensors
+
+        self.stats["misses"] += 1
+        return None
+
+    def put(self, key: str, tensors: Dict[str, "torch.Tensor"]):
+        """Store embeddings in both tiers."""
+        self._put_memory(key, tensors)
+
+        path = self._disk_path(key)
+        if path is not None and not path.exists():
+            # Unique temp name, so processes writing the same key never share a half-written file
+            fd, tmp_path = tempfile.mkstemp(dir=self.disk_dir, prefix=f"{key}.", suffix=".tmp")
+            os.close(fd)
+            try:
+                safetensors_torch.save_file(
+                    {k: v.detach().contiguous().cpu() for k, v in tensors.items()}, tmp_path
+                )
+                os.replace(tmp_path, path)
+            except BaseException:
+                Path(tmp_path).unlink(missing_ok=True)
+                raise
+            size = path.stat().st_size
+            self._disk_bytes += size - self._disk.pop(path, 0)
+            self._disk[path] = size
+            self._evict_disk()
+
+    def clear_memory(self):
+        """Drop the in-memory tier."""
+        self._memory.clear()
+        self._memory_bytes = 0
+
+    def summary(self) -> str:
+        """One-line hit/miss report."""
+        s = self.stats
+        lookups = s["memory_hits"] + s["disk_hits"] + s["misses"]
+        hit_rate = (s["memory_hits"] + s["disk_hits"]) / lookups * 100 if lookups else 0.0
+        return (
+            f"Prompt cache: {s['memory_hits']} memory hits, {s['disk_hits']} disk hits, "
+            f"{s['misses']} misses ({hit_rate:.0f}% hit rate), "
+            f"{self._memory_bytes / 1024 / 1024:.1f} MB resident"
+        )
+
+    def _disk_path(self, key: str) -> Optional[Path]:
+        if self.disk_dir is None:
+            return None
+        return self.disk_dir / f"{key}.safetensors"
+
+    def _put_memory(self, key: str, tensors: Dict[str, "torch.Tensor"]):
+        size = _tensor_bytes(tensors)
+        if size > self.memory_budget:
+            return
+        if key in self._memory:
+            self._memory_bytes -= _tensor_bytes(self._memory.pop(key))
+        self._memory[key] = tensors
+        self._memory_bytes += size
+
+        while self._memory_bytes > self.memory_budget:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_bytes -= _tensor_bytes(evicted)
+            self.stats["evictions"] += 1
+
+    def _evict_disk(self):
+        """Delete least recently used files until the disk tier fits its budget."""
+        while self._disk_bytes > self.disk_budget and self._disk:
+            path, size = self._disk.popitem(last=False)
+            path.unlink(missing_ok=True)
+            self._disk_bytes -= size
+            self.stats["evictions"] += 1
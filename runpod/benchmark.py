@@ -6,28 +6,249 @@ Tests image and video generation performance on cloud GPU
 
 import argparse
 import json
+import math
+import os
+import resource
+import subprocess
 import time
 from datetime import datetime
 from pathlib import Path
+from typing import Dict, List, Optional
 import sys
 
 # Add parent directory to path
 sys.path.insert(0, str(Path(__file__).parent.parent))
 
+from lazy_imports import lazy_import
 from generate import SDXLGenerator
 from generate_video import VideoGenerator
+from benchmark_history import DEFAULT_HISTORY, BenchmarkHistory, environment_fingerprint
+from schedulers import DEFAULT_SCHEDULER, SCHEDULERS
+
+torch = lazy_import("torch")
+
+
+# Production models and sizes
+FULL_PROFILE = {
+    "name": "full",
+    "model_id": "stabilityai/stable-diffusion-xl-base-1.0",
+    "video_model_id": "stabilityai/stable-video-diffusion-img2vid-xt",
+    "dtype": "float16",
+    "image_size": (1024, 1024),
+    "image_steps": 30,
+    "video_size": (1024, 576),
+    "video_steps": 25,
+    "frame_counts": [14, 25],
+    "decode_chunk_size": 8,
+    "reference_steps": 50,
+    "quality_steps": [10, 15, 25],
+}
+
+# Samplers compared by --test-schedulers (lcm and turbo need their LoRA or model)
+QUALITY_SCHEDULERS = [DEFAULT_SCHEDULER, "euler", "dpmpp_2m_karras", "unipc"]
+
+# PSNR against the reference image from which a sampler counts as converged
+QUALITY_PSNR_DB = 30.0
+
+
+# Generation options that trade quality for speed -> values compared against leaving them off
+SPEED_OPTIONS = {
+    "deep_cache_interval": [2, 3, 5],
+    "token_merge_ratio": [0.3, 0.5, 0.6],
+    "early_exit_threshold": [0.005, 0.01, 0.02],
+}
+
+
+# CLIs whose --help must not import torch or diffusers
+STARTUP_SCRIPTS = ["generate.py", "generate_video.py", "workflow_img2vid.py", "runpod/benchmark.py"]
+
+
+def tiny_profile(models_dir: str) -> Dict:
+    """Random-weight models at 64x64 so the whole suite runs on a CPU-only box."""
+    # Imported here: building the models needs diffusers and transformers right away
+    from tiny_models import TINY_RESOLUTION, ensure_tiny_models
+
+    paths = ensure_tiny_models(models_dir)
+    return {
+        "name": "tiny",
+        "model_id": paths["sdxl"],
+        "video_model_id": paths["svd"],
+        "dtype": "float32",
+        "image_size": (TINY_RESOLUTION, TINY_RESOLUTION),
+        "image_steps": 4,
+        "video_size": (TINY_RESOLUTION, TINY_RESOLUTION),
+        "video_steps": 4,
+        "frame_counts": [2, 4],
+        "decode_chunk_size": 2,
+        "reference_steps": 8,
+        "quality_steps": [2, 4],
+    }
+
+
+def percentile(values: List[float], q: float) -> float:
+    """Percentile with linear interpolation between closest ranks (q in 0-100)."""
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def summarize(values: List[float]) -> Dict:
+    """Mean and p50/p90/p99 of a list of seconds, rounded for the results file."""
+    if not values:
+        return {}
+    return {
+        "mean": round(sum(values) / len(values), 4),
+        "p50": round(percentile(values, 50), 4),
+        "p90": round(percentile(values, 90), 4),
+        "p99": round(percentile(values, 99), 4),
+        "min": round(min(values), 4),
+        "max": round(max(values), 4),
+        "count": len(values),
+    }
+
+
+def psnr(image, reference) -> float:
+    """PSNR in dB between two same-size images (capped at 100 for identical ones)."""
+    import numpy as np
+
+    a = np.asarray(image, dtype=np.float64)
+    b = np.asarray(reference, dtype=np.float64)
+    mse = float(((a - b) ** 2).mean())
+    return 100.0 if mse == 0 else min(100.0, 10 * math.log10(255 ** 2 / mse))
+
+
+def synchronize(device: str):
+    """Wait for queued device work so wall-clock timings are accurate."""
+    if device == "cuda":
+        torch.cuda.synchronize()
+    elif device == "mps":
+        torch.mps.synchronize()
+
+
+def reset_peak_memory(device: str):
+    if device == "cuda":
+        torch.cuda.reset_peak_memory_stats()
+
+
+def peak_memory_mb(device: str) -> float:
+    """
+    Peak memory since reset_peak_memory().
+
+    CUDA reports the allocator peak. MPS has no peak counter, so the current
+    driver allocation is used. On CPU this is the process's peak RSS, which
+    cannot be reset.
+    """
+    if device == "cuda":
+        return round(torch.cuda.max_memory_allocated() / 1024 ** 2, 1)
+    if device == "mps":
+        return round(torch.mps.driver_allocated_memory() / 1024 ** 2, 1)
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+class StageTimer:
+    """
+    Time pipeline stages by wrapping their entry points.
+
+    wrap() replaces a method on one object with a timed version, and
+    time_steps() adds forward hooks that record every call of a module
+    (one UNet call per denoising step). The device is synchronized around
+    each measurement, so timings include the GPU work. detach() restores
+    everything.
+    """
+
+    def __init__(self, device: str):
+        self.device = device
+        self.seconds: Dict[str, float] = {}
+        self.steps: List[float] = []
+        self._step_start = None
+        self._undo = []
+
+    def wrap(self, stage: str, owner, attr: str):
+        original = getattr(owner, attr)
+        had_instance_attr = attr in vars(owner)
+
+        def timed(*args, **kwargs):
+            synchronize(self.device)
+            start = time.perf_counter()
+            try:
+                return original(*args, **kwargs)
+            finally:
+                synchronize(self.device)
+                self.seconds[stage] = self.seconds.get(stage, 0.0) + time.perf_counter() - start
+
+        setattr(owner, attr, timed)
+        if had_instance_attr:
+            self._undo.append(lambda: setattr(owner, attr, original))
+        else:
+            self._undo.append(lambda: delattr(owner, attr))
+
+    def time_steps(self, module: "torch.nn.Module"):
+        def before(*_):
+            synchronize(self.device)
+            self._step_start = time.perf_counter()
+
+        def after(*_):
+            synchronize(self.device)
+            self.steps.append(time.perf_counter() - self._step_start)
+
+        handles = [module.register_forward_pre_hook(before), module.register_forward_hook(after)]
+        self._undo.append(lambda: [handle.remove() for handle in handles])
+
+    def reset(self):
+        self.seconds = {}
+        self.steps = []
+
+    def detach(self):
+        for undo in reversed(self._undo):
+            undo()
+        self._undo = []
 
 
 class PerformanceBenchmark:
     """Benchmark image and video generation performance."""
 
-    def __init__(self, output_dir: str = "./benchmark_results"):
+    def __init__(
+        self,
+        output_dir: str = "./benchmark_results",
+        profile: Optional[Dict] = None,
+        warmup: int = 1,
+        repeats: int = 3,
+        history_path: Optional[str] = DEFAULT_HISTORY,
+        label: Optional[str] = None
+    ):
+        """
+        Initialize the benchmark.
+
+        Args:
+            output_dir: Directory for results and generated files
+            profile: Models and sizes to benchmark (FULL_PROFILE or tiny_profile())
+            warmup: Untimed runs before measuring, to absorb first-run
+                compilation and allocation
+            repeats: Timed runs per scenario
+            history_path: History file that save_results() appends to (None to skip)
+            label: Optional name for this run in the history (e.g. "torch-2.4")
+        """
         self.output_dir = Path(output_dir)
         self.output_dir.mkdir(parents=True, exist_ok=True)
+        self.profile = profile or FULL_PROFILE
+        self.warmup = warmup
+        self.repeats = repeats
+        self.history_path = history_path
         self.results = {
+            "run_id": datetime.now().strftime("%Y%m%d_%H%M%S"),
+            "label": label,
             "timestamp": datetime.now().isoformat(),
+            "profile": self.profile["name"],
+            "warmup": warmup,
+            "repeats": repeats,
+            "environment": None,
             "tests": []
         }
+        self.image_generator = None
+        self.video_generator = None
 
     def benchmark_image_generation(
         self,
@@ -47,47 +268,185 @@ class PerformanceBenchmark:
         print("BENCHMARKING IMAGE GENERATION")
         print("=" * 60)
 
+        profile = self.profile
+        width, height = profile["image_size"]
+        steps = profile["image_steps"]
+
         generator = SDXLGenerator(
+            model_id=profile["model_id"],
             device=device,
-            dtype="float16",
+            dtype=profile["dtype"],
             output_dir=str(self.output_dir)
         )
+        # Kept alive so later benchmarks reuse the loaded weights
+        self.image_generator = generator
 
         if lora_path:
             print(f"Loading LoRA: {lora_path}")
             generator.load_lora(lora_path, weight=0.8)
 
-        for idx, prompt in enumerate(test_prompts, 1):
-            print(f"\nTest {idx}/{len(test_prompts)}: {prompt[:50]}...")
+        if self.results["environment"] is None:
+            self.results["environment"] = environment_fingerprint(device, profile["dtype"], generator.pipe)
+
+        timer = StageTimer(device)
+        timer.wrap("text_encode", generator.pipe, "encode_prompt")
+        timer.wrap("vae_decode", generator.pipe.vae, "decode")
+        timer.time_steps(generator.pipe.unet)
 
-            start_time = time.time()
+        def run(prompt: str) -> Dict:
+            timer.reset()
+            reset_peak_memory(device)
+            save_before = generator.writer.stats["seconds"]
+            synchronize(device)
+            start_time = time.perf_counter()
             images = generator.generate(
                 prompt=prompt,
-                width=1024,
-                height=1024,
-                num_inference_steps=30,
+                width=width,
+                height=height,
+                num_inference_steps=steps,
                 guidance_scale=7.5,
                 num_images=1,
                 save_metadata=False
             )
-            elapsed = time.time() - start_time
+            generated = time.perf_counter() - start_time
+            images.paths  # wait for the background writer
+            return {
+                "total": time.perf_counter() - start_time,
+                "generate": generated,
+                "text_encode": timer.seconds.get("text_encode", 0.0),
+                "unet_steps": list(timer.steps),
+                "vae_decode": timer.seconds.get("vae_decode", 0.0),
+                "save": generator.writer.stats["seconds"] - save_before,
+                "peak_memory_mb": peak_memory_mb(device),
+            }
+
+        for _ in range(self.warmup):
+            print("\nWarmup run (not timed)")
+            run(test_prompts[0])
+
+        try:
+            for idx, prompt in enumerate(test_prompts, 1):
+                print(f"\nTest {idx}/{len(test_prompts)}: {prompt[:50]}...")
+                runs = [run(prompt) for _ in range(self.repeats)]
+                totals = [r["total"] for r in runs]
+
+                result = {
+                    "type": "image_generation",
+                    "scenario": f"image {width}x{height} {steps} steps: {prompt}",
+                    "test_number": idx,
+                    "prompt": prompt,
+                    "resolution": f"{width}x{height}",
+                    "steps": steps,
+                    "time_seconds": round(sum(totals) / len(totals), 2),
+                    "samples": [round(t, 4) for t in totals],
+                    "latency": summarize(totals),
+                    "stages": {
+                        "text_encode": summarize([r["text_encode"] for r in runs]),
+                        "unet_step": summarize([t for r in runs for t in r["unet_steps"]]),
+                        "unet_total": summarize([sum(r["unet_steps"]) for r in runs]),
+                        "vae_decode": summarize([r["vae_decode"] for r in runs]),
+                        "save": summarize([r["save"] for r in runs]),
+                    },
+                    "images_per_sec": round(len(runs) / sum(totals), 3),
+                    "peak_memory_mb": max(r["peak_memory_mb"] for r in runs),
+                    "lora_used": lora_path is not None
+                }
+
+                self.results["tests"].append(result)
+                self._print_result(result)
+        finally:
+            timer.detach()
+
+        image_tests = [t for t in self.results["tests"] if t["type"] == "image_generation"]
+        avg_time = sum(t["time_seconds"] for t in image_tests) / len(image_tests)
+        print(f"\nAverage time per image: {avg_time:.2f} seconds")
+
+    def benchmark_schedulers(self, device: str = "cuda", schedulers: Optional[List[str]] = None):
+        """
+        Compare samplers by speed and by how many steps they need to converge.
+
+        Every sampler renders the same prompt and seed at each of the
+        profile's quality_steps. Quality is the PSNR against the default
+        scheduler at reference_steps; a sampler's steps-to-quality is the
+        fewest steps that reach QUALITY_PSNR_DB.
+        """
+        schedulers = schedulers or QUALITY_SCHEDULERS
+
+        print("\n" + "=" * 60)
+        print("BENCHMARKING SCHEDULERS (STEPS TO QUALITY)")
+        print("=" * 60)
+
+        profile = self.profile
+        width, height = profile["image_size"]
+        prompt = "a beautiful landscape with mountains and lake"
+
+        if self.image_generator is None:
+            self.image_generator = SDXLGenerator(
+                model_id=profile["model_id"],
+                device=device,
+                dtype=profile["dtype"],
+                output_dir=str(self.output_dir)
+            )
+        generator = self.image_generator
+
+        if self.results["environment"] is None:
+            self.results["environment"] = environment_fingerprint(device, profile["dtype"], generator.pipe)
 
+        def run(scheduler: str, steps: int):
+            reset_peak_memory(device)
+            synchronize(device)
+            start_time = time.perf_counter()
+            images = generator.generate(
+                prompt=prompt,
+                width=width,
+                height=height,
+                num_inference_steps=steps,
+                guidance_scale=7.5,
+                seed=42,
+                save_metadata=False,
+                scheduler=scheduler
+            )
+            synchronize(device)
+            return images[0], time.perf_counter() - start_time
+
+        print(f"\nReference: {DEFAULT_SCHEDULER} scheduler, {profile['reference_steps']} steps")
+        reference, _ = run(DEFAULT_SCHEDULER, profile["reference_steps"])
+        for _ in range(self.warmup):
+            print("\nWarmup run (not timed)")
+            run(DEFAULT_SCHEDULER, profile["quality_steps"][0])
+
+        steps_to_quality = {}
+        tests = [(name, steps) for name in schedulers for steps in profile["quality_steps"]]
+        for idx, (scheduler, steps) in enumerate(tests, 1):
+            print(f"\nTest {idx}/{len(tests)}: {scheduler}, {steps} steps")
+            runs = [run(scheduler, steps) for _ in range(self.repeats)]
+            totals = [seconds for _, seconds in runs]
+            quality = round(psnr(runs[0][0], reference), 2)
             result = {
-                "type": "image_generation",
+                "type": "scheduler_quality",
+                "scenario": f"scheduler {scheduler} {width}x{height} {steps} steps",
                 "test_number": idx,
-                "prompt": prompt,
-                "resolution": "1024x1024",
-                "steps": 30,
-                "time_seconds": round(elapsed, 2),
-                "lora_used": lora_path is not None
+                "scheduler": scheduler,
+                "resolution": f"{width}x{height}",
+                "steps": steps,
+                "reference_steps": profile["reference_steps"],
+                "psnr_db": quality,
+                "time_seconds": round(sum(totals) / len(totals), 2),
+                "samples": [round(t, 4) for t in totals],
+                "latency": summarize(totals),
+                "stages": {},
+                "peak_memory_mb": peak_memory_mb(device),
             }
-
             self.results["tests"].append(result)
-            print(f"✓ Completed in {elapsed:.2f} seconds")
+            self._print_result(result)
+            print(f"    PSNR vs reference: {quality:.1f} dB")
+            if quality >= QUALITY_PSNR_DB and scheduler not in steps_to_quality:
+                steps_to_quality[scheduler] = steps
 
-        avg_time = sum(t["time_seconds"] for t in self.results["tests"]
-                      if t["type"] == "image_generation") / len(test_prompts)
-        print(f"\nAverage time per image: {avg_time:.2f} seconds")
+        self.results["steps_to_quality"] = {
+            "psnr_db": QUALITY_PSNR_DB,
+            "steps": {name: steps_to_quality.get(name) for name in schedulers},
+        }
 
     def benchmark_video_generation(
         self,
@@ -97,66 +456,329 @@ class PerformanceBenchmark:
     ):
         """Benchmark SVD video generation."""
         if frame_counts is None:
-            frame_counts = [14, 25]  # Short and medium length videos
+            frame_counts = self.profile["frame_counts"]  # Short and medium length videos
 
         print("\n" + "=" * 60)
         print("BENCHMARKING VIDEO GENERATION")
         print("=" * 60)
 
+        profile = self.profile
+
         # Use test image or generate one
         if test_image is None or not Path(test_image).exists():
             print("\nGenerating test image for video benchmark...")
+            # Shares the already-loaded SDXL weights if the image benchmark ran
             img_gen = SDXLGenerator(
+                model_id=profile["model_id"],
                 device=device,
-                dtype="float16",
+                dtype=profile["dtype"],
                 output_dir=str(self.output_dir)
             )
-            img_gen.generate(
+            images = img_gen.generate(
                 prompt="a scenic landscape, professional photography",
-                width=1024,
-                height=576,
-                num_inference_steps=25,
+                width=profile["video_size"][0],
+                height=profile["video_size"][1],
+                num_inference_steps=profile["image_steps"],
                 save_metadata=False
             )
-            # Get most recent image
-            images = sorted(self.output_dir.glob("generated_*.png"), key=lambda p: p.stat().st_mtime)
-            test_image = str(images[-1])
-            print(f"Using test image: {test_image}")
+            # Passed to SVD in memory; the PNG is written in the background
+            test_image = images[0]
+            img_gen.close()
+            print(f"Using test image: {images.paths[0]}")
 
         vid_gen = VideoGenerator(
+            model_id=profile["video_model_id"],
             device=device,
-            dtype="float16",
-            output_dir=str(self.output_dir)
+            dtype=profile["dtype"],
+            output_dir=str(self.output_dir),
+            resolution=profile["video_size"]
         )
+        self.video_generator = vid_gen
+
+        if self.results["environment"] is None:
+            self.results["environment"] = environment_fingerprint(device, profile["dtype"], vid_gen.pipe)
 
-        for idx, num_frames in enumerate(frame_counts, 1):
-            duration = num_frames / 6  # Assuming 6 fps
-            print(f"\nTest {idx}/{len(frame_counts)}: {num_frames} frames (~{duration:.1f}s)")
+        timer = StageTimer(device)
+        timer.wrap("image_encode", vid_gen.pipe, "_encode_image")
+        timer.wrap("image_encode", vid_gen.pipe, "_encode_vae_image")
+        timer.wrap("vae_decode", vid_gen.pipe, "decode_latents")
+        timer.time_steps(vid_gen.pipe.unet)
 
-            start_time = time.time()
-            video_path = vid_gen.generate_video(
-                image_path=test_image,
+        def run(num_frames: int) -> Dict:
+            timer.reset()
+            reset_peak_memory(device)
+            synchronize(device)
+            start_time = time.perf_counter()
+            future = vid_gen.generate_video_async(
+                image=test_image,
                 num_frames=num_frames,
                 fps=6,
+                decode_chunk_size=profile["decode_chunk_size"],
+                num_inference_steps=profile["video_steps"],
                 save_metadata=False
             )
-            elapsed = time.time() - start_time
+            generated = time.perf_counter() - start_time
+            future.result()
+            total = time.perf_counter() - start_time
+            return {
+                "total": total,
+                "generate": generated,
+                "image_encode": timer.seconds.get("image_encode", 0.0),
+                "unet_steps": list(timer.steps),
+                "vae_decode": timer.seconds.get("vae_decode", 0.0),
+                "save": total - generated,
+                "peak_memory_mb": peak_memory_mb(device),
+            }
+
+        for _ in range(self.warmup):
+            print("\nWarmup run (not timed)")
+            run(frame_counts[0])
+
+        try:
+            for idx, num_frames in enumerate(frame_counts, 1):
+                duration = num_frames / 6  # Assuming 6 fps
+                print(f"\nTest {idx}/{len(frame_counts)}: {num_frames} frames (~{duration:.1f}s)")
+                runs = [run(num_frames) for _ in range(self.repeats)]
+                totals = [r["total"] for r in runs]
+
+                result = {
+                    "type": "video_generation",
+                    "scenario": f"video {profile['video_size'][0]}x{profile['video_size'][1]} "
+                                f"{num_frames} frames {profile['video_steps']} steps",
+                    "test_number": idx,
+                    "num_frames": num_frames,
+                    "resolution": f"{profile['video_size'][0]}x{profile['video_size'][1]}",
+                    "steps": profile["video_steps"],
+                    "decode_chunk_size": profile["decode_chunk_size"],
+                    "duration_seconds": round(duration, 1),
+                    "time_seconds": round(sum(totals) / len(totals), 2),
+                    "samples": [round(t, 4) for t in totals],
+                    "latency": summarize(totals),
+                    "stages": {
+                        "image_encode": summarize([r["image_encode"] for r in runs]),
+                        "unet_step": summarize([t for r in runs for t in r["unet_steps"]]),
+                        "unet_total": summarize([sum(r["unet_steps"]) for r in runs]),
+                        "vae_decode": summarize([r["vae_decode"] for r in runs]),
+                        "save": summarize([r["save"] for r in runs]),
+                    },
+                    "videos_per_sec": round(len(runs) / sum(totals), 3),
+                    "peak_memory_mb": max(r["peak_memory_mb"] for r in runs),
+                    "fps": 6
+                }
+
+                self.results["tests"].append(result)
+                self._print_result(result)
+        finally:
+            timer.detach()
+
+        video_tests = [t for t in self.results["tests"] if t["type"] == "video_generation"]
+        avg_time = sum(t["time_seconds"] for t in video_tests) / len(video_tests)
+        print(f"\nAverage time per video: {avg_time:.2f} seconds")
 
+    def benchmark_speed_option(self, option: str, device: str = "cuda", values: Optional[List] = None):
+        """
+        Measure what a speed option buys and what it costs in image and video quality.
+
+        The SDXL image and the SVD video are rendered with the option off and
+        then at each value, with the same prompt, input and seed. Speedup is
+        relative to the run with the option off, and drift is the PSNR
+        against its output (averaged over frames for video), so a value can
+        be picked per preset. The denoising steps that actually ran are
+        counted too, for options that end early.
+
+        Args:
+            option: generate()/generate_video() keyword from SPEED_OPTIONS
+            device: Device to run on
+            values: Values to compare (default: SPEED_OPTIONS[option])
+        """
+        values = values or SPEED_OPTIONS[option]
+
+        print("\n" + "=" * 60)
+        print(f"BENCHMARKING SPEED VS QUALITY: {option}")
+        print("=" * 60)
+
+        profile = self.profile
+        if self.image_generator is None:
+            self.image_generator = SDXLGenerator(
+                model_id=profile["model_id"],
+                device=device,
+                dtype=profile["dtype"],
+                output_dir=str(self.output_dir)
+            )
+        img_gen = self.image_generator
+        if self.video_generator is None:
+            self.video_generator = VideoGenerator(
+                model_id=profile["video_model_id"],
+                device=device,
+                dtype=profile["dtype"],
+                output_dir=str(self.output_dir),
+                resolution=profile["video_size"]
+            )
+        vid_gen = self.video_generator
+
+        if self.results["environment"] is None:
+            self.results["environment"] = environment_fingerprint(device, profile["dtype"], img_gen.pipe)
+
+        # The exported video is lossy, so compare the frames handed to the encoder
+        frames = {}
+        export = vid_gen._export
+
+        def capture(video_frames, params):
+            frames["last"] = video_frames
+            return export(video_frames, params)
+
+        vid_gen._export = capture
+        # One UNet call per denoising step (the CFG batch goes through in one call)
+        unet_calls = []
+        hooks = [
+            module.register_forward_pre_hook(lambda *_: unet_calls.append(1))
+            for module in (img_gen.pipe.unet, vid_gen.pipe.unet)
+        ]
+        width, height = profile["image_size"]
+        video_width, video_height = profile["video_size"]
+        num_frames = profile["frame_counts"][0]
+        input_image = img_gen.generate(
+            prompt="a scenic landscape, professional photography",
+            width=video_width,
+            height=video_height,
+            num_inference_steps=profile["image_steps"],
+            seed=42,
+            save_metadata=False
+        )[0]
+
+        def run_image(value) -> tuple:
+            unet_calls.clear()
+            synchronize(device)
+            start_time = time.perf_counter()
+            images = img_gen.generate(
+                prompt="a beautiful landscape with mountains and lake",
+                width=width,
+                height=height,
+                num_inference_steps=profile["image_steps"],
+                guidance_scale=7.5,
+                seed=42,
+                save_metadata=False,
+                **{option: value}
+            )
+            synchronize(device)
+            return [images[0]], time.perf_counter() - start_time, len(unet_calls)
+
+        def run_video(value) -> tuple:
+            unet_calls.clear()
+            synchronize(device)
+            start_time = time.perf_counter()
+            vid_gen.generate_video(
+                image=input_image,
+                num_frames=num_frames,
+                decode_chunk_size=profile["decode_chunk_size"],
+                num_inference_steps=profile["video_steps"],
+                seed=42,
+                save_metadata=False,
+                **{option: value}
+            )
+            return frames["last"], time.perf_counter() - start_time, len(unet_calls)
+
+        stages = [
+            ("image", run_image, f"{width}x{height} {profile['image_steps']} steps"),
+            ("video", run_video, f"{video_width}x{video_height} {num_frames} frames {profile['video_steps']} steps"),
+        ]
+        try:
+            for stage, run, shape in stages:
+                for _ in range(self.warmup):
+                    print(f"\nWarmup run (not timed): {stage}")
+                    run(None)
+                print(f"\nBaseline: {stage} {shape}, {option} off")
+                baseline = [run(None) for _ in range(self.repeats)]
+                reference = baseline[0][0]
+                baseline_seconds = sum(run[1] for run in baseline) / len(baseline)
+
+                for idx, value in enumerate([None] + values):
+                    if value is not None:
+                        print(f"\nTest {idx}/{len(values)}: {stage} {shape}, {option} {value}")
+                    runs = baseline if value is None else [run(value) for _ in range(self.repeats)]
+                    totals = [run[1] for run in runs]
+                    outputs = runs[0][0]
+                    quality = sum(psnr(a, b) for a, b in zip(outputs, reference)) / len(reference)
+                    mean_seconds = sum(totals) / len(totals)
+                    result = {
+                        "type": "speed_quality",
+                        "scenario": f"{stage} {shape} {option} {value if value is not None else 'off'}",
+                        "test_number": idx,
+                        "stage": stage,
+                        "option": option,
+                        "value": value,
+                        "psnr_db": round(quality, 2),
+                        "speedup": round(baseline_seconds / mean_seconds, 3),
+                        "steps_used": runs[0][2],
+                        "time_seconds": round(mean_seconds, 2),
+                        "samples": [round(t, 4) for t in totals],
+                        "latency": summarize(totals),
+                        "stages": {},
+                        "peak_memory_mb": None,
+                    }
+                    self.results["tests"].append(result)
+                    if value is not None:
+                        self._print_result(result)
+                        print(f"    {result['speedup']:.2f}x vs off, PSNR vs off: {result['psnr_db']:.1f} dB, "
+                              f"{result['steps_used']} steps")
+        finally:
+            vid_gen._export = export
+            for hook in hooks:
+                hook.remove()
+
+    def benchmark_startup(self, device: str = "cuda"):
+        """Benchmark CLI startup (--help in a fresh interpreter) so import-time regressions show up."""
+        print("\n" + "=" * 60)
+        print("BENCHMARKING CLI STARTUP")
+        print("=" * 60)
+
+        if self.results["environment"] is None:
+            self.results["environment"] = environment_fingerprint(device, self.profile["dtype"])
+
+        repo_dir = Path(__file__).parent.parent
+        env = dict(os.environ, IMPORT_REPORT="1")
+
+        def run(script: str):
+            start = time.perf_counter()
+            completed = subprocess.run(
+                [sys.executable, str(repo_dir / script), "--help"],
+                env=env, capture_output=True, text=True, check=True
+            )
+            # The import report lists each heavy module first on its line
+            report = completed.stderr.split("Import report", 1)[-1].splitlines()[1:]
+            heavy = [line.split()[0] for line in report if line.strip() and "no heavy modules" not in line]
+            return time.perf_counter() - start, heavy
+
+        for idx, script in enumerate(STARTUP_SCRIPTS, 1):
+            print(f"\nTest {idx}/{len(STARTUP_SCRIPTS)}: {script} --help")
+            for _ in range(self.warmup):
+                run(script)
+            runs = [run(script) for _ in range(self.repeats)]
+            totals = [seconds for seconds, _ in runs]
             result = {
-                "type": "video_generation",
+                "type": "startup",
+                "scenario": f"startup {script} --help",
                 "test_number": idx,
-                "num_frames": num_frames,
-                "duration_seconds": round(duration, 1),
-                "time_seconds": round(elapsed, 2),
-                "fps": 6
+                "time_seconds": round(sum(totals) / len(totals), 3),
+                "samples": [round(t, 4) for t in totals],
+                "latency": summarize(totals),
+                "stages": {},
+                "heavy_imports": runs[-1][1],
+                "peak_memory_mb": None,
             }
-
             self.results["tests"].append(result)
-            print(f"✓ Completed in {elapsed:.2f} seconds")
+            self._print_result(result)
+            if result["heavy_imports"]:
+                print(f"    ✗ --help imported {', '.join(result['heavy_imports'])}")
 
-        avg_time = sum(t["time_seconds"] for t in self.results["tests"]
-                      if t["type"] == "video_generation") / len(frame_counts)
-        print(f"\nAverage time per video: {avg_time:.2f} seconds")
+    def _print_result(self, result: Dict):
+        latency = result["latency"]
+        memory = f", peak memory {result['peak_memory_mb']:.0f} MB" if result["peak_memory_mb"] is not None else ""
+        print(f"✓ p50 {latency['p50']:.2f}s, p90 {latency['p90']:.2f}s, p99 {latency['p99']:.2f}s "
+              f"over {latency['count']} run(s){memory}")
+        for stage, stats in result["stages"].items():
+            if stats:
+                print(f"    {stage:<12} mean {stats['mean'] * 1000:8.1f} ms   p90 {stats['p90'] * 1000:8.1f} ms")
 
     def save_results(self):
         """Save benchmark results to JSON."""
@@ -167,6 +789,11 @@ class PerformanceBenchmark:
             json.dump(self.results, f, indent=2)
 
         print(f"\n✓ Results saved to: {results_file}")
+
+        if self.history_path and self.results["tests"]:
+            BenchmarkHistory(self.history_path).append(self.results)
+            print(f"✓ Run {self.results['run_id']} added to history: {self.history_path}")
+            print("  Compare with: python runpod/benchmark_history.py compare")
         return results_file
 
     def print_summary(self):
@@ -177,6 +804,9 @@ class PerformanceBenchmark:
 
         image_tests = [t for t in self.results["tests"] if t["type"] == "image_generation"]
         video_tests = [t for t in self.results["tests"] if t["type"] == "video_generation"]
+        startup_tests = [t for t in self.results["tests"] if t["type"] == "startup"]
+        scheduler_tests = [t for t in self.results["tests"] if t["type"] == "scheduler_quality"]
+        speed_tests = [t for t in self.results["tests"] if t["type"] == "speed_quality" and t["value"] is not None]
 
         if image_tests:
             avg_img_time = sum(t["time_seconds"] for t in image_tests) / len(image_tests)
@@ -184,6 +814,8 @@ class PerformanceBenchmark:
             print(f"  Tests: {len(image_tests)}")
             print(f"  Average: {avg_img_time:.2f}s per image")
             print(f"  Range: {min(t['time_seconds'] for t in image_tests):.2f}s - {max(t['time_seconds'] for t in image_tests):.2f}s")
+            throughput = sum(t["images_per_sec"] for t in image_tests) / len(image_tests)
+            print(f"  Throughput: {throughput:.3f} images/sec")
 
         if video_tests:
             avg_vid_time = sum(t["time_seconds"] for t in video_tests) / len(video_tests)
@@ -191,6 +823,32 @@ class PerformanceBenchmark:
             print(f"  Tests: {len(video_tests)}")
             print(f"  Average: {avg_vid_time:.2f}s per video")
             print(f"  Range: {min(t['time_seconds'] for t in video_tests):.2f}s - {max(t['time_seconds'] for t in video_tests):.2f}s")
+            throughput = sum(t["videos_per_sec"] for t in video_tests) / len(video_tests)
+            print(f"  Throughput: {throughput:.3f} videos/sec")
+
+        if scheduler_tests:
+            target = self.results["steps_to_quality"]["psnr_db"]
+            print(f"\nSchedulers (steps to {target:.0f} dB PSNR vs the reference):")
+            for name, steps in self.results["steps_to_quality"]["steps"].items():
+                tests = [t for t in scheduler_tests if t["scheduler"] == name]
+                if steps is None:
+                    reached = f"not reached in {max(t['steps'] for t in tests)} steps"
+                else:
+                    seconds = next(t["time_seconds"] for t in tests if t["steps"] == steps)
+                    reached = f"{steps} steps, {seconds:.2f}s"
+                print(f"  {name}: {reached}")
+
+        if speed_tests:
+            print(f"\nSpeed Options (speedup and PSNR vs the option off, same seed):")
+            for test in speed_tests:
+                print(f"  {test['stage']} {test['option']} {test['value']}: "
+                      f"{test['speedup']:.2f}x, {test['psnr_db']:.1f} dB, {test['steps_used']} steps")
+
+        if startup_tests:
+            print(f"\nCLI Startup (--help):")
+            for test in startup_tests:
+                heavy = f" (imports {', '.join(test['heavy_imports'])})" if test["heavy_imports"] else ""
+                print(f"  {test['scenario'].split()[1]}: {test['time_seconds']:.2f}s{heavy}")
 
         print("\n" + "=" * 60)
 
@@ -217,6 +875,37 @@ def main():
         action="store_true",
         help="Run video generation benchmarks"
     )
+    parser.add_argument(
+        "--test-startup",
+        action="store_true",
+        help="Run CLI startup (import time) benchmarks"
+    )
+    parser.add_argument(
+        "--test-schedulers",
+        action="store_true",
+        help="Compare samplers' speed and steps to quality"
+    )
+    parser.add_argument(
+        "--schedulers",
+        type=str,
+        default=",".join(QUALITY_SCHEDULERS),
+        help="Comma-separated samplers for --test-schedulers (from: " + ", ".join(SCHEDULERS) + ")"
+    )
+    parser.add_argument(
+        "--test-deep-cache",
+        action="store_true",
+        help="Compare deep cache intervals' speedup and quality drift against no caching"
+    )
+    parser.add_argument(
+        "--test-token-merging",
+        action="store_true",
+        help="Compare token merge ratios' speedup and quality drift against no merging"
+    )
+    parser.add_argument(
+        "--test-early-exit",
+        action="store_true",
+        help="Compare early exit thresholds' steps used, speedup and quality drift against full schedules"
+    )
     parser.add_argument(
         "--test-all",
         action="store_true",
@@ -234,14 +923,62 @@ def main():
         default="./benchmark_results",
         help="Output directory for results"
     )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Untimed warmup runs before each benchmark"
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Timed runs per scenario (for percentiles)"
+    )
+    parser.add_argument(
+        "--label",
+        type=str,
+        default=None,
+        help="Name for this run in the benchmark history"
+    )
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=DEFAULT_HISTORY,
+        help="Benchmark history file to append the run to"
+    )
+    parser.add_argument(
+        "--tiny",
+        action="store_true",
+        help="Use tiny random-weight models at 64x64 (runs on CPU in seconds)"
+    )
+    parser.add_argument(
+        "--tiny-models-dir",
+        type=str,
+        default="./models/tiny",
+        help="Where the tiny models are built and cached"
+    )
 
     args = parser.parse_args()
 
+    unknown = [name for name in args.schedulers.split(",") if name.strip() and name.strip() not in SCHEDULERS]
+    if unknown:
+        parser.error(f"unknown scheduler(s): {', '.join(unknown)}")
+
     # Default to all tests if none specified
-    if not (args.test_image or args.test_video or args.test_all):
+    if not (args.test_image or args.test_video or args.test_startup or args.test_schedulers
+            or args.test_deep_cache or args.test_token_merging or args.test_early_exit or args.test_all):
         args.test_all = True
 
-    benchmark = PerformanceBenchmark(output_dir=args.output_dir)
+    profile = tiny_profile(args.tiny_models_dir) if args.tiny else FULL_PROFILE
+    benchmark = PerformanceBenchmark(
+        output_dir=args.output_dir,
+        profile=profile,
+        warmup=args.warmup,
+        repeats=args.repeats,
+        history_path=args.history,
+        label=args.label
+    )
 
     try:
         if args.test_all or args.test_image:
@@ -250,11 +987,29 @@ def main():
                 lora_path=args.lora
             )
 
+        if args.test_all or args.test_schedulers:
+            benchmark.benchmark_schedulers(
+                device=args.device,
+                schedulers=[name.strip() for name in args.schedulers.split(",") if name.strip()]
+            )
+
+        if args.test_all or args.test_deep_cache:
+            benchmark.benchmark_speed_option("deep_cache_interval", device=args.device)
+
+        if args.test_all or args.test_token_merging:
+            benchmark.benchmark_speed_option("token_merge_ratio", device=args.device)
+
+        if args.test_all or args.test_early_exit:
+            benchmark.benchmark_speed_option("early_exit_threshold", device=args.device)
+
         if args.test_all or args.test_video:
             benchmark.benchmark_video_generation(
                 device=args.device
             )
 
+        if args.test_all or args.test_startup:
+            benchmark.benchmark_startup(device=args.device)
+
         benchmark.print_summary()
         benchmark.save_results()
 
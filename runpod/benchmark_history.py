@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+Benchmark History
+Append-only store of benchmark runs with environment fingerprints, and a compare command that flags significant slowdowns
+"""
+
+import argparse
+import json
+import math
+import os
+import platform
+import subprocess
+import sys
+import threading
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+
+DEFAULT_HISTORY = "./benchmark_results/history.jsonl"
+
+
+def environment_fingerprint(device: str, dtype: str, pipe=None) -> Dict:
+    """
+    Describe everything that can change benchmark numbers without a code change.
+
+    Args:
+        device: Device the benchmark ran on
+        dtype: Model dtype
+        pipe: Optional loaded pipeline, used to record the attention processor
+
+    Returns:
+        Flat dict of versions, hardware and settings
+    """
+    # Imported here so list and compare work without the ML stack installed
+    import torch
+    import diffusers
+    import transformers
+
+    fingerprint = {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "diffusers": diffusers.__version__,
+        "transformers": transformers.__version__,
+        "device": device,
+        "dtype": dtype,
+        "platform": platform.platform(),
+    }
+    try:
+        import accelerate
+        fingerprint["accelerate"] = accelerate.__version__
+    except ImportError:
+        pass
+
+    if device == "cuda" and torch.cuda.is_available():
+        fingerprint["gpu"] = torch.cuda.get_device_name(0)
+        fingerprint["cuda"] = torch.version.cuda
+        fingerprint["cudnn"] = torch.backends.cudnn.version()
+        fingerprint["flash_sdp"] = torch.backends.cuda.flash_sdp_enabled()
+        fingerprint["mem_efficient_sdp"] = torch.backends.cuda.mem_efficient_sdp_enabled()
+    else:
+        fingerprint["cpu"] = platform.processor() or platform.machine()
+        fingerprint["threads"] = torch.get_num_threads()
+
+    if pipe is not None:
+        processors = {type(p).__name__ for p in pipe.unet.attn_processors.values()}
+        fingerprint["attention"] = ",".join(sorted(processors))
+
+    try:
+        fingerprint["git_commit"] = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).parent, capture_output=True, text=True, timeout=5
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        fingerprint["git_commit"] = None
+    return fingerprint
+
+
+def _betacf(a: float, b: float, x: float) -> float:
+    """Continued fraction for the regularized incomplete beta function (Lentz's method)."""
+    tiny = 1e-30
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1.0)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    h = d
+    for m in range(1, 200):
+        m2 = 2 * m
+        for numerator in (
+            m * (b - m) * x / ((a + m2 - 1) * (a + m2)),
+            -(a + m) * (a + b + m) * x / ((a + m2) * (a + m2 + 1)),
+        ):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            h *= d * c
+        if abs(d * c - 1.0) < 1e-12:
+            break
+    return h
+
+
+def _incomplete_beta(a: float, b: float, x: float) -> float:
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x))
+    if x < (a + 1) / (a + b + 2):
+        return front * _betacf(a, b, x) / a
+    return 1.0 - front * _betacf(b, a, 1 - x) / b
+
+
+def welch_t_test(a: List[float], b: List[float]) -> Tuple[float, float]:
+    """
+    Two-sided Welch's t-test for a difference in means.
+
+    Returns:
+        (t statistic, p-value); p is 1.0 when either side has fewer than two samples
+    """
+    if len(a) < 2 or len(b) < 2:
+        return 0.0, 1.0
+    mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+    var_a = sum((x - mean_a) ** 2 for x in a) / (len(a) - 1)
+    var_b = sum((x - mean_b) ** 2 for x in b) / (len(b) - 1)
+    se_a, se_b = var_a / len(a), var_b / len(b)
+    if se_a + se_b == 0:
+        return 0.0, 1.0 if mean_a == mean_b else 0.0
+    t = (mean_b - mean_a) / math.sqrt(se_a + se_b)
+    dof = (se_a + se_b) ** 2 / (
+        (se_a ** 2 / (len(a) - 1) if se_a else 0.0) + (se_b ** 2 / (len(b) - 1) if se_b else 0.0)
+    )
+    p = _incomplete_beta(dof / 2, 0.5, dof / (dof + t * t))
+    return t, p
+
+
+class BenchmarkHistory:
+    """Append-only JSONL file of benchmark runs, plus an optional baseline run."""
+
+    def __init__(self, path: str = DEFAULT_HISTORY):
+        """
+        Initialize the history.
+
+        Args:
+            path: JSONL file to append runs to (created on first write);
+                the baseline is kept next to it in baseline.json
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.baseline_path = self.path.with_name("baseline.json")
+        self._lock = threading.Lock()
+
+    def append(self, run: Dict):
+        """Append one run (one line, written with a single O_APPEND write)."""
+        line = (json.dumps(run, sort_keys=True) + "\n").encode("utf-8")
+        with self._lock:
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+
+    def runs(self) -> List[Dict]:
+        """All runs, oldest first."""
+        if not self.path.exists():
+            return []
+        with open(self.path, "r") as f:
+            return [json.loads(line) for line in f if line.strip()]
+
+    def get(self, ref: str) -> Dict:
+        """
+        Look up a run by ID, unique ID prefix, label, or position.
+
+        Args:
+            ref: Run ID (or prefix), label, "latest", "previous" or "baseline"
+
+        Returns:
+            The most recent matching run
+        """
+        runs = self.runs()
+        if not runs:
+            raise ValueError(f"No benchmark runs recorded in {self.path}")
+        if ref == "latest":
+            return runs[-1]
+        if ref == "previous":
+            if len(runs) < 2:
+                raise ValueError("Only one run recorded; nothing to compare against")
+            return runs[-2]
+        if ref == "baseline":
+            baseline = self.baseline()
+            if baseline is None:
+                raise ValueError("No baseline set; use 'benchmark_history.py baseline <run>'")
+            ref = baseline
+        matches = [run for run in runs if run["run_id"].startswith(ref) or run.get("label") == ref]
+        if not matches:
+            raise ValueError(f"Unknown run: {ref}")
+        return matches[-1]
+
+    def baseline(self) -> Optional[str]:
+        if not self.baseline_path.exists():
+            return None
+        with open(self.baseline_path, "r") as f:
+            return json.load(f).get("run_id")
+
+    def set_baseline(self, ref: str) -> str:
+        run_id = self.get(ref)["run_id"]
+        tmp_path = self.baseline_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"run_id": run_id}, f)
+        os.replace(tmp_path, self.baseline_path)
+        return run_id
+
+
+def compare_runs(
+    old: Dict,
+    new: Dict,
+    alpha: float = 0.05,
+    min_change: float = 0.05
+) -> List[Dict]:
+    """
+    Line up scenarios present in both runs and test each for a change in latency.
+
+    A scenario is flagged when Welch's t-test on the per-run latencies gives
+    p < alpha and the mean moved by more than min_change (a fraction), so
+    tiny but consistent differences are not reported as regressions.
+
+    Returns:
+        One row per common scenario with old/new means, change, p-value and verdict
+    """
+    old_tests = {t["scenario"]: t for t in old["tests"] if "scenario" in t}
+    rows = []
+    for test in new["tests"]:
+        scenario = test.get("scenario")
+        if scenario not in old_tests:
+            continue
+        a = old_tests[scenario].get("samples") or [old_tests[scenario]["time_seconds"]]
+        b = test.get("samples") or [test["time_seconds"]]
+        mean_a, mean_b = sum(a) / len(a), sum(b) / len(b)
+        change = (mean_b - mean_a) / mean_a if mean_a else 0.0
+        _, p = welch_t_test(a, b)
+        significant = p < alpha and abs(change) > min_change
+        if significant:
+            verdict = "SLOWER" if change > 0 else "faster"
+        else:
+            verdict = "same"
+        rows.append({
+            "scenario": scenario,
+            "old_mean": mean_a,
+            "new_mean": mean_b,
+            "change": change,
+            "p_value": p,
+            "verdict": verdict,
+        })
+    return rows
+
+
+def print_comparison(old: Dict, new: Dict, rows: List[Dict]):
+    print(f"Comparing {old['run_id']} ({old.get('label') or 'no label'}) "
+          f"-> {new['run_id']} ({new.get('label') or 'no label'})")
+
+    old_env, new_env = old.get("environment", {}), new.get("environment", {})
+    changed = sorted(k for k in set(old_env) | set(new_env) if old_env.get(k) != new_env.get(k))
+    if changed:
+        print("\nEnvironment changes:")
+        for key in changed:
+            print(f"  {key}: {old_env.get(key)} -> {new_env.get(key)}")
+
+    print(f"\n{'Scenario':<52} {'Old (s)':>9} {'New (s)':>9} {'Change':>8} {'p':>7}  Verdict")
+    for row in rows:
+        print(f"{row['scenario'][:52]:<52} {row['old_mean']:>9.3f} {row['new_mean']:>9.3f} "
+              f"{row['change'] * 100:>+7.1f}% {row['p_value']:>7.3f}  {row['verdict']}")
+    if not rows:
+        print("  (no scenarios in common)")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="List, compare and baseline recorded benchmark runs"
+    )
+
+    parser.add_argument(
+        "--history",
+        type=str,
+        default=DEFAULT_HISTORY,
+        help="History file written by benchmark.py"
+    )
+
+    subparsers = parser.add_subparsers(dest='command', help='Commands')
+
+    subparsers.add_parser('list', help='List recorded runs')
+
+    compare_parser = subparsers.add_parser('compare', help='Compare two runs')
+    compare_parser.add_argument(
+        'old',
+        nargs='?',
+        default=None,
+        help='Run ID, label, "previous" or "baseline" (default: baseline if set, else previous)'
+    )
+    compare_parser.add_argument('new', nargs='?', default='latest', help='Run to check (default: latest)')
+    compare_parser.add_argument('--alpha', type=float, default=0.05, help='Significance level')
+    compare_parser.add_argument(
+        '--min-change',
+        type=float,
+        default=5.0,
+        help='Smallest latency change (percent) reported as a regression'
+    )
+
+    baseline_parser = subparsers.add_parser('baseline', help='Mark a run as the baseline')
+    baseline_parser.add_argument('run', nargs='?', default='latest', help='Run ID or label (default: latest)')
+
+    args = parser.parse_args()
+
+    history = BenchmarkHistory(args.history)
+
+    try:
+        if args.command == 'list':
+            baseline = history.baseline()
+            for run in history.runs():
+                env = run.get("environment", {})
+                marker = " (baseline)" if run["run_id"] == baseline else ""
+                print(f"{run['run_id']}  {run.get('label') or '-':<16} {run.get('profile', '?'):<5} "
+                      f"{env.get('gpu') or env.get('cpu', '?')}  torch {env.get('torch', '?')}  "
+                      f"{len(run['tests'])} scenario(s){marker}")
+        elif args.command == 'compare':
+            old_ref = args.old or ("baseline" if history.baseline() else "previous")
+            old, new = history.get(old_ref), history.get(args.new)
+            rows = compare_runs(old, new, alpha=args.alpha, min_change=args.min_change / 100)
+            print_comparison(old, new, rows)
+            regressions = [row for row in rows if row["verdict"] == "SLOWER"]
+            if regressions:
+                print(f"\n✗ {len(regressions)} scenario(s) significantly slower")
+                sys.exit(1)
+            print("\n✓ No significant slowdowns")
+        elif args.command == 'baseline':
+            run_id = history.set_baseline(args.run)
+            print(f"✓ Baseline set to {run_id}")
+        else:
+            parser.print_help()
+    except ValueError as e:
+        print(f"Error: {e}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
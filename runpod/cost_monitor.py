@@ -6,8 +6,191 @@ Tracks usage time and estimates costs
 
 import argparse
 import json
+import math
+import sys
+import time
 from datetime import datetime, timedelta
 from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add parent directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+from usage_log import DEFAULT_USAGE_LOG, UsageLog
+
+
+# Defaults for workload entries that leave a parameter out
+IMAGE_DEFAULTS = {"width": 1024, "height": 1024, "steps": 30}
+VIDEO_DEFAULTS = {"width": 1024, "height": 576, "num_frames": 25, "steps": 25, "decode_chunk_size": 8}
+
+
+def normalize_job(job: Dict) -> Dict:
+    """
+    Fill in defaults for one workload entry.
+
+    Entries look like {"type": "image", "width", "height", "steps", "count"}
+    or {"type": "video", "width", "height", "num_frames", "steps",
+    "decode_chunk_size", "count"}; "num_inference_steps" is accepted for "steps".
+    """
+    kind = job.get("type", "image")
+    if kind not in ("image", "video"):
+        raise ValueError(f"Unknown job type: {kind}")
+    normalized = dict(IMAGE_DEFAULTS if kind == "image" else VIDEO_DEFAULTS)
+    normalized.update({k: v for k, v in job.items() if k in normalized})
+    if "num_inference_steps" in job:
+        normalized["steps"] = job["num_inference_steps"]
+    normalized["type"] = kind
+    normalized["count"] = job.get("count", 1)
+    return normalized
+
+
+def stage_features(job: Dict) -> Dict[str, List[float]]:
+    """
+    The workload quantities each pipeline stage's time is proportional to.
+
+    Prompt and image encoding are fixed per job; the UNet scales with
+    pixels x steps (x frames for video); decoding scales with pixels
+    (x frames, plus one decoder call per decode chunk for video); MP4
+    encoding scales with frames.
+    """
+    megapixels = job["width"] * job["height"] / 1e6
+    if job["type"] == "image":
+        return {
+            "text_encode": [1.0],
+            "unet_total": [megapixels * job["steps"]],
+            "vae_decode": [megapixels],
+            "save": [megapixels],
+        }
+    frames = job["num_frames"]
+    return {
+        "image_encode": [1.0],
+        "unet_total": [megapixels * frames * job["steps"]],
+        "vae_decode": [megapixels * frames, math.ceil(frames / job["decode_chunk_size"])],
+        "save": [float(frames)],
+    }
+
+
+def _fit_through_origin(xs: List[List[float]], ys: List[float]) -> List[float]:
+    """
+    Least-squares coefficients for y = sum(c_i * x_i) with one or two features.
+
+    With two features, falls back to the first one alone when the data cannot
+    separate them (one distinct point) or the fit goes negative.
+    """
+    sxx = sum(x[0] * x[0] for x in xs)
+    single = [sum(x[0] * y for x, y in zip(xs, ys)) / sxx if sxx else 0.0]
+    if len(xs[0]) == 1:
+        return single
+    a = sxx
+    b = sum(x[0] * x[1] for x in xs)
+    d = sum(x[1] * x[1] for x in xs)
+    e = sum(x[0] * y for x, y in zip(xs, ys))
+    f = sum(x[1] * y for x, y in zip(xs, ys))
+    det = a * d - b * b
+    if abs(det) <= 1e-9 * max(a * d, 1e-12):
+        return single + [0.0]
+    c0, c1 = (e * d - b * f) / det, (a * f - b * e) / det
+    if c0 < 0 or c1 < 0:
+        return single + [0.0]
+    return [c0, c1]
+
+
+def _test_job(test: Dict) -> Dict:
+    """Workload entry equivalent to one benchmark test."""
+    width, height = (int(v) for v in test["resolution"].split("x"))
+    if test["type"] == "image_generation":
+        return normalize_job({"type": "image", "width": width, "height": height, "steps": test["steps"]})
+    return normalize_job({
+        "type": "video",
+        "width": width,
+        "height": height,
+        "num_frames": test["num_frames"],
+        "steps": test["steps"],
+        "decode_chunk_size": test.get("decode_chunk_size", VIDEO_DEFAULTS["decode_chunk_size"]),
+    })
+
+
+class LatencyModel:
+    """
+    Per-GPU latency model fitted to benchmark stage timings.
+
+    Every stage gets its own coefficients over stage_features(); what the
+    stages do not explain (scheduler, Python overhead) becomes a fixed
+    per-job "overhead" term. Because each stage is fitted against the
+    quantity that drives it, a benchmark at a single resolution still
+    extrapolates to other sizes, step counts and frame counts.
+    """
+
+    def __init__(self, gpu_type: str):
+        self.gpu_type = gpu_type
+        self.coefficients: Dict[str, Dict[str, List[float]]] = {}
+        self.samples: Dict[str, int] = {}
+        self.error: Dict[str, float] = {}
+
+    @classmethod
+    def fit(cls, gpu_type: str, tests: List[Dict]) -> "LatencyModel":
+        """
+        Fit the model.
+
+        Args:
+            gpu_type: GPU the tests ran on
+            tests: Test entries from benchmark.py results (with "stages")
+
+        Returns:
+            The fitted model (kinds without tests are left out)
+        """
+        model = cls(gpu_type)
+        for kind, test_type in (("image", "image_generation"), ("video", "video_generation")):
+            rows = [(_test_job(t), t) for t in tests if t.get("type") == test_type and t.get("stages")]
+            if not rows:
+                continue
+            coefficients = {}
+            for stage in stage_features(rows[0][0]):
+                xs = [stage_features(job)[stage] for job, _ in rows]
+                ys = [test["stages"].get(stage, {}).get("mean", 0.0) for _, test in rows]
+                coefficients[stage] = _fit_through_origin(xs, ys)
+            model.coefficients[kind] = coefficients
+
+            residuals = [test["time_seconds"] - model._stage_seconds(job) for job, test in rows]
+            coefficients["overhead"] = [max(0.0, sum(residuals) / len(residuals))]
+            model.samples[kind] = len(rows)
+            errors = [abs(model.predict(job) - test["time_seconds"]) / test["time_seconds"]
+                      for job, test in rows if test["time_seconds"] > 0]
+            model.error[kind] = sum(errors) / len(errors) if errors else 0.0
+        return model
+
+    def _stage_seconds(self, job: Dict) -> float:
+        coefficients = self.coefficients[job["type"]]
+        return sum(
+            sum(c * x for c, x in zip(coefficients[stage], features))
+            for stage, features in stage_features(job).items()
+        )
+
+    def predict(self, job: Dict) -> float:
+        """Seconds for one item of a normalized workload entry."""
+        if job["type"] not in self.coefficients:
+            raise ValueError(f"No {job['type']} benchmarks for {self.gpu_type}")
+        return self._stage_seconds(job) + self.coefficients[job["type"]]["overhead"][0]
+
+
+def match_gpu_type(device_name: str, known: List[str]) -> str:
+    """Map a CUDA device name (e.g. "NVIDIA GeForce RTX 4090") to a GPU_PRICES key."""
+    name = device_name.upper().replace("-", " ")
+    for gpu_type in sorted(known, key=len, reverse=True):
+        if all(token in name for token in gpu_type.upper().split()):
+            return gpu_type
+    return device_name
+
+
+def load_workload(path: str) -> List[Dict]:
+    """Read a workload manifest: a JSON list or JSONL of job entries (see normalize_job)."""
+    with open(path, "r") as f:
+        text = f.read()
+    if text.lstrip().startswith("["):
+        entries = json.loads(text)
+    else:
+        entries = [json.loads(line) for line in text.splitlines() if line.strip()]
+    return [normalize_job(entry) for entry in entries]
 
 
 class CostMonitor:
@@ -23,68 +206,71 @@ class CostMonitor:
         "H100": 3.99,
     }
 
-    def __init__(self, log_file: str = "./runpod/usage_log.json"):
-        self.log_file = Path(log_file)
-        self.log_file.parent.mkdir(parents=True, exist_ok=True)
-        self.sessions = self.load_log()
-
-    def load_log(self):
-        """Load usage log from file."""
-        if self.log_file.exists():
-            with open(self.log_file, 'r') as f:
-                return json.load(f)
-        return {"sessions": []}
-
-    def save_log(self):
-        """Save usage log to file."""
-        with open(self.log_file, 'w') as f:
-            json.dump(self.sessions, f, indent=2)
+    def __init__(self, log_file: str = DEFAULT_USAGE_LOG):
+        """
+        Initialize the monitor.
+
+        Args:
+            log_file: Append-only usage event log (see usage_log.UsageLog)
+        """
+        self.usage = UsageLog(log_file)
+        self._migrate_json_log(self.usage.path.with_name("usage_log.json"))
+        # Latency models fitted by load_benchmarks(), keyed by GPU type
+        self.models: Dict[str, LatencyModel] = {}
+
+    def _migrate_json_log(self, old_log: Path):
+        """Replay sessions from the old whole-file usage_log.json into the event log, once."""
+        if not old_log.exists():
+            return
+        with open(old_log, 'r') as f:
+            sessions = json.load(f).get("sessions", [])
+        for index, session in enumerate(sessions):
+            session_id = f"migrated-{index}"
+            self.usage.append({
+                "event": "session_start",
+                "session": session_id,
+                "gpu_type": session["gpu_type"],
+                "pod_id": session.get("pod_id"),
+                "rate": self.GPU_PRICES.get(session["gpu_type"], 0),
+                "time": datetime.fromisoformat(session["start_time"]).timestamp(),
+            })
+            if session.get("end_time"):
+                self.usage.append({
+                    "event": "session_end",
+                    "session": session_id,
+                    "time": datetime.fromisoformat(session["end_time"]).timestamp(),
+                })
+        old_log.rename(old_log.with_suffix(".json.migrated"))
+        print(f"✓ Migrated {len(sessions)} session(s) from {old_log} to {self.usage.path}")
 
     def start_session(self, gpu_type: str, pod_id: str = None):
         """Start a new usage session."""
-        session = {
-            "pod_id": pod_id or "unknown",
-            "gpu_type": gpu_type,
-            "start_time": datetime.now().isoformat(),
-            "end_time": None,
-            "duration_hours": 0,
-            "estimated_cost": 0
-        }
-        self.sessions["sessions"].append(session)
-        self.save_log()
+        session_id = self.usage.start_session(gpu_type, pod_id, self.GPU_PRICES.get(gpu_type, 0))
 
         print(f"✓ Session started: {gpu_type}")
+        print(f"  Session ID: {session_id}")
         print(f"  Pod ID: {pod_id}")
         print(f"  Hourly rate: ${self.GPU_PRICES.get(gpu_type, 0):.2f}/hour")
-        return len(self.sessions["sessions"]) - 1
+        return session_id
 
-    def end_session(self, session_index: int = -1):
-        """End a usage session."""
-        if not self.sessions["sessions"]:
+    def end_session(self, session_id: Optional[str] = None):
+        """End a usage session (default: the most recently started open one)."""
+        open_sessions = self.usage.rollup()["open_sessions"]
+        if not open_sessions:
             print("No active sessions")
             return
-
-        session = self.sessions["sessions"][session_index]
-        if session["end_time"]:
-            print("Session already ended")
+        if session_id is None:
+            session_id = max(open_sessions.values(), key=lambda s: s["start_time"])["session"]
+        elif session_id not in open_sessions:
+            print(f"No active session {session_id}")
             return
 
-        start = datetime.fromisoformat(session["start_time"])
-        end = datetime.now()
-        duration = (end - start).total_seconds() / 3600  # Convert to hours
-
-        session["end_time"] = end.isoformat()
-        session["duration_hours"] = round(duration, 3)
-        session["estimated_cost"] = round(
-            duration * self.GPU_PRICES.get(session["gpu_type"], 0),
-            2
-        )
-
-        self.save_log()
+        self.usage.end_session(session_id)
+        session = next(s for s in self.usage.rollup()["recent_sessions"] if s["session"] == session_id)
 
         print(f"\n✓ Session ended")
         print(f"  GPU: {session['gpu_type']}")
-        print(f"  Duration: {duration:.2f} hours ({int(duration * 60)} minutes)")
+        print(f"  Duration: {session['duration_hours']:.2f} hours ({int(session['duration_hours'] * 60)} minutes)")
         print(f"  Estimated cost: ${session['estimated_cost']:.2f}")
 
     def estimate_cost(self, gpu_type: str, hours: float):
@@ -93,15 +279,154 @@ class CostMonitor:
         cost = hours * rate
         return cost
 
+    def load_benchmarks(self, sources: List[str]) -> Dict[str, LatencyModel]:
+        """
+        Fit a latency model per GPU from benchmark.py results.
+
+        Args:
+            sources: benchmark_*.json files, history.jsonl files, or
+                directories containing them (a directory's history.jsonl is
+                used when present, otherwise its benchmark_*.json files)
+
+        Returns:
+            The fitted models, keyed by GPU type
+        """
+        runs = []
+        for source in sources:
+            path = Path(source)
+            if path.is_dir():
+                history = path / "history.jsonl"
+                files = [history] if history.exists() else sorted(path.glob("benchmark_*.json"))
+            else:
+                files = [path]
+            for file in files:
+                with open(file, "r") as f:
+                    if file.suffix == ".jsonl":
+                        runs.extend(json.loads(line) for line in f if line.strip())
+                    else:
+                        runs.append(json.load(f))
+
+        tests_by_gpu: Dict[str, List[Dict]] = {}
+        for run in runs:
+            gpu = (run.get("environment") or {}).get("gpu")
+            if not gpu:
+                # CPU and tiny-model runs say nothing about GPU latency
+                continue
+            gpu_type = match_gpu_type(gpu, list(self.GPU_PRICES))
+            tests_by_gpu.setdefault(gpu_type, []).extend(run.get("tests", []))
+
+        self.models = {gpu: LatencyModel.fit(gpu, tests) for gpu, tests in tests_by_gpu.items()}
+        return self.models
+
+    def estimate_workload(self, gpu_type: str, jobs: List[Dict]) -> Dict:
+        """
+        Predict wall time and cost of a workload on one GPU.
+
+        Args:
+            gpu_type: GPU with a fitted latency model
+            jobs: Normalized workload entries (see load_workload)
+
+        Returns:
+            {"gpu", "seconds", "hours", "cost", "images", "videos"}
+        """
+        model = self.models.get(gpu_type)
+        if model is None:
+            raise ValueError(f"No benchmark results for {gpu_type}")
+        seconds = sum(model.predict(job) * job["count"] for job in jobs)
+        hours = seconds / 3600
+        return {
+            "gpu": gpu_type,
+            "seconds": seconds,
+            "hours": hours,
+            "cost": self.estimate_cost(gpu_type, hours),
+            "images": sum(job["count"] for job in jobs if job["type"] == "image"),
+            "videos": sum(job["count"] for job in jobs if job["type"] == "video"),
+        }
+
+    def recommend_gpu(self, jobs: List[Dict], deadline_hours: Optional[float] = None) -> Optional[Dict]:
+        """
+        Find the cheapest benchmarked GPU that finishes the workload in time.
+
+        Args:
+            jobs: Normalized workload entries (see load_workload)
+            deadline_hours: Latest acceptable wall time (None for no deadline)
+
+        Returns:
+            The winning estimate_workload() result, or None if no GPU meets the deadline
+        """
+        kinds = {job["type"] for job in jobs}
+        estimates = [
+            self.estimate_workload(gpu, jobs) for gpu, model in self.models.items()
+            if gpu in self.GPU_PRICES and kinds <= set(model.coefficients)
+        ]
+        estimates.sort(key=lambda e: e["cost"])
+
+        print("\n" + "=" * 60)
+        print("GPU RECOMMENDATION")
+        print("=" * 60)
+        images = sum(job["count"] for job in jobs if job["type"] == "image")
+        videos = sum(job["count"] for job in jobs if job["type"] == "video")
+        print(f"Workload: {images} image(s), {videos} video(s)")
+        if deadline_hours is not None:
+            print(f"Deadline: {deadline_hours:.2f} hours")
+        print(f"\n  {'GPU':20s} {'Time':>10s} {'Cost':>9s}")
+        for estimate in estimates:
+            late = deadline_hours is not None and estimate["hours"] > deadline_hours
+            print(f"  {estimate['gpu']:20s} {estimate['hours']:>9.2f}h ${estimate['cost']:>8.2f}"
+                  f"{'  misses deadline' if late else ''}")
+        missing = [gpu for gpu in self.GPU_PRICES if gpu not in {e["gpu"] for e in estimates}]
+        if missing:
+            print(f"\n  No benchmark results: {', '.join(missing)}")
+
+        on_time = [e for e in estimates if deadline_hours is None or e["hours"] <= deadline_hours]
+        print()
+        if on_time:
+            best = on_time[0]
+            print(f"✓ Cheapest: {best['gpu']} — {best['hours']:.2f} hours, ${best['cost']:.2f}")
+        else:
+            best = None
+            print("✗ No benchmarked GPU meets the deadline")
+        print("=" * 60)
+        return best
+
+    def print_models(self):
+        """Show the fitted latency models."""
+        if not self.models:
+            print("No GPU benchmark results found (run runpod/benchmark.py on a pod first)")
+            return
+        for gpu, model in sorted(self.models.items()):
+            print(f"\n{gpu}:")
+            for kind, coefficients in model.coefficients.items():
+                print(f"  {kind}: {model.samples[kind]} test(s), "
+                      f"mean error {model.error[kind] * 100:.1f}% on the benchmark itself")
+                for stage, values in coefficients.items():
+                    print(f"    {stage:>12s}: {', '.join(f'{v:.4g}' for v in values)}")
+            for kind, job in (("image", normalize_job({"type": "image"})), ("video", normalize_job({"type": "video"}))):
+                if kind in model.coefficients:
+                    print(f"  default {kind}: {model.predict(job):.1f}s")
+
     def estimate_for_workflow(
         self,
         gpu_type: str,
         num_images: int = 0,
         num_videos: int = 0,
-        time_per_image: float = 30,  # seconds
-        time_per_video: float = 120,  # seconds
+        time_per_image: Optional[float] = None,  # seconds
+        time_per_video: Optional[float] = None,  # seconds
     ):
-        """Estimate cost for a specific workflow."""
+        """
+        Estimate cost for a specific workflow.
+
+        Per-item times default to the GPU's fitted latency model at the
+        default 1024x1024/30-step image and 25-frame video, or to 30s and
+        120s when no benchmarks are loaded for the GPU.
+        """
+        model = self.models.get(gpu_type)
+        if time_per_image is None:
+            has_model = model is not None and "image" in model.coefficients
+            time_per_image = round(model.predict(normalize_job({"type": "image"})), 1) if has_model else 30
+        if time_per_video is None:
+            has_model = model is not None and "video" in model.coefficients
+            time_per_video = round(model.predict(normalize_job({"type": "video"})), 1) if has_model else 120
         total_time_seconds = (num_images * time_per_image) + (num_videos * time_per_video)
         total_hours = total_time_seconds / 3600
         cost = self.estimate_cost(gpu_type, total_hours)
@@ -119,31 +444,53 @@ class CostMonitor:
 
         return cost
 
-    def get_summary(self):
-        """Get usage summary."""
-        if not self.sessions["sessions"]:
+    def get_summary(self, days: int = 7):
+        """
+        Get usage summary from the rollup (constant time, however long the log).
+
+        Args:
+            days: Number of most recent days to break down
+        """
+        rollup = self.usage.rollup()
+        totals = rollup["totals"]
+        if not totals["sessions"] and not rollup["open_sessions"] and not totals["jobs"]:
             print("No usage sessions recorded")
             return
 
-        total_cost = sum(s["estimated_cost"] for s in self.sessions["sessions"])
-        total_hours = sum(s["duration_hours"] for s in self.sessions["sessions"])
-        active_sessions = sum(1 for s in self.sessions["sessions"] if not s["end_time"])
+        # Open sessions are billed up to now
+        open_hours = sum(time.time() - s["start_time"] for s in rollup["open_sessions"].values()) / 3600
+        open_cost = sum((time.time() - s["start_time"]) / 3600 * s["rate"] for s in rollup["open_sessions"].values())
 
         print("\n" + "=" * 60)
         print("USAGE SUMMARY")
         print("=" * 60)
-        print(f"Total sessions: {len(self.sessions['sessions'])}")
-        print(f"Active sessions: {active_sessions}")
-        print(f"Total runtime: {total_hours:.2f} hours")
-        print(f"Total cost: ${total_cost:.2f}")
+        print(f"Total sessions: {totals['sessions'] + len(rollup['open_sessions'])}")
+        print(f"Active sessions: {len(rollup['open_sessions'])}")
+        print(f"Total runtime: {totals['hours'] + open_hours:.2f} hours")
+        print(f"Total cost: ${totals['cost'] + open_cost:.2f}")
+        if totals["jobs"]:
+            busy = totals["gpu_seconds"] / 3600 / (totals["hours"] + open_hours) if totals["hours"] + open_hours else 0
+            print(f"Generation jobs: {totals['jobs']} ({totals['gpu_seconds'] / 3600:.2f} GPU-hours, "
+                  f"{busy * 100:.0f}% of billed time)")
         print("=" * 60)
 
+        print("\nBy GPU:")
+        for gpu, bucket in sorted(rollup["gpus"].items()):
+            print(f"  {gpu:20s} {bucket['hours']:>7.2f}h  ${bucket['cost']:>7.2f}  "
+                  f"{bucket['jobs']} job(s), {bucket['gpu_seconds'] / 60:.1f} GPU-min")
+
+        print(f"\nLast {days} day(s):")
+        for day in sorted(rollup["days"])[-days:]:
+            bucket = rollup["days"][day]
+            print(f"  {day}  {bucket['hours']:>7.2f}h  ${bucket['cost']:>7.2f}  {bucket['jobs']} job(s)")
+
         # Show recent sessions
         print("\nRecent sessions:")
-        for session in self.sessions["sessions"][-5:]:
-            start = datetime.fromisoformat(session["start_time"])
-            status = "ACTIVE" if not session["end_time"] else "ENDED"
-            print(f"  [{status}] {session['gpu_type']} - {start.strftime('%Y-%m-%d %H:%M')} - ${session['estimated_cost']:.2f}")
+        for session in list(rollup["open_sessions"].values()) + rollup["recent_sessions"][::-1][:5]:
+            start = datetime.fromtimestamp(session["start_time"])
+            status = "ACTIVE" if "end_time" not in session else "ENDED"
+            cost = session.get("estimated_cost", (time.time() - session["start_time"]) / 3600 * session["rate"])
+            print(f"  [{status}] {session['gpu_type']} - {start.strftime('%Y-%m-%d %H:%M')} - ${cost:.2f}")
 
     def list_gpu_prices(self):
         """List available GPU types and prices."""
@@ -169,30 +516,75 @@ def main():
     start_parser.add_argument('--pod-id', type=str, default=None, help='Pod ID')
 
     # End session
-    subparsers.add_parser('end', help='End current session')
+    end_parser = subparsers.add_parser('end', help='End current session')
+    end_parser.add_argument('--session', type=str, default=None, help='Session ID (default: most recent)')
 
     # Estimate
     estimate_parser = subparsers.add_parser('estimate', help='Estimate costs')
     estimate_parser.add_argument('--gpu', type=str, required=True, help='GPU type')
     estimate_parser.add_argument('--images', type=int, default=0, help='Number of images')
     estimate_parser.add_argument('--videos', type=int, default=0, help='Number of videos')
-    estimate_parser.add_argument('--time-per-image', type=float, default=30, help='Seconds per image')
-    estimate_parser.add_argument('--time-per-video', type=float, default=120, help='Seconds per video')
+    estimate_parser.add_argument(
+        '--time-per-image',
+        type=float,
+        default=None,
+        help='Seconds per image (default: from benchmarks, else 30)'
+    )
+    estimate_parser.add_argument(
+        '--time-per-video',
+        type=float,
+        default=None,
+        help='Seconds per video (default: from benchmarks, else 120)'
+    )
+    estimate_parser.add_argument('--workload', type=str, default=None, help='Workload manifest (JSON or JSONL)')
+
+    # Recommend
+    recommend_parser = subparsers.add_parser('recommend', help='Cheapest GPU that meets a deadline')
+    recommend_parser.add_argument('--workload', type=str, required=True, help='Workload manifest (JSON or JSONL)')
+    recommend_parser.add_argument('--deadline', type=float, default=None, help='Deadline in hours')
+
+    # Latency models
+    models_parser = subparsers.add_parser('models', help='Show latency models fitted to benchmark results')
 
     # Summary
-    subparsers.add_parser('summary', help='Show usage summary')
+    summary_parser = subparsers.add_parser('summary', help='Show usage summary')
+    summary_parser.add_argument('--days', type=int, default=7, help='Days to break down')
+
+    # Compact
+    subparsers.add_parser('compact', help='Fold the event log into the rollup and start a new log')
 
     # List prices
     subparsers.add_parser('prices', help='List GPU prices')
 
+    for model_parser in (estimate_parser, recommend_parser, models_parser):
+        model_parser.add_argument(
+            '--benchmarks',
+            type=str,
+            action='append',
+            default=None,
+            help='benchmark.py results file or directory (repeatable, default: ./benchmark_results)'
+        )
+
     args = parser.parse_args()
 
     monitor = CostMonitor()
+    if args.command in ('estimate', 'recommend', 'models'):
+        sources = args.benchmarks or ['./benchmark_results']
+        monitor.load_benchmarks([source for source in sources if Path(source).exists()])
 
     if args.command == 'start':
         monitor.start_session(args.gpu, args.pod_id)
     elif args.command == 'end':
-        monitor.end_session()
+        monitor.end_session(args.session)
+    elif args.command == 'estimate' and args.workload:
+        try:
+            estimate = monitor.estimate_workload(args.gpu, load_workload(args.workload))
+        except ValueError as e:
+            print(f"Error: {e}")
+            return
+        print(f"\n{estimate['gpu']}: {estimate['images']} image(s), {estimate['videos']} video(s)")
+        print(f"Estimated time: {estimate['hours']:.2f} hours ({int(estimate['seconds'] / 60)} minutes)")
+        print(f"Estimated cost: ${estimate['cost']:.2f}")
     elif args.command == 'estimate':
         monitor.estimate_for_workflow(
             args.gpu,
@@ -201,8 +593,15 @@ def main():
             args.time_per_image,
             args.time_per_video
         )
+    elif args.command == 'recommend':
+        monitor.recommend_gpu(load_workload(args.workload), args.deadline)
+    elif args.command == 'models':
+        monitor.print_models()
     elif args.command == 'summary':
-        monitor.get_summary()
+        monitor.get_summary(args.days)
+    elif args.command == 'compact':
+        monitor.usage.rollup(compact=True)
+        print(f"✓ Compacted {monitor.usage.path}")
     elif args.command == 'prices':
         monitor.list_gpu_prices()
     else:
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Tiny Random-Weight Models
+Builds miniature SDXL and SVD pipelines with random weights so benchmarks run on a CPU-only box
+"""
+
+import argparse
+import json
+import tempfile
+from pathlib import Path
+from typing import Dict
+
+import torch
+from diffusers import (
+    AutoencoderKL,
+    AutoencoderKLTemporalDecoder,
+    EulerDiscreteScheduler,
+    StableDiffusionXLPipeline,
+    StableVideoDiffusionPipeline,
+    UNet2DConditionModel,
+    UNetSpatioTemporalConditionModel,
+)
+from transformers import (
+    CLIPImageProcessor,
+    CLIPTextConfig,
+    CLIPTextModel,
+    CLIPTextModelWithProjection,
+    CLIPTokenizer,
+    CLIPVisionConfig,
+    CLIPVisionModelWithProjection,
+)
+from transformers.models.clip.tokenization_clip import bytes_to_unicode
+
+
+# Largest size the tiny models are meant for; anything bigger only adds CPU time
+TINY_RESOLUTION = 64
+
+
+def _build_tokenizer(path: Path):
+    """Byte-level CLIP tokenizer with no merges, so no vocabulary download is needed."""
+    chars = list(bytes_to_unicode().values())
+    vocab = {}
+    for char in chars:
+        vocab[char] = len(vocab)
+    for char in chars:
+        vocab[char + "</w>"] = len(vocab)
+    vocab["<|startoftext|>"] = len(vocab)
+    vocab["<|endoftext|>"] = len(vocab)
+
+    with open(path / "vocab.json", "w") as f:
+        json.dump(vocab, f)
+    with open(path / "merges.txt", "w") as f:
+        f.write("#version: 0.2\n")
+    return CLIPTokenizer(str(path / "vocab.json"), str(path / "merges.txt"), model_max_length=77)
+
+
+def build_tiny_sdxl(path: str) -> str:
+    """
+    Save a random-weight SDXL pipeline (~12 MB) with the real architecture's layout.
+
+    Args:
+        path: Directory to save the pipeline to
+
+    Returns:
+        The directory, usable as model_id for SDXLGenerator
+    """
+    torch.manual_seed(0)
+    unet = UNet2DConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=2,
+        sample_size=32,
+        in_channels=4,
+        out_channels=4,
+        down_block_types=("DownBlock2D", "CrossAttnDownBlock2D"),
+        up_block_types=("CrossAttnUpBlock2D", "UpBlock2D"),
+        attention_head_dim=(2, 4),
+        use_linear_projection=True,
+        addition_embed_type="text_time",
+        addition_time_embed_dim=8,
+        transformer_layers_per_block=(1, 2),
+        projection_class_embeddings_input_dim=80,
+        cross_attention_dim=64,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        steps_offset=1,
+        beta_schedule="scaled_linear",
+        timestep_spacing="leading",
+    )
+    vae = AutoencoderKL(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        up_block_types=["UpDecoderBlock2D"] * 2,
+        latent_channels=4,
+        sample_size=128,
+    )
+    text_config = CLIPTextConfig(
+        bos_token_id=0,
+        eos_token_id=2,
+        hidden_size=32,
+        intermediate_size=37,
+        layer_norm_eps=1e-5,
+        num_attention_heads=4,
+        num_hidden_layers=5,
+        pad_token_id=1,
+        vocab_size=1000,
+        hidden_act="gelu",
+        projection_dim=32,
+    )
+    with tempfile.TemporaryDirectory() as tokenizer_dir:
+        tokenizer = _build_tokenizer(Path(tokenizer_dir))
+        pipe = StableDiffusionXLPipeline(
+            vae=vae,
+            text_encoder=CLIPTextModel(text_config),
+            text_encoder_2=CLIPTextModelWithProjection(text_config),
+            tokenizer=tokenizer,
+            tokenizer_2=tokenizer,
+            unet=unet,
+            scheduler=scheduler,
+        )
+        pipe.save_pretrained(path)
+    return str(path)
+
+
+def build_tiny_svd(path: str) -> str:
+    """
+    Save a random-weight Stable Video Diffusion pipeline.
+
+    Args:
+        path: Directory to save the pipeline to
+
+    Returns:
+        The directory, usable as model_id for VideoGenerator
+    """
+    torch.manual_seed(0)
+    unet = UNetSpatioTemporalConditionModel(
+        block_out_channels=(32, 64),
+        layers_per_block=1,
+        sample_size=32,
+        in_channels=8,
+        out_channels=4,
+        down_block_types=("CrossAttnDownBlockSpatioTemporal", "DownBlockSpatioTemporal"),
+        up_block_types=("UpBlockSpatioTemporal", "CrossAttnUpBlockSpatioTemporal"),
+        cross_attention_dim=32,
+        num_attention_heads=8,
+        projection_class_embeddings_input_dim=96,
+        addition_time_embed_dim=32,
+    )
+    scheduler = EulerDiscreteScheduler(
+        beta_start=0.00085,
+        beta_end=0.012,
+        beta_schedule="scaled_linear",
+        interpolation_type="linear",
+        num_train_timesteps=1000,
+        prediction_type="v_prediction",
+        sigma_max=700.0,
+        sigma_min=0.002,
+        steps_offset=1,
+        timestep_spacing="leading",
+        timestep_type="continuous",
+        use_karras_sigmas=True,
+    )
+    vae = AutoencoderKLTemporalDecoder(
+        block_out_channels=[32, 64],
+        in_channels=3,
+        out_channels=3,
+        down_block_types=["DownEncoderBlock2D"] * 2,
+        latent_channels=4,
+    )
+    # The pipeline always resizes the conditioning image to 224 for CLIP
+    vision_config = CLIPVisionConfig(
+        hidden_size=32,
+        projection_dim=32,
+        num_hidden_layers=5,
+        num_attention_heads=4,
+        image_size=224,
+        intermediate_size=37,
+        patch_size=14,
+    )
+
+    pipe = StableVideoDiffusionPipeline(
+        vae=vae,
+        image_encoder=CLIPVisionModelWithProjection(vision_config),
+        unet=unet,
+        scheduler=scheduler,
+        feature_extractor=CLIPImageProcessor(crop_size=224, size=224),
+    )
+    pipe.save_pretrained(path)
+    return str(path)
+
+
+def ensure_tiny_models(root: str) -> Dict[str, str]:
+    """
+    Build the tiny models under root unless they already exist.
+
+    Returns:
+        {"sdxl": path, "svd": path}
+    """
+    root = Path(root)
+    paths = {"sdxl": root / "tiny-sdxl", "svd": root / "tiny-svd"}
+    builders = {"sdxl": build_tiny_sdxl, "svd": build_tiny_svd}
+    for name, path in paths.items():
+        if not (path / "model_index.json").exists():
+            print(f"Building tiny random-weight {name.upper()} model in {path}")
+            builders[name](str(path))
+    return {name: str(path) for name, path in paths.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Build tiny random-weight SDXL and SVD models for CPU benchmarks"
+    )
+
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="./models/tiny",
+        help="Directory to build the models in"
+    )
+
+    args = parser.parse_args()
+
+    paths = ensure_tiny_models(args.output_dir)
+    print(f"\n✓ SDXL: {paths['sdxl']}")
+    print(f"✓ SVD: {paths['svd']}")
+
+
+if __name__ == "__main__":
+    main()
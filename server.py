@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+"""
+Generation Server
+Keeps the SDXL (and optionally SVD) pipelines loaded and serves jobs over local HTTP
+"""
+
+import argparse
+import json
+import queue
+import threading
+import time
+import traceback
+import uuid
+from collections import OrderedDict
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+from generate import SDXLGenerator
+from compile_cache import DEFAULT_COMPILE_CACHE
+from generate_with_config import load_config, resolve_preset, warmup_shapes
+from prompt_cache import PromptEmbeddingCache
+from schedulers import DEFAULT_SCHEDULER, check_scheduler
+from step_metrics import JsonlSink, PrometheusSink, RingBufferSink, StepMetrics
+from token_merging import resolve_token_merge_ratio
+from usage_log import UsageLog, UsageSink
+
+
+IMAGE_FIELDS = (
+    "negative_prompt", "width", "height", "num_inference_steps",
+    "guidance_scale", "num_images", "seed", "lora_scale", "batch_size", "scheduler",
+    "cfg_cutoff", "cfg_converge", "deep_cache_interval", "token_merge_ratio",
+    "early_exit_threshold",
+)
+VIDEO_FIELDS = (
+    "num_frames", "fps", "motion_bucket_id", "noise_aug_strength",
+    "decode_chunk_size", "seed", "deep_cache_interval", "token_merge_ratio",
+    "early_exit_threshold",
+)
+
+# Finished jobs stay pollable for this long, and at most this many are kept
+FINISHED_JOB_TTL_SECONDS = 3600
+MAX_FINISHED_JOBS = 1000
+
+
+class GenerationServer:
+    """Own warm generators and run submitted jobs one at a time on the device."""
+
+    def __init__(self, config: dict, output_dir: str = "./outputs", video_model: Optional[str] = None):
+        """
+        Initialize the server; the image pipeline loads on the worker thread.
+
+        Args:
+            config: Parsed configuration file (model, loras, presets, ...)
+            output_dir: Directory to save generated images and videos
+            video_model: SVD model ID (loaded on the first video job)
+        """
+        self.config = config
+        self.output_dir = output_dir
+        self.video_model = video_model or "stabilityai/stable-video-diffusion-img2vid-xt"
+        self.model_config = config.get("model", {})
+
+        prompt_cache = None
+        cache_config = config.get("prompt_cache")
+        if cache_config and cache_config.get("enabled", True):
+            prompt_cache = PromptEmbeddingCache(
+                memory_budget_mb=cache_config.get("memory_budget_mb", 256),
+                disk_dir=cache_config.get("disk_dir"),
+                disk_budget_mb=cache_config.get("disk_budget_mb", 2048)
+            )
+
+        # Recent steps are always kept in memory for job progress; file sinks are optional
+        metrics_config = config.get("metrics", {})
+        self.recent_steps = RingBufferSink(metrics_config.get("ring_buffer", 1000))
+        sinks = [self.recent_steps]
+        if metrics_config.get("jsonl"):
+            sinks.append(JsonlSink(metrics_config["jsonl"]))
+        if metrics_config.get("prometheus"):
+            sinks.append(PrometheusSink(metrics_config["prometheus"]))
+        if metrics_config.get("usage_log"):
+            sinks.append(UsageSink(UsageLog(metrics_config["usage_log"]), metrics_config.get("gpu_type")))
+        self.step_metrics = StepMetrics(sinks, device=self.model_config.get("device", "cuda"))
+
+        # Loaded by the worker before its first job, so the server answers
+        # (and queues jobs) while the weights are still loading
+        self.prompt_cache = prompt_cache
+        self.image_generator = None
+        self.image_model_state = "loading"
+        self.image_model_error = None
+        self.default_loras = [name for name, lora in config.get("loras", {}).items() if lora.get("enabled", False)]
+        self.video_generator = None
+
+        self.jobs: Dict[str, Dict] = {}
+        self.jobs_lock = threading.Lock()
+        # Queued job ids in run order, and finished ones with their monotonic finish time
+        self.queued_ids: List[str] = []
+        self.finished: "OrderedDict[str, float]" = OrderedDict()
+        self.queue: "queue.Queue[str]" = queue.Queue()
+        self.worker = threading.Thread(target=self._worker_loop, daemon=True)
+        self.worker.start()
+
+    def submit(self, kind: str, payload: Dict) -> Dict:
+        """Queue an image or video job and return its initial status."""
+        if not isinstance(payload, dict):
+            raise ValueError("Request body must be a JSON object")
+        if kind == "image" and not payload.get("prompt"):
+            raise ValueError("'prompt' is required")
+        if kind == "video" and not payload.get("image_path"):
+            raise ValueError("'image_path' is required")
+        for name in payload.get("loras") or []:
+            self._lora_spec(name)
+        if payload.get("scheduler"):
+            check_scheduler(payload["scheduler"])
+        if payload.get("token_merge_ratio") is not None:
+            # Only checks the value; "auto" is resolved against the job's size later
+            resolve_token_merge_ratio(payload["token_merge_ratio"], 0, 0)
+
+        job_id = uuid.uuid4().hex
+        job = {
+            "jobId": job_id,
+            "type": kind,
+            "status": "queued",
+            "request": payload,
+            "result": None,
+            "error": None,
+            "created_at": datetime.now().isoformat(),
+        }
+        with self.jobs_lock:
+            self._evict_finished()
+            self.jobs[job_id] = job
+            self.queued_ids.append(job_id)
+            self.queue.put(job_id)
+        return self.status(job_id)
+
+    def status(self, job_id: str) -> Optional[Dict]:
+        """Return a copy of a job's public status, or None if unknown."""
+        with self.jobs_lock:
+            job = self.jobs.get(job_id)
+            if job is None:
+                return None
+            status = {k: v for k, v in job.items() if k != "request"}
+            # 1-based place in line; 0 once the job has left the queue
+            status["queue_position"] = self.queued_ids.index(job_id) + 1 if job["status"] == "queued" else 0
+        if status["status"] == "running":
+            steps = [e for e in self.recent_steps.recent(job_id=job_id) if e["event"] == "step"]
+            if steps:
+                status["progress"] = {
+                    "step": steps[-1]["step"] + 1,
+                    "total_steps": steps[-1]["total_steps"],
+                    "it_per_sec": steps[-1]["it_per_sec"],
+                }
+        return status
+
+    def _load_image_generator(self):
+        try:
+            self.image_generator = SDXLGenerator(
+                model_id=self.model_config.get("model_id", "stabilityai/stable-diffusion-xl-base-1.0"),
+                vae_model=self.model_config.get("vae_model"),
+                device=self.model_config.get("device", "cuda"),
+                dtype=self.model_config.get("dtype", "float16"),
+                output_dir=self.output_dir,
+                prompt_cache=self.prompt_cache,
+                lora_memory_mb=self.model_config.get("lora_memory_mb"),
+                fused_lora_dir=self.model_config.get("fused_lora_dir"),
+                step_metrics=self.step_metrics,
+                memory_mode=self.model_config.get("memory_mode", "auto"),
+                vram_budget_gb=self.model_config.get("vram_budget_gb"),
+                compile_models=self.model_config.get("compile", False),
+                compile_cache_dir=self.model_config.get("compile_cache_dir") or DEFAULT_COMPILE_CACHE
+            )
+            if self.image_generator.compile_cache is not None:
+                # Compile every preset's shape with the default LoRAs before taking jobs
+                self.image_model_state = "warming_up"
+                self.image_generator.set_loras([self._lora_spec(name) for name in self.default_loras])
+                self.image_generator.warmup(warmup_shapes(self.config))
+                self._load_video_generator(warmup=True)
+            self.image_model_state = "ready"
+            print("✓ Image model ready")
+        except Exception as e:
+            traceback.print_exc()
+            self.image_model_state = "failed"
+            self.image_model_error = str(e)
+
+    def _worker_loop(self):
+        self._load_image_generator()
+        while True:
+            job_id = self.queue.get()
+            with self.jobs_lock:
+                job = self.jobs[job_id]
+                self.queued_ids.remove(job_id)
+                job["status"] = "running"
+                job["started_at"] = datetime.now().isoformat()
+            try:
+                if job["type"] == "image":
+                    result = self._run_image(job["request"], job_id)
+                else:
+                    result = self._run_video(job["request"], job_id)
+                update = {"status": "completed", "result": result}
+            except Exception as e:
+                traceback.print_exc()
+                update = {"status": "failed", "error": str(e)}
+            with self.jobs_lock:
+                job.update(update)
+                job["finished_at"] = datetime.now().isoformat()
+                self.finished[job_id] = time.monotonic()
+                self._evict_finished()
+
+    def _evict_finished(self):
+        """Forget finished jobs past the TTL or over the cap, oldest first (call with jobs_lock held)."""
+        cutoff = time.monotonic() - FINISHED_JOB_TTL_SECONDS
+        while self.finished:
+            job_id, finished_at = next(iter(self.finished.items()))
+            if finished_at >= cutoff and len(self.finished) <= MAX_FINISHED_JOBS:
+                break
+            del self.finished[job_id]
+            del self.jobs[job_id]
+
+    def _run_image(self, request: Dict, job_id: str) -> Dict:
+        if self.image_generator is None:
+            raise RuntimeError(f"Image model failed to load: {self.image_model_error}")
+        params = resolve_preset(self.config, request.get("preset"))
+        kwargs = {
+            "negative_prompt": params.get("negative_prompt", ""),
+            "width": params.get("width", 1024),
+            "height": params.get("height", 1024),
+            "num_inference_steps": params.get("num_inference_steps", 30),
+            "guidance_scale": params.get("guidance_scale", 7.5),
+            "lora_scale": params.get("lora_scale", 1.0),
+            "scheduler": params.get("scheduler", DEFAULT_SCHEDULER),
+            "cfg_cutoff": params.get("cfg_cutoff"),
+            "cfg_converge": params.get("cfg_converge"),
+            "deep_cache_interval": params.get("deep_cache_interval"),
+            "token_merge_ratio": params.get("token_merge_ratio"),
+            "early_exit_threshold": params.get("early_exit_threshold"),
+        }
+        kwargs.update({k: request[k] for k in IMAGE_FIELDS if request.get(k) is not None})
+
+        # Switch LoRA sets per job; the pool keeps recently used adapters resident
+        lora_names = request.get("loras")
+        if lora_names is None:
+            lora_names = self.default_loras
+        self.image_generator.set_loras([self._lora_spec(name) for name in lora_names])
+
+        images = self.image_generator.generate(
+            prompt=request["prompt"], save_metadata=True, job_id=job_id, **kwargs
+        )
+        return {"paths": images.paths}
+
+    def _lora_spec(self, name: str) -> Dict:
+        lora = self.config.get("loras", {}).get(name)
+        if lora is None:
+            raise ValueError(f"LoRA '{name}' not found in config")
+        return {"name": name, "path": lora["path"], "weight": lora.get("weight", 1.0)}
+
+    def _load_video_generator(self, warmup: bool = False):
+        """
+        Create the video generator on first use.
+
+        Args:
+            warmup: In compiled mode, compile the model.warmup_frame_counts
+                shapes now (an empty list skips loading SVD at startup)
+        """
+        frame_counts = self.model_config.get("warmup_frame_counts", [25])
+        if warmup and not frame_counts:
+            return
+        if self.video_generator is None:
+            # Imported lazily so image-only servers never load SVD
+            from generate_video import VideoGenerator
+            self.video_generator = VideoGenerator(
+                model_id=self.video_model,
+                device=self.model_config.get("device", "cuda"),
+                dtype=self.model_config.get("dtype", "float16"),
+                output_dir=self.output_dir,
+                step_metrics=self.step_metrics,
+                compile_models=self.model_config.get("compile", False),
+                compile_cache_dir=self.model_config.get("compile_cache_dir") or DEFAULT_COMPILE_CACHE
+            )
+        if warmup:
+            self.video_generator.warmup(frame_counts)
+            print("✓ Video model ready")
+
+    def _run_video(self, request: Dict, job_id: str) -> Dict:
+        self._load_video_generator()
+
+        kwargs = {k: request[k] for k in VIDEO_FIELDS if request.get(k) is not None}
+        video_path = self.video_generator.generate_video(
+            image=request["image_path"], job_id=job_id, **kwargs
+        )
+        return {"paths": [video_path]}
+
+
+class GenerationRequestHandler(BaseHTTPRequestHandler):
+    """HTTP routes mirroring the /api/generate endpoints in PRODUCT_SPEC.md."""
+
+    server_version = "SDXLGenerationServer/1.0"
+
+    def do_POST(self):
+        routes = {"/api/generate/image": "image", "/api/generate/video": "video"}
+        kind = routes.get(self.path.rstrip("/"))
+        if kind is None:
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            payload = json.loads(self.rfile.read(length) or b"{}")
+            status = self.server.generation.submit(kind, payload)
+        except (ValueError, json.JSONDecodeError) as e:
+            self._send_json(400, {"error": str(e)})
+            return
+        self._send_json(202, status)
+
+    def do_GET(self):
+        prefix = "/api/generate/status/"
+        url = urlparse(self.path)
+        if url.path == "/api/health":
+            self._send_json(200, {"status": "ok", "image_model": self.server.generation.image_model_state})
+        elif url.path == "/api/metrics/steps":
+            query = parse_qs(url.query)
+            try:
+                limit = int(query.get("limit", ["100"])[0])
+            except ValueError:
+                self._send_json(400, {"error": "'limit' must be an integer"})
+                return
+            events = self.server.generation.recent_steps.recent(
+                limit=limit,
+                job_id=query.get("job", [None])[0]
+            )
+            self._send_json(200, {"events": events})
+        elif url.path.startswith(prefix):
+            status = self.server.generation.status(url.path[len(prefix):])
+            if status is None:
+                self._send_json(404, {"error": "Unknown job"})
+            else:
+                self._send_json(200, status)
+        else:
+            self._send_json(404, {"error": f"Unknown endpoint: {self.path}"})
+
+    def log_message(self, format, *args):
+        print(f"[server] {self.address_string()} {format % args}")
+
+    def _send_json(self, code: int, body: Dict):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a long-lived generation server that keeps models loaded"
+    )
+
+    parser.add_argument(
+        "--config",
+        type=str,
+        default="./configs/example_config.json",
+        help="Path to configuration file"
+    )
+    parser.add_argument(
+        "--host",
+        type=str,
+        default="127.0.0.1",
+        help="Address to listen on"
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=7860,
+        help="Port to listen on"
+    )
+    parser.add_argument(
+        "--video-model",
+        type=str,
+        default="stabilityai/stable-video-diffusion-img2vid-xt",
+        help="SVD model ID or path (loaded on the first video job)"
+    )
+    parser.add_argument(
+        "--output-dir",
+        type=str,
+        default="./outputs",
+        help="Directory to save generated images and videos"
+    )
+
+    args = parser.parse_args()
+
+    config = load_config(args.config)
+    generation = GenerationServer(config, output_dir=args.output_dir, video_model=args.video_model)
+
+    httpd = ThreadingHTTPServer((args.host, args.port), GenerationRequestHandler)
+    httpd.generation = generation
+    print(f"\n✓ Generation server listening on http://{args.host}:{args.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        print("\nShutting down server")
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+#!/usr/bin/env python3
+"""
+Step Callbacks
+callback_on_step_end helpers that change or end denoising partway through a call, chained with StepMetrics trackers
+"""
+
+import math
+from typing import Dict, List, Optional, Tuple
+
+
+def chain_callbacks(*callbacks) -> Tuple[Optional[object], List[str]]:
+    """
+    Combine step callbacks into one for callback_on_step_end.
+
+    Callbacks run in order; each sees the tensors returned by the ones
+    before it. A callback can list the pipeline tensors it needs in a
+    tensor_inputs attribute.
+
+    Args:
+        callbacks: Callbacks taking (pipe, step, timestep, callback_kwargs); None entries are skipped
+
+    Returns:
+        (callback or None, callback_on_step_end_tensor_inputs)
+    """
+    active = [callback for callback in callbacks if callback is not None]
+    tensor_inputs = ["latents"]
+    for callback in active:
+        for name in getattr(callback, "tensor_inputs", []):
+            if name not in tensor_inputs:
+                tensor_inputs.append(name)
+    if not active:
+        return None, tensor_inputs
+    if len(active) == 1:
+        return active[0], tensor_inputs
+
+    def chained(pipe, step: int, timestep, callback_kwargs: Dict) -> Dict:
+        outputs = {}
+        for callback in active:
+            result = callback(pipe, step, timestep, dict(callback_kwargs, **outputs)) or {}
+            outputs.update(result)
+        return outputs
+
+    return chained, tensor_inputs
+
+
+class GuidanceCutoff:
+    """
+    Stop classifier-free guidance partway through an SDXL call.
+
+    Late steps mostly refine detail that guidance no longer changes, so the
+    rest of the schedule runs the UNet on the conditional half of the batch
+    only, which halves its cost for those steps. Guidance stops after a
+    fixed fraction of the steps, once the guidance direction (conditional
+    minus unconditional noise prediction) stops changing between steps, or
+    at whichever comes first when both are set.
+    """
+
+    # Conditioning tensors the pipeline doubles for CFG
+    tensor_inputs = ["prompt_embeds", "add_text_embeds", "add_time_ids"]
+
+    def __init__(self, pipe, num_inference_steps: int, cutoff: Optional[float] = None, converge: Optional[float] = None):
+        """
+        Initialize the cutoff for one pipeline call.
+
+        Args:
+            pipe: SDXL pipeline about to run
+            num_inference_steps: Steps requested for the call
+            cutoff: Fraction of the steps that keep guidance (0-1], e.g. 0.6
+            converge: Stop once the guidance delta changes by less than this
+                fraction of its norm from one step to the next (e.g. 0.05)
+        """
+        if cutoff is not None and not 0 < cutoff <= 1:
+            raise ValueError(f"cfg_cutoff must be in (0, 1], got {cutoff}")
+        if converge is not None and converge <= 0:
+            raise ValueError(f"cfg_converge must be positive, got {converge}")
+        self.num_inference_steps = num_inference_steps
+        self.cutoff = cutoff
+        self.guided_steps = math.ceil(cutoff * num_inference_steps) if cutoff is not None else None
+        self.converge = converge
+        # Steps that ran with guidance; stays None while guidance is on
+        self.cfg_steps: Optional[int] = None
+        self.delta_change: Optional[float] = None
+        self._previous_delta = None
+        self._hook = None
+        if converge is not None:
+            self._hook = pipe.unet.register_forward_hook(self._observe)
+
+    def _observe(self, module, args, output):
+        noise_pred = output[0] if isinstance(output, tuple) else output.sample
+        if self.cfg_steps is not None or noise_pred.shape[0] % 2:
+            return
+        uncond, text = noise_pred.float().chunk(2)
+        delta = text - uncond
+        if self._previous_delta is not None:
+            # One device sync per step, only in converge mode
+            self.delta_change = ((delta - self._previous_delta).norm() / delta.norm().clamp_min(1e-8)).item()
+        self._previous_delta = delta
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: Dict) -> Dict:
+        if self.cfg_steps is not None or not pipe.do_classifier_free_guidance:
+            return {}
+        done = step + 1
+        if done >= self.num_inference_steps:
+            return {}
+        reached = self.guided_steps is not None and done >= self.guided_steps
+        converged = self.converge is not None and self.delta_change is not None and self.delta_change < self.converge
+        if not (reached or converged):
+            return {}
+
+        self.cfg_steps = done
+        self.finish()
+        # The pipeline checks guidance_scale > 1 before every step
+        pipe._guidance_scale = 1.0
+        # Batches are [unconditional, conditional]; keep the conditional half
+        return {name: callback_kwargs[name].chunk(2)[1] for name in self.tensor_inputs}
+
+    def finish(self):
+        """Remove the UNet hook (call after the pipeline returns)."""
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        self._previous_delta = None
+
+    def metadata(self) -> Dict[str, str]:
+        """Fields recorded with the images: the settings and how many steps used guidance."""
+        fields = {"cfg_steps": str(self.cfg_steps if self.cfg_steps is not None else self.num_inference_steps)}
+        if self.cutoff is not None:
+            fields["cfg_cutoff"] = str(self.cutoff)
+        if self.converge is not None:
+            fields["cfg_converge"] = str(self.converge)
+        return fields
+
+
+# Early exit never ends a call before this fraction of its steps
+EARLY_EXIT_MIN_FRACTION = 0.4
+
+
+class EarlyExitReached(Exception):
+    """Raised by EarlyExit in pipelines without an interrupt flag (SVD); carries the final latents."""
+
+    def __init__(self, latents, steps_used: int):
+        super().__init__(f"denoising converged after {steps_used} steps")
+        self.latents = latents
+        self.steps_used = steps_used
+
+
+class EarlyExit:
+    """
+    End denoising early once the predicted image stops changing.
+
+    After each step the scheduler's prediction of the clean latents (x0)
+    is compared with the previous step's. Once it changes by less than the
+    threshold (relative to its norm), the call ends with that prediction as
+    its latents, so the image is decoded without the remaining steps.
+    Schedulers that expose no x0 prediction fall back to the change of the
+    latents themselves. SDXL is stopped through its interrupt flag; for
+    pipelines without one, EarlyExitReached is raised for the caller to
+    decode.
+    """
+
+    def __init__(self, pipe, num_inference_steps: int, threshold: float):
+        """
+        Initialize early exit for one pipeline call.
+
+        Args:
+            pipe: Pipeline about to run (its current scheduler is observed)
+            num_inference_steps: Steps requested for the call
+            threshold: Relative step-to-step change below which denoising ends (e.g. 0.01)
+        """
+        if threshold <= 0:
+            raise ValueError(f"early_exit_threshold must be positive, got {threshold}")
+        self.num_inference_steps = num_inference_steps
+        self.threshold = threshold
+        self.min_steps = max(2, math.ceil(EARLY_EXIT_MIN_FRACTION * num_inference_steps))
+        # Steps that ran; stays None unless denoising ended early
+        self.steps_used: Optional[int] = None
+        self.change: Optional[float] = None
+        self._previous = None
+        self._predicted = None
+        self.scheduler = pipe.scheduler
+        self._step = self.scheduler.step
+        # Instance attribute, removed again in finish()
+        self.scheduler.step = self._observe_step
+
+    def _observe_step(self, *args, return_dict: bool = True, **kwargs):
+        output = self._step(*args, return_dict=True, **kwargs)
+        self._predicted = self._predicted_x0(output)
+        return output if return_dict else output.to_tuple()
+
+    def _predicted_x0(self, output):
+        # Euler-style schedulers return it, LCM calls it denoised
+        for name in ("pred_original_sample", "denoised"):
+            value = getattr(output, name, None)
+            if value is not None:
+                return value
+        # Multistep solvers in x0 mode (DPM++, UniPC) keep it as their latest model output
+        config = self.scheduler.config
+        if config.get("predict_x0", False) or config.get("algorithm_type") in ("dpmsolver++", "sde-dpmsolver++"):
+            return self.scheduler.model_outputs[-1]
+        return None
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: Dict) -> Dict:
+        if self.steps_used is not None:
+            return {}
+        current = self._predicted if self._predicted is not None else callback_kwargs["latents"]
+        if self._previous is not None:
+            # One device sync per step
+            self.change = ((current - self._previous).float().norm() / current.float().norm().clamp_min(1e-8)).item()
+        self._previous = current
+        done = step + 1
+        if done < self.min_steps or done >= self.num_inference_steps:
+            return {}
+        if self.change is None or self.change >= self.threshold:
+            return {}
+
+        self.steps_used = done
+        self.finish()
+        if not hasattr(pipe, "_interrupt"):
+            raise EarlyExitReached(current, done)
+        # The pipeline skips the remaining steps and decodes these latents
+        pipe._interrupt = True
+        return {"latents": current}
+
+    def finish(self):
+        """Restore the scheduler (call after the pipeline returns, also on errors)."""
+        if "step" in vars(self.scheduler):
+            del self.scheduler.step
+        self._previous = None
+        self._predicted = None
+
+    def metadata(self) -> Dict[str, str]:
+        """Fields recorded with the outputs: the threshold and how many steps ran."""
+        return {
+            "early_exit_threshold": str(self.threshold),
+            "steps_used": str(self.steps_used if self.steps_used is not None else self.num_inference_steps),
+        }
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+"""
+Step Metrics
+Per-denoising-step latency, throughput and memory, emitted through the pipelines' callback_on_step_end to pluggable sinks
+"""
+
+import json
+import os
+import threading
+import time
+from collections import deque
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from lazy_imports import lazy_import
+
+torch = lazy_import("torch")
+
+
+def device_memory_bytes(device: str) -> Optional[int]:
+    """Memory currently allocated on the device (None on cpu, where there is no cheap counter)."""
+    if device == "cuda" and torch.cuda.is_available():
+        return torch.cuda.memory_allocated()
+    if device == "mps" and torch.backends.mps.is_available():
+        return torch.mps.current_allocated_memory()
+    return None
+
+
+class JsonlSink:
+    """Append every event as one JSON line."""
+
+    def __init__(self, path: str):
+        """
+        Initialize the sink.
+
+        Args:
+            path: JSONL file to append to (created if missing)
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Line buffered: each event reaches the file without an fsync per step
+        self._file = open(self.path, "a", buffering=1)
+
+    def emit(self, event: Dict):
+        self._file.write(json.dumps(event) + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+class PrometheusSink:
+    """
+    Keep the latest values as gauges and counters and write them in the
+    Prometheus text format, for node_exporter's textfile collector.
+
+    The file is rewritten atomically at most once per min_interval seconds
+    while a run is in progress, and always when a run finishes.
+    """
+
+    def __init__(self, path: str, min_interval: float = 1.0):
+        """
+        Initialize the sink.
+
+        Args:
+            path: .prom file to write
+            min_interval: Minimum seconds between rewrites during a run
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.min_interval = min_interval
+        self._last_write = 0.0
+        self._gauges: Dict[tuple, float] = {}
+        self._counters: Dict[tuple, float] = {}
+
+    def emit(self, event: Dict):
+        stage = event["stage"]
+        if event["event"] == "step":
+            self._gauges[("diffusion_step_seconds", stage)] = event["step_seconds"]
+            self._gauges[("diffusion_iterations_per_second", stage)] = event["it_per_sec"]
+            if event["memory_mb"] is not None:
+                self._gauges[("diffusion_memory_allocated_bytes", stage)] = event["memory_mb"] * 1024 * 1024
+            self._gauges[("diffusion_step_progress_ratio", stage)] = (event["step"] + 1) / event["total_steps"]
+            self._counters[("diffusion_steps_total", stage)] = self._counters.get(("diffusion_steps_total", stage), 0) + 1
+            if time.monotonic() - self._last_write >= self.min_interval:
+                self.write()
+        else:
+            self._counters[("diffusion_runs_total", stage)] = self._counters.get(("diffusion_runs_total", stage), 0) + 1
+            self._counters[("diffusion_pipeline_seconds_total", stage)] = (
+                self._counters.get(("diffusion_pipeline_seconds_total", stage), 0.0) + event["seconds"]
+            )
+            self._counters[("diffusion_denoise_seconds_total", stage)] = (
+                self._counters.get(("diffusion_denoise_seconds_total", stage), 0.0) + event["denoise_seconds"]
+            )
+            self._counters[("diffusion_metrics_overhead_seconds_total", stage)] = (
+                self._counters.get(("diffusion_metrics_overhead_seconds_total", stage), 0.0) + event["overhead_seconds"]
+            )
+            self.write()
+
+    def write(self):
+        lines = []
+        for kind, values in (("gauge", self._gauges), ("counter", self._counters)):
+            for name in sorted({name for name, _ in values}):
+                lines.append(f"# TYPE {name} {kind}")
+                for (metric, stage), value in sorted(values.items()):
+                    if metric == name:
+                        lines.append(f'{name}{{stage="{stage}"}} {value:.6g}')
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(tmp_path, self.path)
+        self._last_write = time.monotonic()
+
+    def close(self):
+        if self._gauges or self._counters:
+            self.write()
+
+
+class RingBufferSink:
+    """Keep the most recent events in memory, e.g. for a status endpoint."""
+
+    def __init__(self, capacity: int = 1000):
+        """
+        Initialize the sink.
+
+        Args:
+            capacity: Number of events kept; older ones are dropped
+        """
+        self.events = deque(maxlen=capacity)
+
+    def emit(self, event: Dict):
+        self.events.append(event)
+
+    def recent(self, limit: Optional[int] = None, job_id: Optional[str] = None) -> List[Dict]:
+        """Most recent events, oldest first, optionally only for one job."""
+        events = [e for e in list(self.events) if job_id is None or e["job_id"] == job_id]
+        return events[-limit:] if limit else events
+
+    def close(self):
+        pass
+
+
+class StepMetrics:
+    """
+    Fan step events out to sinks.
+
+    A sink is any object with emit(event) and close(). Every denoising step
+    emits {"event": "step", "stage", "job_id", "step", "total_steps",
+    "step_seconds", "it_per_sec", "memory_mb", "time"}, and every pipeline
+    call ends with {"event": "run", ...} carrying its totals and the time
+    spent in the callback itself, so the overhead can be checked in production.
+    """
+
+    def __init__(self, sinks: Optional[List] = None, device: str = "cpu", synchronize: bool = False):
+        """
+        Initialize the metrics.
+
+        Args:
+            sinks: Sinks to emit to
+            device: Device the pipelines run on (for memory readings)
+            synchronize: Wait for the device at every step so step_seconds is
+                exact. Off by default: without it a step's time is when the CPU
+                finished queuing it, which matches device time once the kernel
+                queue is full, at no cost to throughput
+        """
+        self.sinks = list(sinks or [])
+        self.device = device
+        self.synchronize = synchronize and device == "cuda"
+        self._lock = threading.Lock()
+
+    def add_sink(self, sink):
+        with self._lock:
+            self.sinks.append(sink)
+
+    def track(self, stage: str, job_id: Optional[str], total_steps: int, pipe=None) -> "StepTracker":
+        """
+        Start tracking one pipeline call.
+
+        Args:
+            stage: Stage label, e.g. "image" or "video"
+            job_id: Job the call belongs to
+            total_steps: Number of denoising steps requested
+            pipe: Pipeline about to run; the first step is timed from its
+                first UNet call instead of from here, so prompt and image
+                encoding are not counted as step time
+
+        Returns:
+            Callback to pass as callback_on_step_end; call finish() after the pipeline returns
+        """
+        return StepTracker(self, stage, job_id, total_steps, pipe)
+
+    def emit(self, event: Dict):
+        with self._lock:
+            for sink in self.sinks:
+                try:
+                    sink.emit(event)
+                except Exception as e:
+                    print(f"Warning: metrics sink {type(sink).__name__} failed: {e}")
+
+    def close(self):
+        with self._lock:
+            for sink in self.sinks:
+                sink.close()
+            self.sinks = []
+
+
+def build_step_metrics(
+    device: str,
+    jsonl_path: Optional[str] = None,
+    prometheus_path: Optional[str] = None,
+    usage_log_path: Optional[str] = None
+) -> Optional[StepMetrics]:
+    """
+    StepMetrics with the sinks given on the command line, or None if there are none.
+
+    Args:
+        device: Device the pipelines run on
+        jsonl_path: Append step events to this JSONL file
+        prometheus_path: Keep this Prometheus textfile up to date
+        usage_log_path: Log each pipeline call's GPU time to this usage log
+            (read by runpod/cost_monitor.py)
+    """
+    sinks = []
+    if jsonl_path:
+        sinks.append(JsonlSink(jsonl_path))
+    if prometheus_path:
+        sinks.append(PrometheusSink(prometheus_path))
+    if usage_log_path:
+        # Imported here so metrics without a usage log need nothing else
+        from usage_log import UsageLog, UsageSink
+        sinks.append(UsageSink(UsageLog(usage_log_path)))
+    return StepMetrics(sinks, device=device) if sinks else None
+
+
+class StepTracker:
+    """Callback for one pipeline call; see StepMetrics.track()."""
+
+    def __init__(self, metrics: StepMetrics, stage: str, job_id: Optional[str], total_steps: int, pipe=None):
+        self.metrics = metrics
+        self.stage = stage
+        self.job_id = job_id
+        self.total_steps = total_steps
+        self.steps = 0
+        self.peak_memory = None
+        self.overhead = 0.0
+        self.start = time.perf_counter()
+        self._last = self.start
+        self._denoise_start = None
+        self._hook = None
+        denoiser = getattr(pipe, "unet", None) or getattr(pipe, "transformer", None)
+        if denoiser is not None:
+            self._hook = denoiser.register_forward_pre_hook(self._first_step_started)
+
+    def _first_step_started(self, module, args):
+        self._last = self._denoise_start = time.perf_counter()
+        self._hook.remove()
+        self._hook = None
+
+    def __call__(self, pipe, step: int, timestep, callback_kwargs: Dict) -> Dict:
+        now = time.perf_counter()
+        if self.metrics.synchronize:
+            torch.cuda.synchronize()
+            now = time.perf_counter()
+        step_seconds = now - self._last
+        memory = device_memory_bytes(self.metrics.device)
+        if memory is not None:
+            self.peak_memory = max(self.peak_memory or 0, memory)
+        self.steps += 1
+
+        self.metrics.emit({
+            "event": "step",
+            "stage": self.stage,
+            "job_id": self.job_id,
+            "step": step,
+            "total_steps": self.total_steps,
+            "step_seconds": round(step_seconds, 6),
+            "it_per_sec": round(1.0 / step_seconds, 3) if step_seconds > 0 else None,
+            "memory_mb": round(memory / (1024 * 1024), 1) if memory is not None else None,
+            "time": time.time(),
+        })
+        # The next step starts when this callback returns, so our own time is not charged to it
+        self._last = time.perf_counter()
+        self.overhead += self._last - now
+        return {}
+
+    def finish(self) -> Dict:
+        """
+        Emit the run summary (also after a failed call, with fewer steps than requested).
+
+        Returns:
+            The summary event
+        """
+        if self._hook is not None:
+            self._hook.remove()
+            self._hook = None
+        seconds = time.perf_counter() - self.start
+        # Denoising ends at the last step callback; the rest is decoding
+        denoise_seconds = self._last - (self._denoise_start or self.start) if self.steps else 0.0
+        summary = {
+            "event": "run",
+            "stage": self.stage,
+            "job_id": self.job_id,
+            "steps": self.steps,
+            "seconds": round(seconds, 4),
+            "denoise_seconds": round(denoise_seconds, 4),
+            "it_per_sec": round(self.steps / denoise_seconds, 3) if denoise_seconds > 0 else None,
+            "peak_memory_mb": round(self.peak_memory / (1024 * 1024), 1) if self.peak_memory is not None else None,
+            "overhead_seconds": round(self.overhead, 6),
+            "overhead_pct": round(100 * self.overhead / seconds, 4) if seconds > 0 else 0.0,
+            "time": time.time(),
+        }
+        self.metrics.emit(summary)
+        if summary["it_per_sec"] is not None:
+            print(f"Denoising: {self.steps} steps at {summary['it_per_sec']:.2f} it/s "
+                  f"(metrics overhead {summary['overhead_pct']:.3f}%)")
+        return summary
@@ -0,0 +1,49 @@
+import json
+
+import pytest
+from PIL import Image
+
+from manifest import OutputManifest, read_image_metadata
+from output_writer import FORMAT_EXTENSIONS, OutputWriter
+
+
+def _metadata(seed: int) -> dict:
+    return {
+        "prompt": f"a red fox {seed}",
+        "seed": str(seed),
+        "model": "test-model",
+        "width": "64",
+        "height": "64",
+        "steps": "4",
+        "job_id": f"job-{seed}",
+    }
+
+
+@pytest.mark.parametrize("output_format", sorted(FORMAT_EXTENSIONS))
+def test_read_image_metadata_round_trips(tmp_path, output_format):
+    writer = OutputWriter(output_format=output_format, num_workers=0)
+    path = writer.submit(Image.new("RGB", (64, 64), "red"), tmp_path / "image", _metadata(1)).result()
+
+    assert read_image_metadata(path) == _metadata(1)
+
+
+def test_rebuild_indexes_every_output_format(tmp_path):
+    for seed, output_format in enumerate(sorted(FORMAT_EXTENSIONS)):
+        writer = OutputWriter(output_format=output_format, num_workers=0)
+        writer.submit(Image.new("RGB", (64, 64), "red"), tmp_path / f"image_{seed}", _metadata(seed))
+    # Images without generation metadata are skipped
+    Image.new("RGB", (8, 8)).save(tmp_path / "other.jpg")
+    with open(tmp_path / "video_1_metadata.json", "w") as f:
+        json.dump({"job_id": "job-video", "seed": 7, "num_frames": 25}, f)
+
+    manifest = OutputManifest(tmp_path / "manifest.jsonl")
+    assert manifest.rebuild(str(tmp_path)) == len(FORMAT_EXTENSIONS) + 1
+
+    for seed, output_format in enumerate(sorted(FORMAT_EXTENSIONS)):
+        [record] = manifest.find(job_id=f"job-{seed}")
+        assert record["path"].endswith(FORMAT_EXTENSIONS[output_format])
+        assert record["seed"] == seed
+        assert record["width"] == 64
+    [video] = manifest.find(job_id="job-video")
+    assert video["type"] == "video"
+    assert video["path"].endswith("video_1.mp4")
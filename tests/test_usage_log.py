@@ -0,0 +1,51 @@
+import os
+
+import pytest
+
+import usage_log
+from usage_log import UsageLog
+
+
+def test_rollup_folds_incrementally(tmp_path):
+    log = UsageLog(str(tmp_path / "usage.jsonl"))
+    log.log_job("image", 1.5, gpu_type="A100")
+    assert log.rollup()["totals"]["jobs"] == 1
+    log.log_job("image", 2.5, gpu_type="A100")
+    rollup = log.rollup(compact=True)
+    log.log_job("video", 1.0, gpu_type="A100")
+
+    rollup = log.rollup()
+    assert rollup["totals"]["jobs"] == 3
+    assert rollup["totals"]["gpu_seconds"] == pytest.approx(5.0)
+
+
+def test_rollup_finishes_crashed_compaction(tmp_path, monkeypatch):
+    log = UsageLog(str(tmp_path / "usage.jsonl"))
+    log.log_job("image", 1.0, gpu_type="A100")
+    log.rollup()
+    log.log_job("image", 2.0, gpu_type="A100")
+
+    # Crash after the rollup naming the new log is saved, before the log is replaced
+    replace = os.replace
+
+    def crash_on_log_replace(src, dst):
+        if str(dst) == str(log.path):
+            raise KeyboardInterrupt
+        replace(src, dst)
+
+    monkeypatch.setattr(usage_log.os, "replace", crash_on_log_replace)
+    with pytest.raises(KeyboardInterrupt):
+        log.rollup(compact=True)
+    monkeypatch.setattr(usage_log.os, "replace", replace)
+
+    # Appenders keep writing to the old log in the meantime
+    log.log_job("video", 4.0, gpu_type="A100")
+
+    rollup = log.rollup()
+    assert rollup["totals"]["jobs"] == 3
+    assert rollup["totals"]["gpu_seconds"] == pytest.approx(7.0)
+    assert rollup["log_id"] == log._log_id(os.open(log.path, os.O_RDONLY))
+
+    # Nothing is folded twice afterwards
+    log.log_job("image", 1.0, gpu_type="A100")
+    assert log.rollup()["totals"]["jobs"] == 4
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Token Merging
+Merges similar spatial tokens before UNet self-attention and unmerges them after, for high-resolution SDXL and SVD
+"""
+
+import math
+from typing import Dict, Optional, Union
+
+from lazy_imports import lazy_import
+
+torch = lazy_import("torch")
+
+
+# Minimum output pixels -> merge ratio used for "auto"; below the smallest, merging costs more than it saves
+TOKEN_MERGE_RATIOS = [
+    (2048 * 2048, 0.6),
+    (1536 * 1536, 0.5),
+    (1024 * 1024, 0.4),
+    # SVD's 1024x576 frames
+    (1024 * 576, 0.3),
+]
+
+# One destination token per 2x2 cell, so at most 3/4 of the tokens can merge
+MAX_TOKEN_MERGE_RATIO = 0.75
+
+# Batch entries scored together (bounds the similarity matrix for 25-frame SVD batches)
+SCORE_CHUNK = 8
+
+
+def default_token_merge_ratio(width: int, height: int) -> float:
+    """Merge ratio for "auto" at an output size (0.0 below 1024x576)."""
+    for pixels, ratio in TOKEN_MERGE_RATIOS:
+        if width * height >= pixels:
+            return ratio
+    return 0.0
+
+
+def resolve_token_merge_ratio(ratio: Union[float, str, None], width: int, height: int) -> Optional[float]:
+    """
+    Merge ratio for one call: a number as given, "auto" by output size, None or 0 for no merging.
+
+    Raises:
+        ValueError: for an unknown string or a ratio outside [0, MAX_TOKEN_MERGE_RATIO)
+    """
+    if isinstance(ratio, str):
+        if ratio != "auto":
+            raise ValueError(f"token_merge_ratio must be a number or 'auto', got '{ratio}'")
+        ratio = default_token_merge_ratio(width, height)
+    if ratio is None or ratio == 0:
+        return None
+    if not 0 < ratio < MAX_TOKEN_MERGE_RATIO:
+        raise ValueError(f"token_merge_ratio must be in [0, {MAX_TOKEN_MERGE_RATIO}), got {ratio}")
+    return ratio
+
+
+def parse_token_merge_ratio(value: str) -> Union[float, str]:
+    """argparse type for --token-merge-ratio: a number or "auto"."""
+    return value if value == "auto" else float(value)
+
+
+def _bipartite_merge(x, height: int, width: int, r: int):
+    """
+    ToMe-style bipartite soft matching on one layer's tokens.
+
+    The top-left token of every 2x2 cell is a destination and the rest are
+    sources. The r sources most similar (cosine) to some destination are
+    averaged into it.
+
+    Returns:
+        (merge, unmerge) functions for tensors shaped like x
+    """
+    batch, tokens, _ = x.shape
+    positions = torch.arange(tokens, device=x.device).view(height, width)
+    is_dst = torch.zeros(height, width, dtype=torch.bool, device=x.device)
+    is_dst[0::2, 0::2] = True
+    dst_idx = positions[is_dst]
+    src_idx = positions[~is_dst]
+
+    with torch.no_grad():
+        metric = x / x.norm(dim=-1, keepdim=True).clamp_min(1e-6)
+        node_max, node_idx = [], []
+        for start in range(0, batch, SCORE_CHUNK):
+            chunk = metric[start:start + SCORE_CHUNK]
+            scores = chunk[:, src_idx] @ chunk[:, dst_idx].transpose(-1, -2)
+            best, index = scores.max(dim=-1)
+            node_max.append(best)
+            node_idx.append(index)
+        node_max = torch.cat(node_max)
+        node_idx = torch.cat(node_idx)
+        edge_idx = node_max.argsort(dim=-1, descending=True)
+        unm_idx = edge_idx[:, r:]
+        merged_idx = edge_idx[:, :r]
+        target_idx = node_idx.gather(-1, merged_idx)
+
+    def expand(index, channels: int):
+        return index[..., None].expand(-1, -1, channels)
+
+    def merge(tensor):
+        channels = tensor.shape[-1]
+        src, dst = tensor[:, src_idx], tensor[:, dst_idx]
+        unm = src.gather(1, expand(unm_idx, channels))
+        merged = src.gather(1, expand(merged_idx, channels))
+        dst = dst.scatter_reduce(1, expand(target_idx, channels), merged, reduce="mean")
+        return torch.cat([unm, dst], dim=1)
+
+    def unmerge(tensor):
+        # Attention output may have a different width than its input
+        channels = tensor.shape[-1]
+        unm, dst = tensor[:, :unm_idx.shape[1]], tensor[:, unm_idx.shape[1]:]
+        out = tensor.new_empty(batch, tokens, channels)
+        out[:, dst_idx] = dst
+        out.scatter_(1, expand(src_idx[unm_idx], channels), unm)
+        out.scatter_(1, expand(src_idx[merged_idx], channels), dst.gather(1, expand(target_idx, channels)))
+        return out
+
+    return merge, unmerge
+
+
+class TokenMergeProcessor:
+    """Attention processor that runs another one on merged tokens while merging is on."""
+
+    def __init__(self, token_merging: "TokenMerging", processor):
+        self.token_merging = token_merging
+        self.processor = processor
+
+    def __call__(self, attn, hidden_states, encoder_hidden_states=None, attention_mask=None, temb=None, *args, **kwargs):
+        layer = None
+        if encoder_hidden_states is None and hidden_states.ndim == 3:
+            layer = self.token_merging._layer(hidden_states)
+        if layer is None:
+            return self.processor(attn, hidden_states, encoder_hidden_states, attention_mask, temb, *args, **kwargs)
+        merge, unmerge = _bipartite_merge(hidden_states, *layer)
+        output = self.processor(attn, merge(hidden_states), None, attention_mask, temb, *args, **kwargs)
+        return unmerge(output)
+
+
+class TokenMerging:
+    """
+    Token merging (ToMe for Stable Diffusion) for a UNet's spatial self-attention.
+
+    Self-attention cost grows with the square of the token count, which is
+    what dominates high-resolution steps. While merging is on, every spatial
+    self-attention layer at most max_downsample below the latent resolution
+    merges the given fraction of its most redundant tokens, attends over
+    the rest, and copies each merged token's output back to it. Temporal
+    (frame) attention and cross-attention are left alone. For SDXL that is
+    the 2x-downsampled level, the highest one with attention; SVD also
+    merges at full latent resolution.
+
+    Processors are wrapped once per UNet (see attach()) and pass straight
+    through while merging is off. Anything that replaces them, such as
+    attention slicing, is wrapped again on the next start().
+    """
+
+    def __init__(self, unet, max_downsample: int = 2):
+        self.unet = unet
+        self.max_downsample = max_downsample
+        self.ratio: Optional[float] = None
+        self.merged_calls = 0
+        self._latent_size = None
+        unet.register_forward_pre_hook(self._before_call, with_kwargs=True)
+
+    @classmethod
+    def attach(cls, unet) -> "TokenMerging":
+        """The UNet's TokenMerging, installed on first use (generators sharing a UNet share it)."""
+        token_merging = getattr(unet, "_token_merging", None)
+        if token_merging is None:
+            token_merging = cls(unet)
+            unet._token_merging = token_merging
+        return token_merging
+
+    def _before_call(self, module, args, kwargs):
+        sample = args[0] if args else kwargs["sample"]
+        self._latent_size = tuple(sample.shape[-2:])
+
+    def _layer(self, hidden_states):
+        """(height, width, tokens to merge) for a self-attention input, or None to run it unmerged."""
+        if self.ratio is None or self._latent_size is None:
+            return None
+        latent_height, latent_width = self._latent_size
+        tokens = hidden_states.shape[1]
+        downsample = round(math.sqrt(latent_height * latent_width / tokens))
+        if downsample < 1 or downsample > self.max_downsample:
+            return None
+        height, width = math.ceil(latent_height / downsample), math.ceil(latent_width / downsample)
+        if height * width != tokens:
+            return None
+        destinations = math.ceil(height / 2) * math.ceil(width / 2)
+        r = min(int(tokens * self.ratio), tokens - destinations)
+        if r <= 0:
+            return None
+        self.merged_calls += 1
+        return height, width, r
+
+    def _wrap_processors(self):
+        for name, module in self.unet.named_modules():
+            # Spatial self-attention only: not cross-attention (attn2) or SVD's temporal blocks
+            if not name.endswith("attn1") or "temporal" in name or not hasattr(module, "set_processor"):
+                continue
+            if not isinstance(module.processor, TokenMergeProcessor):
+                module.set_processor(TokenMergeProcessor(self, module.processor))
+
+    def start(self, ratio: float):
+        """
+        Merge tokens in the next pipeline call.
+
+        Args:
+            ratio: Fraction of each layer's tokens to merge, in (0, 0.75)
+        """
+        if not 0 < ratio < MAX_TOKEN_MERGE_RATIO:
+            raise ValueError(f"token_merge_ratio must be in (0, {MAX_TOKEN_MERGE_RATIO}), got {ratio}")
+        self._wrap_processors()
+        self.ratio = ratio
+        self.merged_calls = 0
+
+    def stop(self) -> Dict:
+        """
+        End merging (call after the pipeline returns, also on errors).
+
+        Returns:
+            {"merged_calls"}: attention calls that ran on merged tokens
+        """
+        stats = {"merged_calls": self.merged_calls}
+        self.ratio = None
+        return stats
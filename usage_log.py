@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+Usage Log
+Append-only log of GPU sessions and per-job GPU time, with incremental per-day and per-GPU rollups
+"""
+
+import fcntl
+import json
+import os
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+DEFAULT_USAGE_LOG = "./runpod/usage_events.jsonl"
+
+# Fold the log into the rollup and truncate it once it is this large
+COMPACT_BYTES = 1024 * 1024
+
+# Ended sessions kept in the rollup for the summary's "recent sessions"
+RECENT_SESSIONS = 10
+
+
+def _empty_bucket() -> Dict:
+    return {"sessions": 0, "hours": 0.0, "cost": 0.0, "jobs": 0, "gpu_seconds": 0.0}
+
+
+class UsageLog:
+    """
+    Append-only JSONL event log plus a rollup snapshot next to it.
+
+    Writers only ever append one line (under an flock, so several processes
+    can log at once). Readers fold the events written since the last
+    snapshot into the rollup, so a summary costs the same no matter how long
+    the log has been running. Once the unfolded part of the log exceeds
+    COMPACT_BYTES it is folded and the log starts over.
+
+    Events:
+        {"event": "session_start", "session", "gpu_type", "pod_id", "rate", "time"}
+        {"event": "session_end", "session", "time"}
+        {"event": "job", "kind", "job_id", "gpu_type", "gpu_seconds", "time"}
+    """
+
+    def __init__(self, path: str = DEFAULT_USAGE_LOG):
+        """
+        Initialize the log.
+
+        Args:
+            path: Event log file; the rollup is kept beside it as <name>.rollup.json
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.rollup_path = self.path.with_name(self.path.stem + ".rollup.json")
+        self._lock = threading.Lock()
+
+    def append(self, event: Dict):
+        """Append one event with a single write (cheap enough to call per job)."""
+        event.setdefault("time", time.time())
+        line = (json.dumps(event) + "\n").encode("utf-8")
+        with self._lock:
+            while True:
+                fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX)
+                    # Compaction may have replaced the file while we waited for the lock
+                    if self._same_file(fd):
+                        os.write(fd, line)
+                        return
+                finally:
+                    os.close(fd)
+
+    def log_job(self, kind: str, gpu_seconds: float, job_id: Optional[str] = None, gpu_type: Optional[str] = None):
+        """
+        Record GPU time spent on one generation job.
+
+        Args:
+            kind: "image" or "video"
+            gpu_seconds: Wall time the job held the GPU
+            job_id: Job the time belongs to
+            gpu_type: GPU it ran on (defaults to the open session's GPU when folded)
+        """
+        self.append({
+            "event": "job",
+            "kind": kind,
+            "job_id": job_id,
+            "gpu_type": gpu_type,
+            "gpu_seconds": round(gpu_seconds, 4),
+        })
+
+    def start_session(self, gpu_type: str, pod_id: Optional[str], rate: float) -> str:
+        """Record a session start; returns the new session ID."""
+        session_id = uuid.uuid4().hex[:8]
+        self.append({
+            "event": "session_start",
+            "session": session_id,
+            "gpu_type": gpu_type,
+            "pod_id": pod_id,
+            "rate": rate,
+        })
+        return session_id
+
+    def end_session(self, session_id: str):
+        self.append({"event": "session_end", "session": session_id})
+
+    def rollup(self, compact: bool = False) -> Dict:
+        """
+        Current totals, folding in any events appended since the last call.
+
+        Args:
+            compact: Start a new log even if the current one is below COMPACT_BYTES
+
+        Returns:
+            {"totals", "days", "gpus", "open_sessions", "recent_sessions", ...}
+            where totals, days[YYYY-MM-DD] and gpus[type] each hold sessions,
+            hours, cost, jobs and gpu_seconds
+        """
+        with self._lock:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                rollup = self._load_rollup()
+                log_id = self._log_id(fd)
+                if rollup["log_id"] is None:
+                    rollup["log_id"] = log_id
+                if rollup["log_id"] != log_id:
+                    # A compaction wrote the rollup but did not get to replace the
+                    # log; fold what was appended to the old log since, then replace it
+                    folded = 0
+                    if log_id == rollup.get("pending_log_id"):
+                        folded = rollup["pending_offset"] + self._fold_tail(fd, rollup, rollup["pending_offset"])
+                    self._start_new_log(rollup, log_id, folded)
+                else:
+                    folded = self._fold_tail(fd, rollup, rollup["offset"])
+                    rollup["offset"] += folded
+                    if compact or rollup["offset"] > COMPACT_BYTES:
+                        self._start_new_log(rollup, log_id, rollup["offset"])
+                    elif folded:
+                        self._save_rollup(rollup)
+            finally:
+                os.close(fd)
+        return rollup
+
+    def _fold_tail(self, fd: int, rollup: Dict, offset: int) -> int:
+        """Fold the complete lines after offset into the rollup; returns the bytes folded."""
+        os.lseek(fd, offset, os.SEEK_SET)
+        tail = b""
+        while True:
+            chunk = os.read(fd, 1 << 20)
+            if not chunk:
+                break
+            tail += chunk
+        # Only complete lines; a partial last line is folded next time
+        complete = tail[:tail.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            if line.strip():
+                self._fold(rollup, json.loads(line))
+        return len(complete)
+
+    def _fold(self, rollup: Dict, event: Dict):
+        kind = event["event"]
+        if kind == "session_start":
+            rollup["open_sessions"][event["session"]] = {
+                "session": event["session"],
+                "gpu_type": event["gpu_type"],
+                "pod_id": event.get("pod_id"),
+                "rate": event.get("rate", 0.0),
+                "start_time": event["time"],
+            }
+        elif kind == "session_end":
+            session = rollup["open_sessions"].pop(event["session"], None)
+            if session is None:
+                return
+            hours = max(0.0, event["time"] - session["start_time"]) / 3600
+            session.update(
+                end_time=event["time"],
+                duration_hours=round(hours, 3),
+                estimated_cost=round(hours * session["rate"], 4),
+            )
+            end_day = datetime.fromtimestamp(event["time"]).strftime("%Y-%m-%d")
+            for bucket in self._buckets(rollup, session["gpu_type"], end_day):
+                bucket["sessions"] += 1
+            # Hours and cost count toward the day they were spent on
+            for day, day_hours in _split_by_day(session["start_time"], event["time"]):
+                for bucket in self._buckets(rollup, session["gpu_type"], day):
+                    bucket["hours"] += day_hours
+                    bucket["cost"] += day_hours * session["rate"]
+            rollup["recent_sessions"] = (rollup["recent_sessions"] + [session])[-RECENT_SESSIONS:]
+        elif kind == "job":
+            gpu_type = event.get("gpu_type")
+            if gpu_type is None:
+                open_gpus = {s["gpu_type"] for s in rollup["open_sessions"].values()}
+                gpu_type = open_gpus.pop() if len(open_gpus) == 1 else "unknown"
+            day = datetime.fromtimestamp(event["time"]).strftime("%Y-%m-%d")
+            for bucket in self._buckets(rollup, gpu_type, day):
+                bucket["jobs"] += 1
+                bucket["gpu_seconds"] += event["gpu_seconds"]
+
+    def _buckets(self, rollup: Dict, gpu_type: str, day: Optional[str]) -> List[Dict]:
+        """Rollup buckets an amount is added to: totals, the GPU, and the day (if given)."""
+        buckets = [rollup["totals"], rollup["gpus"].setdefault(gpu_type, _empty_bucket())]
+        if day is not None:
+            buckets.append(rollup["days"].setdefault(day, _empty_bucket()))
+        return buckets
+
+    def _load_rollup(self) -> Dict:
+        if self.rollup_path.exists():
+            with open(self.rollup_path, "r") as f:
+                return json.load(f)
+        return {
+            "log_id": None,
+            "offset": 0,
+            "totals": _empty_bucket(),
+            "days": {},
+            "gpus": {},
+            "open_sessions": {},
+            "recent_sessions": [],
+        }
+
+    def _save_rollup(self, rollup: Dict):
+        tmp_path = self.rollup_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(rollup, f, indent=2)
+        os.replace(tmp_path, self.rollup_path)
+
+    def _start_new_log(self, rollup: Dict, old_log_id: Optional[str], folded_offset: int):
+        """
+        Replace the (fully folded) log with an empty one; caller holds the flock.
+
+        The rollup naming the new log is written first, so a crash in between
+        is detected by the ID mismatch and finished on the next rollup(). It
+        also records the old log and how far it was folded, because appenders
+        keep writing to the old log until it is replaced.
+        """
+        log_id = uuid.uuid4().hex
+        header = (json.dumps({"event": "log", "log_id": log_id}) + "\n").encode("utf-8")
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            f.write(header)
+        rollup["log_id"] = log_id
+        rollup["offset"] = len(header)
+        rollup["pending_log_id"] = old_log_id
+        rollup["pending_offset"] = folded_offset
+        self._save_rollup(rollup)
+        os.replace(tmp_path, self.path)
+
+    def _log_id(self, fd: int) -> Optional[str]:
+        os.lseek(fd, 0, os.SEEK_SET)
+        first = os.read(fd, 256).split(b"\n", 1)[0]
+        try:
+            header = json.loads(first)
+        except ValueError:
+            return None
+        return header.get("log_id") if header.get("event") == "log" else None
+
+    def _same_file(self, fd: int) -> bool:
+        try:
+            return os.fstat(fd).st_ino == os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return False
+
+
+def _split_by_day(start: float, end: float) -> List[tuple]:
+    """Split [start, end] (epoch seconds) into (YYYY-MM-DD, hours) pieces at local midnight."""
+    pieces = []
+    current = datetime.fromtimestamp(start)
+    stop = datetime.fromtimestamp(max(start, end))
+    while True:
+        midnight = datetime(current.year, current.month, current.day) + timedelta(days=1)
+        piece_end = min(midnight, stop)
+        pieces.append((current.strftime("%Y-%m-%d"), (piece_end - current).total_seconds() / 3600))
+        if piece_end >= stop:
+            return pieces
+        current = piece_end
+
+
+class UsageSink:
+    """StepMetrics sink that logs each pipeline call's GPU time as a job."""
+
+    def __init__(self, usage_log: UsageLog, gpu_type: Optional[str] = None):
+        self.usage_log = usage_log
+        self.gpu_type = gpu_type
+
+    def emit(self, event: Dict):
+        if event["event"] == "run":
+            self.usage_log.log_job(event["stage"], event["seconds"], event["job_id"], self.gpu_type)
+
+    def close(self):
+        pass
@@ -6,12 +6,212 @@ Generates an image using SDXL + LoRA, then creates a video from it using SVD
 
 import argparse
 import os
+import queue
 import sys
+import threading
+import time
+import uuid
 from pathlib import Path
+from typing import Dict, List
 
 # Import our generators
 from generate import SDXLGenerator
-from generate_video import VideoGenerator
+from generate_with_config import load_jobs
+from memory_scheduler import StageMemoryScheduler
+from step_metrics import build_step_metrics
+
+
+def run_on_server(args):
+    """Run the workflow as two jobs on a generation server."""
+    from client import submit_job
+
+    if args.lora:
+        print("Warning: --lora is ignored in server mode; the server uses its configured LoRAs")
+
+    if args.skip_image:
+        image_path = os.path.abspath(args.skip_image)
+    else:
+        print("Step 1: Generating image on server")
+        status = submit_job(args.server, "image", {
+            "prompt": args.prompt,
+            "negative_prompt": args.negative_prompt,
+            "width": 1024,
+            "height": 576,
+            "num_inference_steps": args.image_steps,
+            "guidance_scale": 7.5,
+            "num_images": 1,
+            "seed": args.seed,
+            "lora_scale": args.lora_scale,
+        })
+        image_path = status["result"]["paths"][0]
+        print(f"✓ Image generated: {image_path}")
+
+    print("Step 2: Generating video on server")
+    status = submit_job(args.server, "video", {
+        "image_path": image_path,
+        "num_frames": args.num_frames,
+        "fps": args.fps,
+        "motion_bucket_id": args.motion,
+        "noise_aug_strength": 0.02,
+        "decode_chunk_size": 8,
+        "seed": args.seed,
+    })
+    print(f"\n✓ Workflow Complete!")
+    print(f"Input image: {image_path}")
+    print(f"Output video: {status['result']['paths'][0]}")
+
+
+def run_batch(args):
+    """
+    Produce an image and a video for every line of a JSONL prompt file.
+
+    The stages form a pipeline: SDXL puts images on a bounded queue, SVD
+    takes them off, and MP4 encoding runs on VideoGenerator's encoder
+    thread. When both models fit on the GPU at once, the two stages run
+    concurrently on separate threads. Otherwise the device alternates: it
+    fills the queue with images and then drains it, so the models swap once
+    per --queue-depth items instead of once per item.
+
+    Each line may set prompt (required), negative_prompt, seed, num_frames,
+    fps and motion; the command line provides the defaults.
+    """
+    jobs = load_jobs(args.batch)
+    print(f"Batch: {len(jobs)} prompt(s), queue depth {args.queue_depth}")
+
+    scheduler = StageMemoryScheduler(device=args.device, budget_gb=args.vram_budget_gb)
+    step_metrics = build_step_metrics(args.device, args.metrics_jsonl, args.metrics_prom, args.usage_log)
+    img_generator = SDXLGenerator(
+        model_id="stabilityai/stable-diffusion-xl-base-1.0",
+        device=args.device,
+        dtype="float16",
+        output_dir=args.output_dir,
+        step_metrics=step_metrics,
+        memory_scheduler=scheduler,
+        compile_models=args.compile
+    )
+    for lora_path in args.lora:
+        if os.path.exists(lora_path):
+            img_generator.load_lora(lora_path)
+        else:
+            print(f"Warning: LoRA not found: {lora_path}")
+    from generate_video import VideoGenerator
+    vid_generator = VideoGenerator(
+        model_id="stabilityai/stable-video-diffusion-img2vid-xt",
+        device=args.device,
+        dtype="float16",
+        output_dir=args.output_dir,
+        memory_scheduler=scheduler,
+        step_metrics=step_metrics,
+        compile_models=args.compile
+    )
+    if args.compile:
+        # Compile both stages' shapes up front so the pipeline's timings are steady
+        img_generator.warmup([{"width": 1024, "height": 576, "guidance_scale": 7.5}])
+        vid_generator.warmup(sorted({job.get("num_frames", args.num_frames) for job in jobs}))
+
+    stats = {"image": [], "video": [], "encode": [], "queue_depth": []}
+    results: List[Dict] = []
+
+    def make_image(index: int, job: Dict) -> Dict:
+        start = time.time()
+        job_id = uuid.uuid4().hex
+        images = img_generator.generate(
+            prompt=job["prompt"],
+            negative_prompt=job.get("negative_prompt", args.negative_prompt),
+            width=1024,
+            height=576,
+            num_inference_steps=args.image_steps,
+            guidance_scale=7.5,
+            num_images=1,
+            seed=job.get("seed", args.seed + index if args.seed is not None else None),
+            lora_scale=args.lora_scale,
+            save_metadata=True,
+            job_id=job_id
+        )
+        stats["image"].append(time.time() - start)
+        return {"job": job, "job_id": job_id, "images": images}
+
+    def make_video(item: Dict):
+        job = item["job"]
+        start = time.time()
+        future = vid_generator.generate_video_async(
+            image=item["images"][0],
+            input_image_path=item["images"].futures[0],
+            num_frames=job.get("num_frames", args.num_frames),
+            fps=job.get("fps", args.fps),
+            motion_bucket_id=job.get("motion", args.motion),
+            seed=item["images"].seeds[0],
+            job_id=item["job_id"]
+        )
+        frames_done = time.time()
+        stats["video"].append(frames_done - start)
+        future.add_done_callback(lambda _: stats["encode"].append(time.time() - frames_done))
+        results.append({"prompt": job["prompt"], "image": item["images"].futures[0], "video": future})
+
+    batch_start = time.time()
+    if scheduler.fits_together(["image", "video"]):
+        print("Both models fit on the GPU: running image and video stages concurrently")
+        scheduler.enter_together(["image", "video"])
+        work: "queue.Queue" = queue.Queue(maxsize=args.queue_depth)
+        failure = []
+
+        def produce():
+            try:
+                for index, job in enumerate(jobs):
+                    work.put(make_image(index, job))
+                    stats["queue_depth"].append(work.qsize())
+            except Exception as e:
+                failure.append(e)
+            finally:
+                work.put(None)
+
+        producer = threading.Thread(target=produce, name="image-stage", daemon=True)
+        producer.start()
+        while True:
+            item = work.get()
+            if item is None:
+                break
+            stats["queue_depth"].append(work.qsize())
+            make_video(item)
+        producer.join()
+        if failure:
+            raise failure[0]
+    else:
+        print("Models do not fit together: alternating stages per queue")
+        pending = list(enumerate(jobs))
+        while pending:
+            buffer = []
+            while pending and len(buffer) < args.queue_depth:
+                buffer.append(make_image(*pending.pop(0)))
+                stats["queue_depth"].append(len(buffer))
+            while buffer:
+                make_video(buffer.pop(0))
+                stats["queue_depth"].append(len(buffer))
+
+    for result in results:
+        result["video"] = result["video"].result()
+        result["image"] = result["image"].result()
+    elapsed = time.time() - batch_start
+    img_generator.close()
+    if step_metrics is not None:
+        step_metrics.close()
+
+    print()
+    print("=" * 60)
+    print(f"✓ Batch complete: {len(results)} image+video pair(s) in {elapsed:.1f}s")
+    print("=" * 60)
+    for stage in ("image", "video", "encode"):
+        times = stats[stage]
+        if times:
+            print(f"{stage:>7}: {len(times)} item(s), {sum(times) / len(times):.1f}s avg, "
+                  f"{len(times) / sum(times) * 60:.1f} item(s)/min while busy")
+    depths = stats["queue_depth"]
+    if depths:
+        print(f"  queue: max depth {max(depths)}, mean {sum(depths) / len(depths):.1f} of {args.queue_depth}")
+    print(f"Overall: {len(results) / elapsed * 60:.1f} pair(s)/min")
+    scheduler.print_report()
+    for result in results:
+        print(f"  {result['video']}  <-  {result['image']}")
 
 
 def main():
@@ -24,7 +224,7 @@ def main():
     img_group.add_argument(
         "--prompt",
         type=str,
-        required=True,
+        default=None,
         help="Text prompt for image generation"
     )
     img_group.add_argument(
@@ -94,15 +294,76 @@ def main():
         default="./outputs",
         help="Output directory"
     )
+    parser.add_argument(
+        "--vram-budget-gb",
+        type=float,
+        default=None,
+        help="GPU memory to plan both stages for (default: 95%% of the card)"
+    )
+    parser.add_argument(
+        "--compile",
+        action="store_true",
+        help="torch.compile the SDXL and SVD UNets and VAE decoders (compiled kernels are cached on disk)"
+    )
+    parser.add_argument(
+        "--batch",
+        type=str,
+        default=None,
+        help="JSONL file of prompts; runs the image and video stages as a pipeline"
+    )
+    parser.add_argument(
+        "--queue-depth",
+        type=int,
+        default=2,
+        help="Images waiting for the video stage in --batch mode"
+    )
+    parser.add_argument(
+        "--metrics-jsonl",
+        type=str,
+        default=None,
+        help="Append per-step metrics of both stages to this JSONL file"
+    )
+    parser.add_argument(
+        "--metrics-prom",
+        type=str,
+        default=None,
+        help="Write per-step metrics of both stages to this Prometheus textfile (.prom)"
+    )
+    parser.add_argument(
+        "--usage-log",
+        type=str,
+        default=None,
+        help="Log GPU time per job to this usage log (see runpod/cost_monitor.py summary)"
+    )
     parser.add_argument(
         "--skip-image",
         type=str,
         default=None,
         help="Skip image generation and use existing image (path)"
     )
+    parser.add_argument(
+        "--server",
+        type=str,
+        default=None,
+        help="Submit both stages to a running generation server instead of loading models"
+    )
 
     args = parser.parse_args()
 
+    if not args.prompt and not args.batch and not args.skip_image:
+        parser.error("one of --prompt, --batch or --skip-image is required")
+
+    if args.batch:
+        if args.server:
+            parser.error("--batch cannot be combined with --server")
+        Path(args.output_dir).mkdir(parents=True, exist_ok=True)
+        run_batch(args)
+        return
+
+    if args.server:
+        run_on_server(args)
+        return
+
     output_dir = Path(args.output_dir)
     output_dir.mkdir(parents=True, exist_ok=True)
 
@@ -111,11 +372,16 @@ def main():
     print("=" * 60)
     print()
 
+    # Decides per stage which components stay on the GPU, so SDXL and SVD
+    # never have to fit on the card at the same time
+    scheduler = StageMemoryScheduler(device=args.device, budget_gb=args.vram_budget_gb)
+    step_metrics = build_step_metrics(args.device, args.metrics_jsonl, args.metrics_prom, args.usage_log)
+
     # Step 1: Generate or load image
     if args.skip_image:
         print("Step 1: Using existing image")
         print(f"Image: {args.skip_image}")
-        image_path = args.skip_image
+        image = image_path = args.skip_image
         if not os.path.exists(image_path):
             print(f"Error: Image not found: {image_path}")
             sys.exit(1)
@@ -128,13 +394,16 @@ def main():
             model_id="stabilityai/stable-diffusion-xl-base-1.0",
             device=args.device,
             dtype="float16",
-            output_dir=args.output_dir
+            output_dir=args.output_dir,
+            step_metrics=step_metrics,
+            memory_scheduler=scheduler,
+            compile_models=args.compile
         )
 
-        # Load LoRAs
+        # Load LoRAs (--lora-scale is applied at generation time)
         for lora_path in args.lora:
             if os.path.exists(lora_path):
-                img_generator.load_lora(lora_path, weight=args.lora_scale)
+                img_generator.load_lora(lora_path)
             else:
                 print(f"Warning: LoRA not found: {lora_path}")
 
@@ -152,30 +421,35 @@ def main():
             save_metadata=True
         )
 
-        # Get the path of generated image
-        # Find the most recent image in output directory
-        image_files = sorted(output_dir.glob("generated_*.png"), key=os.path.getmtime)
-        if not image_files:
+        if not images:
             print("Error: Image generation failed")
             sys.exit(1)
-        image_path = str(image_files[-1])
-        print(f"\n✓ Image generated: {image_path}")
+        # Hand the image to SVD in memory; the PNG is still being written
+        # by the background writer and its path is only needed for metadata
+        image = images[0]
+        image_path = images.futures[0]
+        print(f"\n✓ Image generated (seed: {images.seeds[0]})")
 
     print()
     print("Step 2: Generating video from image")
     print("-" * 60)
 
-    # Create video generator
+    # Create video generator (imported here so runs that stop earlier never import it)
+    from generate_video import VideoGenerator
     vid_generator = VideoGenerator(
         model_id="stabilityai/stable-video-diffusion-img2vid-xt",
         device=args.device,
         dtype="float16",
-        output_dir=args.output_dir
+        output_dir=args.output_dir,
+        memory_scheduler=scheduler,
+        step_metrics=step_metrics,
+        compile_models=args.compile
     )
 
-    # Generate video
+    # Generate video (parks SDXL in host memory first)
     video_path = vid_generator.generate_video(
-        image_path=image_path,
+        image=image,
+        input_image_path=image_path,
         num_frames=args.num_frames,
         fps=args.fps,
         motion_bucket_id=args.motion,
@@ -185,6 +459,14 @@ def main():
         save_metadata=True
     )
 
+    if not args.skip_image:
+        image_path = images.paths[0]
+        scheduler.release_stage("image")
+        img_generator.close()
+    if step_metrics is not None:
+        step_metrics.close()
+    scheduler.print_report()
+
     print()
     print("=" * 60)
     print("✓ Workflow Complete!")